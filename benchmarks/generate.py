@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Synthetic history.db generator.
+
+    Builds a history database at the plugin's latest schema version from generated tasks. The tasks
+    are spread over a number of years with the ids in finish time order, as they are when recorded
+    by Unmanic. The sizes follow the shape of a typical media library:
+        - Source sizes are log-normal around 1.5 GB, clamped to 5 MB - 80 GB.
+        - Most conversions shrink the file to 25-100% of the source, a few grow it slightly.
+        - Some tasks also write a small second destination, like an extracted subtitle.
+        - A few tasks failed and only have a source probe.
+
+    Usage:
+        FILE_SIZE_METRICS_PROFILE=/tmp/fsm python3 benchmarks/generate.py --tasks 1000000
+
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+# Tasks written per transaction
+GENERATE_CHUNK_SIZE = 50000
+
+SOURCE_SIZE_MEDIAN = 1536 * 1024 * 1024
+SOURCE_SIZE_SIGMA = 0.9
+SOURCE_SIZE_LIMITS = (5 * 1024 * 1024, 80 * 1024 * 1024 * 1024)
+DURATION_MEDIAN = 900
+DURATION_SIGMA = 0.8
+FAILED_RATIO = 0.03
+EXTRA_DESTINATION_RATIO = 0.05
+EPISODE_RATIO = 0.6
+
+SOURCE_EXTENSIONS = (("mkv", 60), ("mp4", 28), ("avi", 5), ("m4v", 4), ("ts", 3))
+DESTINATION_EXTENSIONS = (("mkv", 70), ("mp4", 30))
+LIBRARIES = ("/library/movies", "/library/tv", "/library/anime", "/library/documentaries")
+WORDS = (
+    "the", "night", "river", "silent", "city", "last", "house", "dark", "king", "summer", "garden", "storm",
+    "blue", "winter", "road", "island", "stone", "ghost", "glass", "harbor", "mountain", "black", "red",
+    "forest", "secret", "little", "golden", "broken", "empire", "shadow", "station", "midnight", "wild",
+    "north", "machine", "paper", "fire", "iron", "lost", "star", "ocean", "silver", "distant", "hollow",
+    "crown", "signal", "orchard", "falcon", "lantern", "meridian", "quarry", "velvet", "zephyr", "kestrel",
+)
+
+
+def _weighted(choices, rng):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights)[0]
+
+
+def _title(rng, words):
+    # Zipf weighted, so that a few words are very common and most are rare
+    count = rng.randint(1, 4)
+    return " ".join(rng.choices(WORDS, weights=words, k=count)).title()
+
+
+def synthetic_tasks(task_count, seed=1, end_time=None, years=3):
+    """
+    Yield task_count generated tasks in finish time order.
+    Each task is a tuple of (task_label, library_id, task_success, start_time, finish_time, source, destinations),
+    where source is an (abspath, size) tuple and destinations is a list of them.
+
+    :param task_count:
+    :param seed:
+    :param end_time:
+    :param years:
+    :return:
+    """
+    rng = random.Random(seed)
+    end_time = int(end_time or time.time())
+    span = years * 365 * 86400
+    first_finish_time = end_time - span
+    word_weights = [1.0 / (rank + 1) for rank in range(len(WORDS))]
+    shows = ["{} {}".format(_title(rng, word_weights), rng.randint(1, 9)) for _ in range(2000)]
+    size_mu = math.log(SOURCE_SIZE_MEDIAN)
+    duration_mu = math.log(DURATION_MEDIAN)
+    step = span / max(task_count, 1)
+    for index in range(task_count):
+        finish_time = int(first_finish_time + index * step)
+        duration = int(rng.lognormvariate(duration_mu, DURATION_SIGMA))
+        start_time = finish_time - duration
+
+        library = rng.choice(LIBRARIES)
+        library_id = LIBRARIES.index(library) + 1
+        if rng.random() < EPISODE_RATIO:
+            show = rng.choice(shows)
+            season = rng.randint(1, 12)
+            stem = "{} - S{:02d}E{:02d}".format(show, season, rng.randint(1, 24))
+            directory = "{}/{}/Season {:02d}".format(library, show, season)
+        else:
+            stem = "{} ({})".format(_title(rng, word_weights), rng.randint(1950, 2025))
+            directory = "{}/{}".format(library, stem)
+
+        source_size = int(rng.lognormvariate(size_mu, SOURCE_SIZE_SIGMA))
+        source_size = min(max(source_size, SOURCE_SIZE_LIMITS[0]), SOURCE_SIZE_LIMITS[1])
+        source_abspath = "{}/{}.{}".format(directory, stem, _weighted(SOURCE_EXTENSIONS, rng))
+        source = (source_abspath, source_size)
+
+        if rng.random() < FAILED_RATIO:
+            yield os.path.basename(source_abspath), library_id, False, start_time, finish_time, source, []
+            continue
+
+        ratio = 0.25 + rng.betavariate(4, 3) * 0.8
+        destinations = [
+            ("{}/{}.{}".format(directory, stem, _weighted(DESTINATION_EXTENSIONS, rng)), int(source_size * ratio)),
+        ]
+        if rng.random() < EXTRA_DESTINATION_RATIO:
+            destinations.append(("{}/{}.en.srt".format(directory, stem), rng.randint(20000, 200000)))
+        yield os.path.basename(source_abspath), library_id, True, start_time, finish_time, source, destinations
+
+
+def generate_history(plugin, task_count, seed=1, end_time=None, report_progress=None):
+    """
+    Fill the plugin's history database with task_count synthetic tasks.
+    The database must be empty. The schema is created through the plugin's own migrator and the totals,
+    rollups, histograms, breakdowns and search index are built with the same functions that the migrations use.
+
+    :param plugin:
+    :param task_count:
+    :param seed:
+    :param end_time:
+    :param report_progress:
+    :return:
+    """
+    plugin.SchemaMigrator.ready(wait=True)
+    db = plugin.db
+    db.connect(reuse_if_open=True)
+    try:
+        if db.execute_sql('SELECT COUNT(*) FROM "historictasks"').fetchone()[0]:
+            raise RuntimeError("The history database at {} is not empty".format(plugin.db_file))
+
+        tasks = synthetic_tasks(task_count, seed=seed, end_time=end_time)
+        task_id = 0
+        while task_id < task_count:
+            task_rows = []
+            probe_rows = []
+            first_task_id = task_id
+            for task_label, library_id, task_success, start_time, finish_time, source, destinations in tasks:
+                task_id += 1
+                destination_size = sum(size for _abspath, size in destinations)
+                extension = plugin.get_file_extension(source[0])
+                throughput = plugin.get_throughput(source[1], finish_time - start_time) if task_success else None
+                task_rows.append(
+                    (
+                        task_id, task_label, task_success, start_time, finish_time, destination_size, library_id,
+                        extension, throughput,
+                    )
+                )
+                for probe_type, probes in (("source", [source]), ("destination", destinations)):
+                    for abspath, size in probes:
+                        probe_rows.append((task_id, probe_type, abspath, os.path.basename(abspath), size))
+                if len(task_rows) >= GENERATE_CHUNK_SIZE:
+                    break
+            with db.atomic():
+                cursor = db.cursor()
+                cursor.executemany(
+                    'INSERT INTO "historictasks" '
+                    '("id", "task_label", "task_success", "start_time", "finish_time", "destination_size", '
+                    '"library_id", "extension", "throughput") '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    task_rows,
+                )
+                cursor.executemany(
+                    'INSERT INTO "historictaskprobe" ("historictask_id", "type", "abspath", "basename", "size") '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    probe_rows,
+                )
+                if plugin.SchemaMigrator.search_index_available:
+                    plugin._index_tasks_for_search('t."id" > ? AND t."id" <= ?', (first_task_id, task_id))
+            if report_progress is not None:
+                report_progress(task_id, task_count)
+
+        with db.atomic():
+            plugin._rebuild_rollups()
+            plugin._rebuild_distributions()
+            plugin._rebuild_breakdowns()
+            plugin._store_totals(plugin._compute_totals())
+        db.execute_sql("PRAGMA optimize")
+        # Leave everything in the main database file so that it can be copied on its own
+        db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic file size metrics history.db")
+    parser.add_argument("--tasks", type=int, required=True, help="Number of tasks to generate")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import stand_ins
+    stand_ins.install()
+    import plugin
+
+    started = time.monotonic()
+
+    def report_progress(done, total):
+        print("Generated {} of {} tasks".format(done, total), file=sys.stderr)
+
+    generate_history(plugin, args.tasks, seed=args.seed, report_progress=report_progress)
+    print(
+        "Wrote {} tasks to {} in {:.1f} seconds".format(args.tasks, plugin.db_file, time.monotonic() - started),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Benchmark suite for the file size metrics plugin.
+
+    For each database size a synthetic history.db is generated (see generate.py) and every panel
+    endpoint and the task results runner are timed against it. Each size runs in its own process,
+    so that every run starts with a cold connection pool and page cache, just like a restarted
+    Unmanic. The plugin is loaded with the stand-ins from stand_ins.py, no Unmanic install is needed.
+
+    The results are written as JSON. Two result files can be compared with --compare.
+
+    Usage:
+        python3 benchmarks/run.py --sizes 10000,1000000 --output results.json
+        python3 benchmarks/run.py --compare baseline.json results.json
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+import stand_ins
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIRECTORY = os.path.dirname(BENCHMARKS_DIRECTORY)
+RESULTS_FORMAT = 1
+DEFAULT_SIZES = (10000, 1000000, 10000000)
+# Records in the data log that is imported by run_import
+IMPORT_LOG_RECORDS = 5000
+
+
+def _summarise(durations, response_bytes):
+    durations = sorted(durations)
+    return {
+        "runs":           len(durations),
+        "min_ms":         round(durations[0] * 1000, 3),
+        "median_ms":      round(statistics.median(durations) * 1000, 3),
+        "mean_ms":        round(statistics.mean(durations) * 1000, 3),
+        "p95_ms":         round(durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000, 3),
+        "max_ms":         round(durations[-1] * 1000, 3),
+        "response_bytes": response_bytes,
+    }
+
+
+class Worker(object):
+    """
+    Worker
+
+    Runs the benchmarks for a single database size inside the current process.
+    """
+
+    def __init__(self, plugin, repeat):
+        self.plugin = plugin
+        self.repeat = repeat
+        self.results = {}
+
+    def panel(self, path, arguments=None):
+        data = {"path": path, "arguments": arguments or {}}
+        self.plugin.render_frontend_panel(data)
+        return data.get("content") or ""
+
+    def clear_response_cache(self):
+        # Releases before the response cache was added do not have it
+        response_cache = getattr(self.plugin, "ResponseCache", None)
+        if response_cache is not None:
+            response_cache.clear()
+
+    def time_calls(self, name, call, repeat=None, warmup=1, cached=False):
+        """
+        Time repeated calls. Unless cached is True, the response cache is cleared before each call so that
+        every call does the full work.
+
+        :param name:
+        :param call:
+        :param repeat:
+        :param warmup:
+        :param cached:
+        :return:
+        """
+        for _ in range(warmup):
+            call()
+        durations = []
+        response = ""
+        for _ in range(repeat or self.repeat):
+            if not cached:
+                self.clear_response_cache()
+            started = time.perf_counter()
+            response = call()
+            durations.append(time.perf_counter() - started)
+        self.results[name] = _summarise(durations, len(response or ""))
+        return response
+
+    def list_request(self, start=0, search="", column=2, direction="desc", cursor=None, version=None):
+        request = {
+            "draw":    1,
+            "start":   start,
+            "length":  15,
+            "search":  {"value": search},
+            "order":   [{"column": column, "dir": direction}],
+            "columns": [{"name": "basename"}, {"name": "start_time"}, {"name": "finish_time"}],
+        }
+        if cursor:
+            request["cursor"] = cursor
+            request["cursorDirection"] = "next"
+        if version is not None:
+            request["version"] = version
+        return lambda: self.panel("list", {"data": [json.dumps(request).encode("utf-8")]})
+
+    def run_list(self, task_count):
+        for label, fraction in (("first", 0), ("1%", 0.01), ("50%", 0.5), ("99%", 0.99)):
+            start = int(task_count * fraction) // 15 * 15
+            self.time_calls("list offset {}".format(label), self.list_request(start=start))
+        self.time_calls(
+            "list offset 50% by name",
+            self.list_request(start=task_count // 30 * 15, column=0, direction="asc"),
+        )
+
+        first_page = json.loads(self.list_request()())
+        self.time_calls("list next page cursor", self.list_request(start=15, cursor=first_page.get("nextCursor")))
+        self.time_calls("list cached", self.list_request(), cached=True)
+        if first_page.get("version") is not None:
+            self.time_calls("list not modified", self.list_request(version=first_page["version"]), cached=True)
+
+        for label, search in (
+                ("common word", "night"),
+                ("rare word", "kestrel zephyr"),
+                ("episode", "S03E07"),
+                ("prefix", "merid"),
+                ("no match", "qqqqqq"),
+        ):
+            self.time_calls("list search {}".format(label), self.list_request(search=search))
+
+    def run_details(self):
+        self.plugin.db.connect(reuse_if_open=True)
+        try:
+            probe_ids = [
+                row[0] for row in self.plugin.db.execute_sql(
+                    'SELECT "id" FROM "historictaskprobe" WHERE "type" = \'destination\' '
+                    'ORDER BY random() LIMIT ?',
+                    (self.repeat + 1,),
+                )
+            ]
+        finally:
+            self.plugin.db.close()
+        if not probe_ids:
+            return
+        probe_ids = iter(probe_ids * 2)
+        self.time_calls(
+            "conversionDetails",
+            lambda: self.panel("conversionDetails", {"task_id": [str(next(probe_ids)).encode("utf-8")]}),
+        )
+
+    def run_aggregates(self):
+        self.time_calls("totalSizeChange", lambda: self.panel("totalSizeChange"))
+        self.time_calls("timeseries day", lambda: self.panel("timeseries", {"bucket": [b"day"]}))
+        self.time_calls("timeseries hour", lambda: self.panel("timeseries", {"bucket": [b"hour"]}))
+        self.time_calls("distribution", lambda: self.panel("distribution"))
+        self.time_calls("breakdown", lambda: self.panel("breakdown"))
+        self.time_calls("throughput day", lambda: self.panel("throughput", {"bucket": [b"day"]}))
+        self.time_calls("verifyTotals", lambda: self.panel("verifyTotals", {"verify_only": [b"true"]}), repeat=3)
+        month_ago = str(int(time.time()) - 30 * 86400).encode("utf-8")
+        self.time_calls(
+            "export ndjson last 30 days",
+            lambda: self.panel("export", {"format": [b"ndjson"], "from": [month_ago]}),
+            repeat=3,
+        )
+
+    def run_writes(self, work_directory, count):
+        """
+        Record count task results through the runners, as Unmanic calls them at the end of a task.
+        The files are sparse, so they have realistic sizes without using the disk space.
+
+        :param work_directory:
+        :param count:
+        :return:
+        """
+        media_directory = os.path.join(work_directory, "media")
+        os.makedirs(media_directory, exist_ok=True)
+        rng = random.Random(1)
+        durations = []
+        for index in range(count + 1):
+            source = os.path.join(media_directory, "Benchmark Task {} (2024).mkv".format(index))
+            destination = os.path.join(media_directory, "Benchmark Task {} (2024).mp4".format(index))
+            source_size = rng.randint(500, 4000) * 1024 * 1024
+            for path, size in ((source, source_size), (destination, int(source_size * 0.6))):
+                with open(path, "wb") as f:
+                    f.truncate(size)
+            task_data = {"library_id": 1, "task_id": index, "task_type": "local", "source_data": {"abspath": source}}
+            self.plugin.emit_task_scheduled(task_data, task_data_store=stand_ins.TaskDataStore)
+            finish_time = time.time()
+            task_data.update(
+                {
+                    "task_processing_success":     True,
+                    "file_move_processes_success": True,
+                    "destination_files":           [destination],
+                    "start_time":                  finish_time - 600,
+                    "finish_time":                 finish_time,
+                }
+            )
+            started = time.perf_counter()
+            self.plugin.on_postprocessor_task_results(task_data, task_data_store=stand_ins.TaskDataStore)
+            if index:
+                # The first call opens the connection
+                durations.append(time.perf_counter() - started)
+        if self.plugin.ResultWriter.is_enabled():
+            started = time.perf_counter()
+            self.plugin.ResultWriter.flush()
+            self.results["on_postprocessor_task_results flush"] = _summarise([time.perf_counter() - started], 0)
+        self.results["on_postprocessor_task_results"] = _summarise(durations, 0)
+        shutil.rmtree(media_directory, ignore_errors=True)
+
+    def run_import(self, work_directory, count):
+        """
+        Import a data log of count records, then import it again. The second import must skip every record.
+
+        :param work_directory:
+        :param count:
+        :return:
+        """
+        log_path = os.path.join(work_directory, "import-data.log")
+        with open(log_path, "w", encoding="utf-8") as f:
+            for task_id, task in enumerate(generate.synthetic_tasks(count, seed=2, years=1)):
+                _task_label, library_id, task_success, start_time, finish_time, source, destinations = task
+                if not task_success:
+                    continue
+                record = {
+                    "source_abspath":    source[0],
+                    "source_size":       source[1],
+                    "dest_abspath":      destinations[0][0],
+                    "dest_size":         destinations[0][1],
+                    "destination_files": [{"abspath": abspath, "size": size} for abspath, size in destinations],
+                    "start_time":        start_time,
+                    "finish_time":       finish_time,
+                    "data_search_key":   "{} | {} | {}".format(task_id, library_id, source[0]),
+                }
+                f.write("file_size_metrics {}\n".format(json.dumps(record)))
+
+        data_handler = self.plugin.Data()
+        for name in ("import data log", "import data log again"):
+            started = time.perf_counter()
+            counts = data_handler.import_task_results(self.plugin.iter_data_log_results([log_path]))
+            self.results[name] = _summarise([time.perf_counter() - started], 0)
+        os.remove(log_path)
+        if counts["imported"] or counts["skipped"] != counts["read"]:
+            raise RuntimeError("Importing the same data log again recorded its tasks twice: {}".format(counts))
+
+    def run_reset(self):
+        self.time_calls("resetMetrics", lambda: self.panel("resetMetrics"), repeat=1, warmup=0)
+
+
+def _cached_database_path(work_directory, task_count, seed):
+    return os.path.join(work_directory, "history-{}-seed{}.db".format(task_count, seed))
+
+
+def generate_database(work_directory, task_count, seed):
+    """
+    Generate the history.db for task_count tasks in a separate process, unless it already exists.
+    Returns the number of seconds it took, or None if an existing database was reused.
+
+    :param work_directory:
+    :param task_count:
+    :param seed:
+    :return:
+    """
+    cached_database = _cached_database_path(work_directory, task_count, seed)
+    if os.path.exists(cached_database):
+        return None
+    started = time.monotonic()
+    generate_directory = os.path.join(work_directory, "generate-{}".format(task_count))
+    shutil.rmtree(generate_directory, ignore_errors=True)
+    environment = dict(os.environ, **{stand_ins.PROFILE_ENV: generate_directory})
+    command = [
+        sys.executable, os.path.join(BENCHMARKS_DIRECTORY, "generate.py"),
+        "--tasks", str(task_count),
+        "--seed", str(seed),
+    ]
+    subprocess.run(command, check=True, env=environment)
+    os.replace(os.path.join(generate_directory, "history.db"), cached_database)
+    shutil.rmtree(generate_directory, ignore_errors=True)
+    return round(time.monotonic() - started, 3)
+
+
+def run_worker(args):
+    """
+    Benchmark a copy of a generated database. Prints the results as JSON.
+
+    :param args:
+    :return:
+    """
+    profile_directory = os.path.join(args.work_directory, "profile-{}".format(args.tasks))
+    shutil.rmtree(profile_directory, ignore_errors=True)
+    os.makedirs(profile_directory)
+    shutil.copyfile(
+        _cached_database_path(args.work_directory, args.tasks, args.seed),
+        os.path.join(profile_directory, "history.db"),
+    )
+
+    os.environ[stand_ins.PROFILE_ENV] = profile_directory
+    if args.settings:
+        os.environ[stand_ins.SETTINGS_ENV] = args.settings
+    stand_ins.install()
+    sys.path.insert(0, PLUGIN_DIRECTORY)
+    import plugin
+
+    result = {"tasks": args.tasks, "database_bytes": os.path.getsize(plugin.db_file)}
+
+    # Time the first request of the process, including the schema check and opening the pool
+    started = time.perf_counter()
+    plugin.SchemaMigrator.ready(wait=True)
+    result["schema_ready_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    worker = Worker(plugin, args.repeat)
+    worker.time_calls("list first request", worker.list_request(), repeat=1, warmup=0)
+    worker.run_list(args.tasks)
+    worker.run_details()
+    worker.run_aggregates()
+    worker.run_writes(profile_directory, args.writes)
+    worker.run_import(profile_directory, IMPORT_LOG_RECORDS)
+    worker.run_reset()
+    plugin.ResultWriter.stop()
+    result["benchmarks"] = worker.results
+    shutil.rmtree(profile_directory, ignore_errors=True)
+    json.dump(result, sys.stdout)
+
+
+def _environment():
+    environment = {
+        "python":   platform.python_version(),
+        "platform": platform.platform(),
+        "sqlite":   sqlite3.sqlite_version,
+        "peewee":   None,
+    }
+    try:
+        import peewee
+        environment["peewee"] = peewee.__version__
+    except ImportError:
+        pass
+    return environment
+
+
+def _plugin_version():
+    with open(os.path.join(PLUGIN_DIRECTORY, "info.json")) as f:
+        return json.load(f).get("version")
+
+
+def run_suite(args):
+    work_directory = args.work_directory or tempfile.mkdtemp(prefix="file_size_metrics_benchmark_")
+    os.makedirs(work_directory, exist_ok=True)
+    results = {
+        "format":      RESULTS_FORMAT,
+        "plugin":      {"version": _plugin_version()},
+        "environment": _environment(),
+        "started_at":  time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "seed":        args.seed,
+        "settings":    json.loads(args.settings or "{}"),
+        "sizes":       [],
+    }
+    try:
+        for task_count in args.sizes:
+            print("Generating {} tasks".format(task_count), file=sys.stderr)
+            generate_seconds = generate_database(work_directory, task_count, args.seed)
+            print("Benchmarking {} tasks".format(task_count), file=sys.stderr)
+            command = [
+                sys.executable, os.path.abspath(__file__), "--worker",
+                "--tasks", str(task_count),
+                "--seed", str(args.seed),
+                "--repeat", str(args.repeat),
+                "--writes", str(args.writes),
+                "--work-directory", work_directory,
+            ]
+            if args.settings:
+                command += ["--settings", args.settings]
+            output = subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout
+            size_results = json.loads(output)
+            size_results["generate_seconds"] = generate_seconds
+            results["sizes"].append(size_results)
+            if not args.keep:
+                os.remove(_cached_database_path(work_directory, task_count, args.seed))
+    finally:
+        if not args.keep and not args.work_directory:
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+    content = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(content + "\n")
+    else:
+        print(content)
+
+
+def compare(baseline_path, results_path):
+    """
+    Print the median of every benchmark in two result files and the change between them.
+
+    :param baseline_path:
+    :param results_path:
+    :return:
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(results_path) as f:
+        results = json.load(f)
+    baseline_sizes = {size["tasks"]: size for size in baseline.get("sizes", [])}
+    print("{:>10}  {:<40} {:>12} {:>12} {:>8}".format("tasks", "benchmark", "baseline ms", "ms", "change"))
+    for size in results.get("sizes", []):
+        baseline_benchmarks = baseline_sizes.get(size["tasks"], {}).get("benchmarks", {})
+        for name, benchmark in size.get("benchmarks", {}).items():
+            before = baseline_benchmarks.get(name, {}).get("median_ms")
+            after = benchmark["median_ms"]
+            change = "{:+.0%}".format((after - before) / before) if before else "-"
+            print(
+                "{:>10}  {:<40} {:>12} {:>12} {:>8}".format(
+                    size["tasks"], name, "-" if before is None else before, after, change
+                )
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the file size metrics plugin")
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        type=lambda value: [int(size) for size in value.split(",") if size],
+        help="Comma separated numbers of tasks to benchmark (default: %(default)s)",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the generated history")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls of each endpoint")
+    parser.add_argument("--writes", type=int, default=200, help="Task results recorded through the runners")
+    parser.add_argument("--settings", help="JSON object of plugin setting overrides")
+    parser.add_argument("--work-directory", help="Directory for the generated databases (default: a temp directory)")
+    parser.add_argument("--keep", action="store_true", help="Keep generated databases and reuse them in later runs")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "RESULTS"), help="Compare two result files")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--tasks", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.worker:
+        run_worker(args)
+    else:
+        run_suite(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Local stand-ins for the parts of unmanic.libs that plugin.py imports.
+
+    They let the benchmarks load the plugin without an Unmanic installation:
+        - The profile directory is read from the FILE_SIZE_METRICS_PROFILE environment variable.
+        - Setting overrides are read as a JSON object from FILE_SIZE_METRICS_SETTINGS.
+        - There is a single library with this plugin enabled.
+        - Data log records are counted and then discarded.
+
+"""
+
+import json
+import logging
+import os
+import sys
+import types
+
+PROFILE_ENV = "FILE_SIZE_METRICS_PROFILE"
+SETTINGS_ENV = "FILE_SIZE_METRICS_SETTINGS"
+PACKAGES = ("unmanic", "unmanic.libs", "unmanic.libs.unplugins")
+
+
+class UnmanicLogging(object):
+    data_records = 0
+
+    @staticmethod
+    def get_logger(name=None):
+        return logging.getLogger(name)
+
+    @classmethod
+    def data(cls, data_type, **kwargs):
+        cls.data_records += 1
+
+
+class Library(object):
+    def __init__(self, library_id):
+        self.id = library_id
+
+    @staticmethod
+    def get_all_libraries():
+        return [{"id": 1, "name": "Benchmark"}]
+
+    def get_enabled_plugins(self):
+        return [{"plugin_id": "file_size_metrics"}]
+
+
+class TaskDataStore(object):
+    _runner_values = {}
+
+    @classmethod
+    def set_runner_value(cls, key, value):
+        cls._runner_values[key] = value
+
+    @classmethod
+    def get_runner_value(cls, key, default=None, runner=None):
+        return cls._runner_values.get(key, default)
+
+
+class PluginSettings(object):
+    settings = {}
+
+    def __init__(self, *args, **kwargs):
+        overrides = json.loads(os.environ.get(SETTINGS_ENV) or "{}")
+        self.settings = dict(self.settings, **overrides)
+
+    def get_profile_directory(self):
+        profile_directory = os.environ.get(PROFILE_ENV)
+        if not profile_directory:
+            raise RuntimeError("Set {} to the directory that holds history.db".format(PROFILE_ENV))
+        os.makedirs(profile_directory, exist_ok=True)
+        return profile_directory
+
+    def get_setting(self, key=None):
+        if key is None:
+            return dict(self.settings)
+        return self.settings.get(key)
+
+    def get_form_settings(self):
+        return getattr(self, "form_settings", {})
+
+
+def install():
+    """
+    Register the stand-ins as the unmanic.libs modules.
+    Must be called before plugin.py is imported.
+
+    :return:
+    """
+    members = {
+        "unmanic":                         {},
+        "unmanic.libs":                    {},
+        "unmanic.libs.logs":               {"UnmanicLogging": UnmanicLogging},
+        "unmanic.libs.library":            {"Library": Library},
+        "unmanic.libs.task":               {"TaskDataStore": TaskDataStore},
+        "unmanic.libs.unplugins":          {},
+        "unmanic.libs.unplugins.settings": {"PluginSettings": PluginSettings},
+    }
+    for name, attributes in members.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        if name in PACKAGES:
+            module.__path__ = []
+        sys.modules[name] = module
+        parent, _, child = name.rpartition(".")
+        if parent:
+            setattr(sys.modules[parent], child, module)
@@ -20,22 +20,48 @@
 
 """
 
+import atexit
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import functools
+import glob
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
 import json
+import math
 import os
-import uuid
+import queue
+import re
+import shutil
+import sqlite3
+import threading
+import time
 import datetime
-from operator import attrgetter
+import urllib.request
 
 from peewee import (
+    EXCLUDED,
+    BigIntegerField,
     BooleanField,
-    DateTimeField,
+    CompositeKey,
+    DatabaseProxy,
     ForeignKeyField,
+    IntegerField,
     Model,
     OperationalError,
-    SqliteDatabase,
     TextField,
+    Tuple,
+    fn,
 )
+from playhouse.pool import PooledSqliteDatabase
 from playhouse.shortcuts import model_to_dict
+from playhouse.sqlite_ext import FTS5Model, RowIDField, SearchField
 from unmanic.libs.logs import UnmanicLogging
 from unmanic.libs.library import Library
 from unmanic.libs.task import TaskDataStore
@@ -99,20 +125,465 @@ def get_unix_timestamp(value):
     return None
 
 
+def get_epoch_seconds(value):
+    timestamp = get_unix_timestamp(value)
+    if timestamp is None:
+        return None
+    return int(timestamp)
+
+
 class Settings(PluginSettings):
-    settings = {}
+    settings = {
+        "write_behind_enabled":  False,
+        "write_batch_size":      100,
+        "write_batch_interval":  2,
+        "write_queue_size":      1000,
+        "write_durability":      "committed",
+        "retention_days":        0,
+        "partition_months":      0,
+        "slow_query_ms":         500,
+    }
+
+    def __init__(self, *args, **kwargs):
+        super(Settings, self).__init__(*args, **kwargs)
+        self.form_settings = {
+            "write_behind_enabled": {
+                "label":       "Record task results from a background writer in batches",
+                "description": "Groups results from many workers into one database transaction. "
+                               "Changes to the writer settings apply after Unmanic is restarted.",
+            },
+            "write_batch_size":     self.__set_write_behind_form_settings(
+                {
+                    "label":          "Maximum task results written per batch",
+                    "input_type":     "slider",
+                    "slider_options": {
+                        "min": 1,
+                        "max": 1000,
+                    },
+                }
+            ),
+            "write_batch_interval": self.__set_write_behind_form_settings(
+                {
+                    "label":          "Maximum time to wait for a batch to fill",
+                    "input_type":     "slider",
+                    "slider_options": {
+                        "min":    1,
+                        "max":    60,
+                        "suffix": "s",
+                    },
+                }
+            ),
+            "write_queue_size":     self.__set_write_behind_form_settings(
+                {
+                    "label":          "Maximum task results waiting to be written (extra results are dropped)",
+                    "input_type":     "slider",
+                    "slider_options": {
+                        "min":  100,
+                        "max":  10000,
+                        "step": 100,
+                    },
+                }
+            ),
+            "write_durability":     self.__set_write_behind_form_settings(
+                {
+                    "label":          "Write durability",
+                    "input_type":     "select",
+                    "select_options": [
+                        {
+                            "value": "committed",
+                            "label": "Committed - workers wait until their batch has been saved",
+                        },
+                        {
+                            "value": "queued",
+                            "label": "Queued - workers continue immediately, queued results are lost on a crash",
+                        },
+                    ],
+                }
+            ),
+        }
+
+        self.form_settings["retention_days"] = {
+            "label":          "Days to keep individual task records (0 keeps them forever). Older records are "
+                              "removed, but still counted in the totals and daily charts.",
+            "input_type":     "slider",
+            "slider_options": {
+                "min":    0,
+                "max":    3650,
+                "suffix": " days",
+            },
+        }
+        self.form_settings["partition_months"] = {
+            "label":          "Months of task records to keep in the main history database (0 keeps them all there). "
+                              "Records from older months are moved to one read-only file per month.",
+            "input_type":     "slider",
+            "slider_options": {
+                "min":    0,
+                "max":    120,
+                "suffix": " months",
+            },
+        }
+        self.form_settings["slow_query_ms"] = {
+            "label":          "Log database queries slower than this, with their query plan (0 disables the log)",
+            "input_type":     "slider",
+            "slider_options": {
+                "min":    0,
+                "max":    10000,
+                "step":   50,
+                "suffix": " ms",
+            },
+        }
+
+    def __set_write_behind_form_settings(self, form_setting):
+        if not self.get_setting("write_behind_enabled"):
+            form_setting["display"] = "hidden"
+        return form_setting
+
+
+class LatencyHistogram(object):
+    """
+    LatencyHistogram
+
+    Counts durations in fixed buckets. Percentiles are reported as the upper bound of the bucket they fall
+    in, which is close enough to tell a 5 ms request from a 500 ms one without keeping every sample.
+    """
+
+    # Bucket upper bounds in milliseconds. Anything slower goes in a final overflow bucket.
+    bounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, milliseconds):
+        index = 0
+        while index < len(self.bounds) and milliseconds > self.bounds[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                if index < len(self.bounds):
+                    return min(self.bounds[index], round(self.max, 3))
+                return round(self.max, 3)
+        return round(self.max, 3)
+
+    def summary(self):
+        return {
+            "count":   self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0,
+            "p50_ms":  self.percentile(50),
+            "p95_ms":  self.percentile(95),
+            "p99_ms":  self.percentile(99),
+            "max_ms":  round(self.max, 3),
+        }
+
+
+class Instrumentation(object):
+    """
+    Instrumentation
+
+    Process-wide timings of the panel endpoints, runners and background writer.
+    Each measured operation records its duration, the number of database queries it ran and the time
+    spent in each stage: "sql" for the queries, nested operations like "library_assignment", and any
+    stages that the code marks itself, like "json". The summary is served at /stats and written to the data log every
+    log_interval seconds. Queries slower than the slow_query_ms setting are logged with their query plan.
+    """
+
+    log_interval = 600
+    settings_ttl = 60
+
+    _lock = threading.Lock()
+    _local = threading.local()
+    _started_at = time.time()
+    _operations = {}
+    _queries = LatencyHistogram()
+    _slow_queries = collections.deque(maxlen=20)
+    _next_log_at = time.monotonic() + log_interval
+    _slow_query_ms = None
+    _settings_expire_at = 0.0
+
+    @classmethod
+    def _frames(cls):
+        frames = getattr(cls._local, "frames", None)
+        if frames is None:
+            frames = cls._local.frames = []
+        return frames
+
+    @classmethod
+    @contextlib.contextmanager
+    def measure(cls, name):
+        """
+        Time the operation run inside the context. Operations can be nested. The queries and stages of an
+        inner operation are also counted for the outer one, and its duration is added as a stage.
+
+        :param name:
+        :return:
+        """
+        frames = cls._frames()
+        frame = {"queries": 0, "stages": {}}
+        frames.append(frame)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            milliseconds = (time.perf_counter() - started) * 1000
+            frames.pop()
+            # The outer operations see this one as a stage
+            cls._add_stage(name, milliseconds)
+            cls._record(name, milliseconds, frame)
+
+    @classmethod
+    def measured(cls, name):
+        """
+        Decorator that measures every call of a function as the operation name.
+
+        :param name:
+        :return:
+        """
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with cls.measure(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    @classmethod
+    @contextlib.contextmanager
+    def stage(cls, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls._add_stage(name, (time.perf_counter() - started) * 1000)
+
+    @classmethod
+    def _add_stage(cls, name, milliseconds, queries=0):
+        for frame in cls._frames():
+            frame["queries"] += queries
+            frame["stages"][name] = frame["stages"].get(name, 0.0) + milliseconds
+
+    @classmethod
+    def _record(cls, name, milliseconds, frame):
+        with cls._lock:
+            operation = cls._operations.get(name)
+            if operation is None:
+                operation = cls._operations[name] = {
+                    "latency":     LatencyHistogram(),
+                    "queries":     0,
+                    "max_queries": 0,
+                    "stages_ms":   {},
+                }
+            operation["latency"].add(milliseconds)
+            operation["queries"] += frame["queries"]
+            operation["max_queries"] = max(operation["max_queries"], frame["queries"])
+            for stage_name, stage_milliseconds in frame["stages"].items():
+                operation["stages_ms"][stage_name] = operation["stages_ms"].get(stage_name, 0.0) + stage_milliseconds
+            log_now = time.monotonic() >= cls._next_log_at
+            if log_now:
+                cls._next_log_at = time.monotonic() + cls.log_interval
+        if log_now:
+            UnmanicLogging.data("file_size_metrics_stats", data_search_key="file_size_metrics stats", **cls.get_stats())
+
+    @classmethod
+    def record_query(cls, sql, params, milliseconds, explain):
+        """
+        Count a database query for the operations that are running on this thread.
+        Slow queries are logged with the query plan returned by explain().
+
+        :param sql:
+        :param params:
+        :param milliseconds:
+        :param explain:
+        :return:
+        """
+        cls._add_stage("sql", milliseconds, queries=1)
+        with cls._lock:
+            cls._queries.add(milliseconds)
+        slow_query_ms = cls.get_slow_query_ms()
+        if not slow_query_ms or milliseconds < slow_query_ms:
+            return
+        plan = explain()
+        logger.warning(
+            "Slow file size metrics query took %.1f ms: %s %s\nQuery plan:\n%s",
+            milliseconds,
+            sql,
+            repr(params)[:200] if params else "",
+            "\n".join(plan) or "(not available)",
+        )
+        with cls._lock:
+            cls._slow_queries.append(
+                {
+                    "time":        int(time.time()),
+                    "duration_ms": round(milliseconds, 3),
+                    "sql":         sql,
+                    "plan":        plan,
+                }
+            )
+
+    @classmethod
+    def get_slow_query_ms(cls):
+        # Read through a short cache, this is checked after every query
+        if time.monotonic() >= cls._settings_expire_at:
+            cls._slow_query_ms = float(Settings().get_setting("slow_query_ms") or 0)
+            cls._settings_expire_at = time.monotonic() + cls.settings_ttl
+        return cls._slow_query_ms
+
+    @classmethod
+    def get_stats(cls):
+        with cls._lock:
+            operations = {}
+            for name, operation in sorted(cls._operations.items()):
+                summary = operation["latency"].summary()
+                count = summary["count"] or 1
+                summary["mean_queries"] = round(operation["queries"] / count, 2)
+                summary["max_queries"] = operation["max_queries"]
+                summary["mean_stage_ms"] = {
+                    stage_name: round(stage_milliseconds / count, 3)
+                    for stage_name, stage_milliseconds in sorted(operation["stages_ms"].items())
+                }
+                operations[name] = summary
+            return {
+                "uptime_seconds": int(time.time() - cls._started_at),
+                "operations":     operations,
+                "queries":        cls._queries.summary(),
+                "slow_queries":   list(cls._slow_queries),
+            }
+
+
+class InstrumentedPooledSqliteDatabase(PooledSqliteDatabase):
+    """
+    InstrumentedPooledSqliteDatabase
+
+    Reports the duration of every query to Instrumentation.
+    The duration covers running the statement up to its first row. Rows fetched later are not included.
+    """
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        cursor = super(InstrumentedPooledSqliteDatabase, self).execute_sql(sql, params, *args, **kwargs)
+        Instrumentation.record_query(
+            sql,
+            params,
+            (time.perf_counter() - started) * 1000,
+            lambda: self.explain_query_plan(sql, params),
+        )
+        return cursor
+
+    def explain_query_plan(self, sql, params=None):
+        return explain_query_plan(self.cursor(), sql, params)
+
+
+def explain_query_plan(cursor, sql, params=None):
+    if not re.match(r"\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b", sql, re.IGNORECASE):
+        return []
+    try:
+        rows = cursor.execute("EXPLAIN QUERY PLAN " + sql, params or ()).fetchall()
+    except Exception:
+        return []
+    # Each row is (id, parent id, unused, detail). Indent the details to show the tree.
+    depths = {0: -1}
+    plan = []
+    for row_id, parent_id, _unused, detail in rows:
+        depths[row_id] = depths.get(parent_id, -1) + 1
+        plan.append("  " * depths[row_id] + detail)
+    return plan
+
+
+class DatabaseRouter(DatabaseProxy):
+    """
+    DatabaseRouter
+
+    The database that the models and queries use. Calls are passed on to the writer pool, or to the
+    read-only pool while the calling thread has been routed to it with use_reader().
+    The route must only be changed while the thread has no connection open.
+    """
+
+    __slots__ = ("_callbacks", "_Model", "writer", "reader", "_routing")
+
+    def __init__(self, writer, reader):
+        self._callbacks = []
+        self.writer = writer
+        self.reader = reader
+        self._routing = threading.local()
+
+    @property
+    def obj(self):
+        return self.reader if self.reading else self.writer
+
+    @property
+    def reading(self):
+        return getattr(self._routing, "reading", False)
+
+    def use_reader(self, reading=True):
+        self._routing.reading = bool(reading)
+
+    def close_all(self):
+        self.writer.close_all()
+        self.reader.close_all()
 
 
 settings = Settings()
 profile_directory = settings.get_profile_directory()
 db_file = os.path.abspath(os.path.join(profile_directory, "history.db"))
-db = SqliteDatabase(
+# Monthly partition files written by PartitionManager
+partition_directory = os.path.abspath(os.path.join(profile_directory, "history-partitions"))
+# Connections are pooled and reused by each thread for the life of the process. The pragmas are only
+# applied when the pool opens a new connection. Pooled connections move between threads, so the
+# sqlite3 same thread check is disabled. A connection is only ever used by one thread at a time.
+# When every connection is in use, a thread waits up to the timeout (in seconds) for one to be returned.
+write_db = InstrumentedPooledSqliteDatabase(
     db_file,
+    max_connections=8,
+    stale_timeout=600,
+    timeout=30,
+    check_same_thread=False,
     pragmas=(
+        # Only takes effect on a new database, RetentionManager converts existing databases when it first needs to
+        ("auto_vacuum", "incremental"),
         ("foreign_keys", 1),
         ("journal_mode", "wal"),
+        # WAL mode is still crash safe with NORMAL, it only skips the fsync on each commit
+        ("synchronous", "normal"),
+        ("cache_size", -16000),
+        ("mmap_size", 134217728),
+        ("busy_timeout", 10000),
+        ("temp_store", "memory"),
+    ),
+)
+# The panel reads through connections that SQLite opens read-only. In WAL mode a reader works from a
+# snapshot of the last commit and is never blocked by the writer, nor does it block the writer. The
+# connections are long lived, so they get a larger page cache and memory map than the writer.
+read_db = InstrumentedPooledSqliteDatabase(
+    "file:{}?mode=ro".format(urllib.request.pathname2url(db_file)),
+    uri=True,
+    max_connections=8,
+    stale_timeout=600,
+    timeout=30,
+    check_same_thread=False,
+    pragmas=(
+        ("query_only", 1),
+        ("cache_size", -65536),
+        ("mmap_size", 268435456),
+        ("busy_timeout", 10000),
+        ("temp_store", "memory"),
     ),
 )
+db = DatabaseRouter(write_db, read_db)
 
 
 class BaseModel(Model):
@@ -135,377 +606,4131 @@ class BaseModel(Model):
         return model_to_dict(self, backrefs=True)
 
 
+class SchemaVersion(BaseModel):
+    """
+    SchemaVersion
+
+    One row for each history database migration that has been applied
+    """
+
+    version = IntegerField(primary_key=True)
+    description = TextField(null=False, default="")
+    applied_at = BigIntegerField(null=False, default=lambda: int(time.time()))
+
+
 class HistoricTasks(BaseModel):
     """
     HistoricTasks
+
+    Timestamps are stored as UTC UNIX epoch seconds.
+    destination_size is the total size of all of the task's destination probes.
+    library_id is the Unmanic library that processed the task, if it is known.
+    extension is the lower case file extension of the task's source file, without the dot.
+    throughput is the source size processed per second, in bytes. It is only set for successful tasks
+    that took at least one second.
     """
 
     task_label = TextField(null=False, default="UNKNOWN")
-    task_success = BooleanField(null=False, default="UNKNOWN")
-    start_time = DateTimeField(
-        null=False,
-        default=lambda: datetime.datetime.now(datetime.timezone.utc),
-    )
-    finish_time = DateTimeField(null=True)
+    task_success = BooleanField(null=False, default=False, index=True)
+    start_time = BigIntegerField(null=False, default=lambda: int(time.time()), index=True)
+    finish_time = BigIntegerField(null=True, index=True)
+    destination_size = BigIntegerField(null=False, default=0)
+    library_id = IntegerField(null=True, index=True)
+    extension = TextField(null=False, default="", index=True)
+    throughput = BigIntegerField(null=True)
 
 
 class HistoricTaskProbe(BaseModel):
     """
     HistoricTaskMetrics
+
+    Sizes are stored as integer byte counts
     """
 
-    historictask_id = ForeignKeyField(HistoricTasks)
+    historictask_id = ForeignKeyField(HistoricTasks, index=False)
     type = TextField(null=False, default="source")
     abspath = TextField(null=True, default="UNKNOWN")
     basename = TextField(null=True, default="UNKNOWN")
-    size = TextField(null=False, default="0")
+    size = BigIntegerField(null=False, default=0)
 
+    class Meta:
+        indexes = (
+            # Looks up the probes of a task, optionally by type
+            (("historictask_id", "type"), False),
+            # Lists destination probes sorted by basename (SQLite appends the id to every index)
+            (("type", "basename"), False),
+        )
 
-class Data(object):
-    def __init__(self):
-        self.create_db_schema()
 
-    def db_start(self):
-        try:
-            db.connect(reuse_if_open=True)
-        except OperationalError:
-            pass
+class HistoricTotals(BaseModel):
+    """
+    HistoricTotals
 
-    def db_stop(self):
-        try:
-            if not db.is_closed():
-                db.close()
-        except OperationalError:
-            pass
+    A single row of running totals that is updated in the same transaction as the rows it summarises.
+    Sizes only include successful tasks.
+    """
 
-    @staticmethod
-    def get_empty_state_message():
-        return (
-            "No file size metrics have been collected yet. "
-            "Add this plugin to at least one library, then process files to populate this panel."
-        )
+    source_size = BigIntegerField(null=False, default=0)
+    destination_size = BigIntegerField(null=False, default=0)
+    success_count = BigIntegerField(null=False, default=0)
+    task_count = BigIntegerField(null=False, default=0)
 
-    @staticmethod
-    def is_assigned_to_any_library():
-        try:
-            for library in Library.get_all_libraries():
-                enabled_plugins = Library(library.get("id")).get_enabled_plugins()
-                for enabled_plugin in enabled_plugins:
-                    if enabled_plugin.get("plugin_id") == PLUGIN_ID:
-                        return True
-        except Exception:
-            logger.exception(
-                "Failed to determine if file size metrics is assigned to a library."
-            )
-        return False
 
-    def clear_all_data(self):
-        """
-        Clear all historical data from the database.
-        Returns True if successful, False otherwise.
-        """
-        self.db_start()
-        try:
-            # Delete all probe data first (foreign key constraint)
-            HistoricTaskProbe.delete().execute()
-            # Then delete all task records
-            HistoricTasks.delete().execute()
-            logger.info("All file size metrics data has been cleared.")
-            success = True
-        except Exception:
-            logger.exception("Failed to clear historical data from database.")
-            success = False
-        self.db_stop()
-        return success
+class HistoricTaskSearch(FTS5Model):
+    """
+    HistoricTaskSearch
 
-    def create_db_schema(self):
-        # Create required tables in new DB
-        self.db_start()
-        logger.debug("Ensuring history database schema exists")
-        db.create_tables([HistoricTasks, HistoricTaskProbe], safe=True)
-        self.db_stop()
+    Full-text index with one row per task that has a destination probe, keyed by the task id.
+    The basename and abspath columns hold the names and paths of all of the task's probes.
+    """
 
-    def get_total_historic_task_list_count(self):
-        self.db_start()
-        try:
-            query = HistoricTasks.select()
-            return query.count()
-        finally:
-            self.db_stop()
+    rowid = RowIDField()
+    task_label = SearchField()
+    basename = SearchField()
+    abspath = SearchField()
 
-    def build_historic_task_query(self, search_value=None):
-        query = HistoricTaskProbe.select(
-            HistoricTaskProbe.id,
-            HistoricTaskProbe.type,
-            HistoricTaskProbe.abspath,
-            HistoricTaskProbe.basename,
-            HistoricTasks.task_success,
-            HistoricTasks.start_time,
-            HistoricTasks.finish_time,
-        )
+    class Meta:
+        database = db
+        table_name = "historictasksearch"
+        options = {
+            "tokenize": "unicode61 remove_diacritics 2",
+            "prefix":   "2 3",
+        }
 
-        predicate = (HistoricTaskProbe.historictask_id == HistoricTasks.id) & (
-            HistoricTaskProbe.type == "destination"
-        )
-        query = query.join(HistoricTasks, on=predicate)
 
-        if search_value:
-            query = query.where(HistoricTasks.task_label.contains(search_value))
+class HistoricCompaction(BaseModel):
+    """
+    HistoricCompaction
 
-        return query
+    A single row holding the totals of the task and probe rows that were removed by the retention policy.
+    Rollup buckets that start before compacted_before (UTC epoch seconds) can no longer be rebuilt from
+    the raw rows, so they are kept as they are.
+    """
 
-    def get_historic_task_list_filtered_and_sorted(
-        self,
-        order=None,
-        start=0,
-        length=None,
-        search_value=None,
-    ):
-        query = self.build_historic_task_query(search_value=search_value)
+    compacted_before = BigIntegerField(null=False, default=0)
+    source_size = BigIntegerField(null=False, default=0)
+    destination_size = BigIntegerField(null=False, default=0)
+    success_count = BigIntegerField(null=False, default=0)
+    task_count = BigIntegerField(null=False, default=0)
 
-        if order:
-            sort_table = HistoricTasks
-            if order.get("column") in ["basename"]:
-                sort_table = HistoricTaskProbe
 
-            if order.get("dir") == "asc":
-                order_by = attrgetter(order.get("column"))(sort_table).asc()
-            else:
-                order_by = attrgetter(order.get("column"))(sort_table).desc()
-        else:
-            order_by = HistoricTasks.finish_time.desc()
+# The ID of the only row in the HistoricTotals and HistoricCompaction tables
+TOTALS_ROW_ID = 1
 
-        query = query.order_by(order_by)
 
-        if length is not None and int(length) > 0:
-            query = query.limit(int(length)).offset(int(start or 0))
+class HistoricRollup(BaseModel):
+    """
+    HistoricRollup
 
-        return query.dicts()
+    Base model for the time bucketed totals.
+    Each row holds the totals for successful tasks that finished in the bucket starting at bucket_start
+    (UTC epoch seconds). Processing duration is the sum of task durations in seconds, and max_throughput
+    is the highest throughput of a task in the bucket.
+    """
 
-    def get_history_probe_data(self, task_probe_id):
-        self.db_start()
-        try:
-            historictask = (
-                HistoricTaskProbe.select(HistoricTaskProbe.historictask_id)
-                .where(HistoricTaskProbe.id == task_probe_id)
-                .get()
-            )
+    bucket_seconds = None
+    default_bucket_count = None
 
-            historictask_id = historictask.historictask_id
+    bucket_start = BigIntegerField(primary_key=True)
+    source_size = BigIntegerField(null=False, default=0)
+    destination_size = BigIntegerField(null=False, default=0)
+    task_count = BigIntegerField(null=False, default=0)
+    processing_duration = BigIntegerField(null=False, default=0)
+    max_throughput = BigIntegerField(null=False, default=0)
 
-            query = HistoricTaskProbe.select(
-                HistoricTaskProbe.id,
-                HistoricTaskProbe.type,
-                HistoricTaskProbe.abspath,
-                HistoricTaskProbe.basename,
-                HistoricTaskProbe.size,
-            )
 
-            query = query.where(
-                (
-                    (HistoricTaskProbe.historictask_id == historictask_id)
-                    & (HistoricTaskProbe.type == "source")
-                )
-                | (HistoricTaskProbe.id == task_probe_id)
-            )
+class HistoricHourlyTotals(HistoricRollup):
+    """
+    HistoricHourlyTotals
+    """
 
-            results = []
-            for task in query:
-                item = {
-                    "id":       task.id,
-                    "type":     task.type,
-                    "abspath":  task.abspath,
-                    "basename": task.basename,
-                    "size":     task.size,
-                }
-                results.append(item)
+    bucket_seconds = 3600
+    default_bucket_count = 48
 
-            return results
-        except HistoricTaskProbe.DoesNotExist:
-            return []
-        finally:
-            self.db_stop()
 
-    def calculate_total_file_size_difference(self):
-        self.db_start()
+class HistoricDailyTotals(HistoricRollup):
+    """
+    HistoricDailyTotals
+    """
+
+    bucket_seconds = 86400
+    default_bucket_count = 90
+
+
+class HistoricDistribution(BaseModel):
+    """
+    HistoricDistribution
+
+    Log-scale histograms of successful tasks, with one row for each bin that has been used.
+    The bins of each metric are described in DISTRIBUTION_METRICS. Like the totals, the counts still
+    include tasks that were removed by the retention policy.
+    """
+
+    metric = TextField(null=False)
+    bin = IntegerField(null=False)
+    count = BigIntegerField(null=False, default=0)
+
+    class Meta:
+        primary_key = CompositeKey("metric", "bin")
+
+
+class HistoricBreakdown(BaseModel):
+    """
+    HistoricBreakdown
+
+    The totals of successful tasks grouped by library and by source file extension, with one row for each
+    group. dimension is one of BREAKDOWN_DIMENSIONS. key is the library ID or the extension, or an empty
+    string when it is not known. Processing duration and max_throughput are kept the same way as in the
+    rollups. Like the totals, the rows still include tasks that were removed by the retention policy.
+    """
+
+    dimension = TextField(null=False)
+    key = TextField(null=False, default="")
+    source_size = BigIntegerField(null=False, default=0)
+    destination_size = BigIntegerField(null=False, default=0)
+    task_count = BigIntegerField(null=False, default=0)
+    processing_duration = BigIntegerField(null=False, default=0)
+    max_throughput = BigIntegerField(null=False, default=0)
+
+    class Meta:
+        primary_key = CompositeKey("dimension", "key")
+
+
+class HistoricPartition(BaseModel):
+    """
+    HistoricPartition
+
+    One row for each monthly partition file. A partition holds the task and probe rows (and their search
+    index rows) of the tasks that finished, or started if they never finished, between month_start and
+    month_end (UTC epoch seconds). The file never changes once its row has been added.
+    The counts and sizes summarise the partition the same way as the running totals, list_count is the number
+    of /list rows it holds and unfinished_list_count how many of those belong to tasks without a finish time.
+    The id and time ranges let queries skip the partitions that can not match.
+    """
+
+    name = TextField(null=False, unique=True)
+    month_start = BigIntegerField(null=False, index=True)
+    month_end = BigIntegerField(null=False)
+    source_size = BigIntegerField(null=False, default=0)
+    destination_size = BigIntegerField(null=False, default=0)
+    success_count = BigIntegerField(null=False, default=0)
+    task_count = BigIntegerField(null=False, default=0)
+    list_count = BigIntegerField(null=False, default=0)
+    unfinished_list_count = BigIntegerField(null=False, default=0)
+    first_task_id = BigIntegerField(null=True)
+    last_task_id = BigIntegerField(null=True)
+    first_probe_id = BigIntegerField(null=True)
+    last_probe_id = BigIntegerField(null=True)
+    min_start_time = BigIntegerField(null=True)
+    max_start_time = BigIntegerField(null=True)
+    min_finish_time = BigIntegerField(null=True)
+    max_finish_time = BigIntegerField(null=True)
+    created_at = BigIntegerField(null=False, default=lambda: int(time.time()))
+
+
+# Columns the /list endpoint can be sorted by, with the tie breakers that make each row's sort key unique.
+# Every key is backed by an index so that a keyset page can seek straight to its first row.
+LIST_SORT_KEYS = {
+    "basename":    (
+        (HistoricTaskProbe.basename, "basename"),
+        (HistoricTaskProbe.id, "id"),
+    ),
+    "start_time":  (
+        (HistoricTasks.start_time, "start_time"),
+        (HistoricTasks.id, "historictask_id"),
+        (HistoricTaskProbe.id, "id"),
+    ),
+    "finish_time": (
+        (HistoricTasks.finish_time, "finish_time"),
+        (HistoricTasks.id, "historictask_id"),
+        (HistoricTaskProbe.id, "id"),
+    ),
+}
+
+# Columns of the rows selected by Data.build_historic_task_query(), in order
+LIST_ROW_COLUMNS = (
+    "id",
+    "historictask_id",
+    "type",
+    "abspath",
+    "basename",
+    "task_success",
+    "start_time",
+    "finish_time",
+)
+# Columns returned to the panel for each /list row, with their position in LIST_ROW_COLUMNS
+LIST_RESPONSE_COLUMNS = (
+    ("id", 0),
+    ("basename", 4),
+    ("abspath", 3),
+    ("task_success", 5),
+    ("start_time", 6),
+    ("finish_time", 7),
+)
+
+ROLLUP_MODELS = {
+    "hour": HistoricHourlyTotals,
+    "day":  HistoricDailyTotals,
+}
+
+# Upper limit on the number of buckets returned by a single timeseries request
+TIMESERIES_MAX_BUCKETS = 10000
+
+# Upper limits on the rows returned by, and the time spent waiting in, a single /changes request
+CHANGES_MAX_ROWS = 500
+CHANGES_MAX_WAIT = 30
+
+# Histogram bins for the /distribution endpoint. Bins are a fixed fraction of a doubling wide.
+# Ratios are binned by log2 of the value. Signed metrics use bin 0 for values under 1, and the bins
+# either side of it for positive and negative values.
+DISTRIBUTION_METRICS = {
+    "compression_ratio":   {"unit": "ratio", "bins_per_doubling": 8, "signed": False, "max_bin": 80},
+    "bytes_saved":         {"unit": "bytes", "bins_per_doubling": 4, "signed": True, "max_bin": 240},
+    "processing_duration": {"unit": "seconds", "bins_per_doubling": 4, "signed": True, "max_bin": 120},
+}
+
+# Groupings returned by the /breakdown endpoint, with the task column that each one is keyed by
+BREAKDOWN_DIMENSIONS = {
+    "library":   "library_id",
+    "extension": "extension",
+}
+
+
+def _compute_totals():
+    """
+    Calculate the running totals from the raw task and probe rows.
+    This scans every row in history.db. It is only used for migrations and to rebuild or verify the stored totals.
+
+    :return:
+    """
+    totals = {}
+    query = (
+        HistoricTaskProbe.select(fn.SUM(HistoricTaskProbe.size))
+        .join(HistoricTasks, on=(HistoricTaskProbe.historictask_id == HistoricTasks.id))
+        .where((HistoricTaskProbe.type == "source") & (HistoricTasks.task_success))
+    )
+    totals["source_size"] = int(query.scalar() or 0)
+    totals["destination_size"] = int(
+        HistoricTasks.select(fn.SUM(HistoricTasks.destination_size)).where(HistoricTasks.task_success).scalar() or 0
+    )
+    totals["success_count"] = int(
+        HistoricTasks.select(fn.COUNT(HistoricTasks.id)).where(HistoricTasks.task_success).scalar() or 0
+    )
+    totals["task_count"] = int(HistoricTasks.select(fn.COUNT(HistoricTasks.id)).scalar() or 0)
+    # Add back the rows that were removed by the retention policy or moved to partitions
+    for removed in (_read_compaction(), _read_partition_totals()):
+        for key in totals:
+            totals[key] += removed[key]
+    return totals
+
+
+def _read_totals():
+    return (
+        HistoricTotals.select(
+            HistoricTotals.source_size,
+            HistoricTotals.destination_size,
+            HistoricTotals.success_count,
+            HistoricTotals.task_count,
+        )
+        .where(HistoricTotals.id == TOTALS_ROW_ID)
+        .dicts()
+        .first()
+    )
+
+
+def _store_totals(totals):
+    HistoricTotals.insert(id=TOTALS_ROW_ID, **totals).on_conflict_replace().execute()
+
+
+def _restore_totals():
+    # Must be called inside a transaction, so that no task is written between counting and storing
+    totals = _compute_totals()
+    _store_totals(totals)
+    return totals
+
+
+def _read_compaction():
+    compaction = None
+    # The table does not exist yet while the earlier migrations run
+    if HistoricCompaction.table_exists():
+        compaction = (
+            HistoricCompaction.select(
+                HistoricCompaction.compacted_before,
+                HistoricCompaction.source_size,
+                HistoricCompaction.destination_size,
+                HistoricCompaction.success_count,
+                HistoricCompaction.task_count,
+            )
+            .where(HistoricCompaction.id == TOTALS_ROW_ID)
+            .dicts()
+            .first()
+        )
+    return compaction or {
+        "compacted_before": 0,
+        "source_size":      0,
+        "destination_size": 0,
+        "success_count":    0,
+        "task_count":       0,
+    }
+
+
+def _read_partition_totals():
+    totals = {
+        "source_size":      0,
+        "destination_size": 0,
+        "success_count":    0,
+        "task_count":       0,
+    }
+    # The table does not exist yet while the earlier migrations run
+    if HistoricPartition.table_exists():
+        summed = HistoricPartition.select(
+            *[fn.COALESCE(fn.SUM(getattr(HistoricPartition, key)), 0).alias(key) for key in totals]
+        ).dicts().first()
+        totals.update(summed or {})
+    return totals
+
+
+def _delete_tasks(task_ids):
+    # Must be called inside a transaction. Removes the tasks with their probes and search index rows.
+    for offset in range(0, len(task_ids), 500):
+        chunk = task_ids[offset:offset + 500]
+        placeholders = ", ".join("?" * len(chunk))
+        if SchemaMigrator.search_index_available:
+            db.execute_sql('DELETE FROM "historictasksearch" WHERE "rowid" IN ({})'.format(placeholders), chunk)
+        db.execute_sql('DELETE FROM "historictaskprobe" WHERE "historictask_id" IN ({})'.format(placeholders), chunk)
+        db.execute_sql('DELETE FROM "historictasks" WHERE "id" IN ({})'.format(placeholders), chunk)
+
+
+def encode_list_cursor(order, search_value, row):
+    """
+    Build the opaque cursor that points at a row of the /list results.
+
+    :param order:
+    :param search_value:
+    :param row:
+    :return:
+    """
+    keys = [row.get(row_key) for _field, row_key in LIST_SORT_KEYS[order["column"]]]
+    payload = json.dumps([order["column"], order["dir"], search_value or "", keys], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_list_cursor(cursor, order, search_value):
+    """
+    Read the sort key values out of a cursor created by encode_list_cursor().
+    Returns None if the cursor is invalid or was created for a different sort order or search.
+
+    :param cursor:
+    :param order:
+    :param search_value:
+    :return:
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        column, direction, cursor_search, keys = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        return None
+    if [column, direction, cursor_search] != [order["column"], order["dir"], search_value or ""]:
+        return None
+    if not isinstance(keys, list) or len(keys) != len(LIST_SORT_KEYS[column]) or None in keys:
+        return None
+    return keys
+
+
+def _index_tasks_for_search(where_sql, params):
+    # Must be called inside the transaction that writes the rows being indexed
+    db.execute_sql(
+        'INSERT OR REPLACE INTO "historictasksearch" ("rowid", "task_label", "basename", "abspath") '
+        'SELECT t."id", t."task_label", group_concat(p."basename", \' \'), group_concat(p."abspath", \' \') '
+        'FROM "historictasks" AS t '
+        'JOIN "historictaskprobe" AS p ON p."historictask_id" = t."id" '
+        'WHERE {} AND EXISTS ('
+        'SELECT 1 FROM "historictaskprobe" AS d WHERE d."historictask_id" = t."id" AND d."type" = \'destination\''
+        ') '
+        'GROUP BY t."id"'.format(where_sql),
+        params,
+    )
+
+
+def _ensure_search_index(report_progress):
+    """
+    Create and fill the full-text search index if SQLite supports FTS5 and the index does not exist yet.
+    Existing tasks are indexed one chunk of task ids per transaction.
+    Returns True if the search index can be used.
+
+    :param report_progress:
+    :return:
+    """
+    if HistoricTaskSearch.table_exists():
+        return True
+    if not HistoricTaskSearch.fts5_installed():
+        logger.warning("SQLite FTS5 is not available. History search will fall back to a full scan.")
+        return False
+
+    max_id = db.execute_sql('SELECT COALESCE(MAX("id"), 0) FROM "historictasks"').fetchone()[0]
+    with db.atomic():
+        db.create_tables([HistoricTaskSearch])
+    for last_id in range(0, max_id, MIGRATION_CHUNK_SIZE):
+        with db.atomic():
+            _index_tasks_for_search('t."id" > ? AND t."id" <= ?', (last_id, last_id + MIGRATION_CHUNK_SIZE))
+        report_progress(min(last_id + MIGRATION_CHUNK_SIZE, max_id), max_id)
+    return True
+
+
+def _build_search_match_expression(search_value, search_mode="prefix"):
+    """
+    Convert the text typed into the table's search box into an FTS5 MATCH expression.
+    Every word must match a token. In "prefix" mode a word also matches tokens that start with it.
+
+    :param search_value:
+    :param search_mode:
+    :return:
+    """
+    if search_mode not in ["prefix", "token"]:
+        return None
+    # Split the same way as the unicode61 tokenizer. Each token is quoted so that FTS5 operators are ignored.
+    tokens = re.findall(r"[^\W_]+", search_value or "")
+    if not tokens:
+        return None
+    suffix = "*" if search_mode == "prefix" else ""
+    return " ".join('"{}"{}'.format(token, suffix) for token in tokens)
+
+
+def get_throughput(source_size, processing_duration):
+    # Bytes of source processed per second, or None if the task finished within a second
+    if not processing_duration or processing_duration <= 0:
+        return None
+    return int(source_size // processing_duration)
+
+
+def _throughput_sql(source_size_expression, task_table="t"):
+    # The SQL version of get_throughput() for a row of the task table
+    return (
+        'CASE WHEN {task}."finish_time" > {task}."start_time" '
+        'THEN {size} / ({task}."finish_time" - {task}."start_time") END'
+    ).format(task=task_table, size=source_size_expression)
+
+
+def _increment_rollups(
+    finish_time, source_size=0, destination_size=0, task_count=0, processing_duration=0, throughput=None
+):
+    # Must be called inside the transaction that writes the rows being counted
+    for model in ROLLUP_MODELS.values():
+        model.insert(
+            bucket_start=finish_time - (finish_time % model.bucket_seconds),
+            source_size=source_size,
+            destination_size=destination_size,
+            task_count=task_count,
+            processing_duration=processing_duration,
+            max_throughput=throughput or 0,
+        ).on_conflict(
+            conflict_target=[model.bucket_start],
+            update={
+                model.source_size:         model.source_size + EXCLUDED.source_size,
+                model.destination_size:    model.destination_size + EXCLUDED.destination_size,
+                model.task_count:          model.task_count + EXCLUDED.task_count,
+                model.processing_duration: model.processing_duration + EXCLUDED.processing_duration,
+                model.max_throughput:      fn.MAX(model.max_throughput, EXCLUDED.max_throughput),
+            },
+        ).execute()
+
+
+def _increment_rollup_buckets(model, buckets):
+    # Must be called inside the transaction that writes the rows being counted. Each bucket is a list of the
+    # bucket start, source size, destination size, task count, processing duration and highest throughput.
+    if not buckets:
+        return
+    db.cursor().executemany(
+        'INSERT INTO "{}" '
+        '("bucket_start", "source_size", "destination_size", "task_count", "processing_duration", '
+        '"max_throughput") '
+        "VALUES (?, ?, ?, ?, ?, ?) "
+        'ON CONFLICT ("bucket_start") DO UPDATE SET '
+        '"source_size" = "source_size" + excluded."source_size", '
+        '"destination_size" = "destination_size" + excluded."destination_size", '
+        '"task_count" = "task_count" + excluded."task_count", '
+        '"processing_duration" = "processing_duration" + excluded."processing_duration", '
+        '"max_throughput" = MAX("max_throughput", excluded."max_throughput")'.format(model._meta.table_name),
+        buckets,
+    )
+
+
+def _distribution_bin(metric, value):
+    spec = DISTRIBUTION_METRICS[metric]
+    if spec["signed"]:
+        if abs(value) < 1:
+            return 0
+        magnitude = 1 + int(math.floor(math.log2(abs(value)) * spec["bins_per_doubling"]))
+        return int(math.copysign(min(magnitude, spec["max_bin"]), value))
+    if value <= 0:
+        return -spec["max_bin"]
+    magnitude = int(math.floor(math.log2(value) * spec["bins_per_doubling"]))
+    return max(-spec["max_bin"], min(magnitude, spec["max_bin"]))
+
+
+def _distribution_bin_bounds(metric, bin_index):
+    """
+    Return the lower and upper bounds of a histogram bin.
+
+    :param metric:
+    :param bin_index:
+    :return:
+    """
+    spec = DISTRIBUTION_METRICS[metric]
+    width = float(spec["bins_per_doubling"])
+    if not spec["signed"]:
+        return 2 ** (bin_index / width), 2 ** ((bin_index + 1) / width)
+    if bin_index == 0:
+        return -1.0, 1.0
+    lower, upper = 2 ** ((abs(bin_index) - 1) / width), 2 ** (abs(bin_index) / width)
+    if bin_index < 0:
+        return -upper, -lower
+    return lower, upper
+
+
+def _distribution_bins(source_size, destination_size, processing_duration):
+    """
+    Return the (metric, bin) pairs that a successful task is counted in.
+
+    :param source_size:
+    :param destination_size:
+    :param processing_duration:
+    :return:
+    """
+    bins = [
+        ("bytes_saved", _distribution_bin("bytes_saved", source_size - destination_size)),
+        ("processing_duration", _distribution_bin("processing_duration", max(processing_duration, 0))),
+    ]
+    if source_size > 0:
+        bins.append(("compression_ratio", _distribution_bin("compression_ratio", destination_size / source_size)))
+    return bins
+
+
+def _increment_distributions(counts):
+    # Must be called inside the transaction that writes the rows being counted.
+    # counts maps (metric, bin) to the change in the bin's count.
+    rows = [(metric, bin_index, change) for (metric, bin_index), change in counts.items() if change]
+    if not rows:
+        return
+    db.cursor().executemany(
+        'INSERT INTO "historicdistribution" ("metric", "bin", "count") VALUES (?, ?, ?) '
+        'ON CONFLICT ("metric", "bin") DO UPDATE SET "count" = "count" + excluded."count"',
+        rows,
+    )
+
+
+def _distribution_percentile(metric, bins, total, percent):
+    """
+    Estimate a percentile from the (bin, count) pairs of a histogram, sorted by bin.
+    The value is interpolated within the bin that holds the percentile.
+
+    :param metric:
+    :param bins:
+    :param total:
+    :param percent:
+    :return:
+    """
+    rank = total * percent / 100.0
+    seen = 0
+    for bin_index, count in bins:
+        if count and seen + count >= rank:
+            lower, upper = _distribution_bin_bounds(metric, bin_index)
+            return lower + (upper - lower) * max(rank - seen, 0) / count
+        seen += count
+    return None
+
+
+def _rebuild_distributions(report_progress=None):
+    """
+    Recalculate the histograms from the raw task and probe rows, including the partitions.
+    Tasks that were removed by the retention policy can not be counted again, so they are left out.
+
+    :param report_progress:
+    :return:
+    """
+    counts = collections.Counter()
+    partitions = PartitionRouter.list_partitions()
+    total = db.execute_sql('SELECT COUNT(*) FROM "historictasks" WHERE "task_success"').fetchone()[0]
+    total += sum(partition["success_count"] for partition in partitions)
+    sql = (
+        'SELECT COALESCE(s."size", 0), t."destination_size", COALESCE(t."finish_time" - t."start_time", 0) '
+        'FROM "historictasks" AS t '
+        'LEFT JOIN "historictaskprobe" AS s ON s."historictask_id" = t."id" AND s."type" = \'source\' '
+        'WHERE t."task_success"'
+    )
+    cursors = itertools.chain(
+        [db.execute_sql(sql)],
+        (cursor for _partition, cursor in PartitionRouter.query(sql, partitions=partitions)),
+    )
+    done = 0
+    for cursor in cursors:
+        while True:
+            rows = cursor.fetchmany(MIGRATION_CHUNK_SIZE)
+            if not rows:
+                break
+            for source_size, destination_size, processing_duration in rows:
+                counts.update(_distribution_bins(source_size, destination_size, processing_duration))
+            done += len(rows)
+            if report_progress is not None:
+                report_progress(done, total)
+    db.execute_sql('DELETE FROM "historicdistribution"')
+    _increment_distributions(counts)
+
+
+def get_file_extension(abspath):
+    return os.path.splitext(os.path.basename(abspath or ""))[1][1:].lower()
+
+
+def _count_breakdowns(
+    changes, library_id, extension, source_size=0, destination_size=0, task_count=0, processing_duration=0,
+    throughput=None,
+):
+    # changes maps (dimension, key) to a list of the changes in source size, destination size, task count and
+    # processing duration, followed by the highest throughput
+    for dimension, key in (("library", library_id), ("extension", extension)):
+        change = changes.setdefault((dimension, "" if key is None else str(key)), [0, 0, 0, 0, 0])
+        change[0] += source_size
+        change[1] += destination_size
+        change[2] += task_count
+        change[3] += processing_duration
+        change[4] = max(change[4], throughput or 0)
+
+
+def _increment_breakdowns(changes):
+    # Must be called inside the transaction that writes the rows being counted
+    rows = [(dimension, key) + tuple(change) for (dimension, key), change in changes.items() if any(change)]
+    if not rows:
+        return
+    db.cursor().executemany(
+        'INSERT INTO "historicbreakdown" '
+        '("dimension", "key", "source_size", "destination_size", "task_count", "processing_duration", '
+        '"max_throughput") '
+        "VALUES (?, ?, ?, ?, ?, ?, ?) "
+        'ON CONFLICT ("dimension", "key") DO UPDATE SET '
+        '"source_size" = "source_size" + excluded."source_size", '
+        '"destination_size" = "destination_size" + excluded."destination_size", '
+        '"task_count" = "task_count" + excluded."task_count", '
+        '"processing_duration" = "processing_duration" + excluded."processing_duration", '
+        '"max_throughput" = MAX("max_throughput", excluded."max_throughput")',
+        rows,
+    )
+
+
+def _rebuild_breakdowns():
+    """
+    Recalculate the library and extension breakdowns from the raw task and probe rows, including the partitions.
+    Tasks that were removed by the retention policy can not be counted again, so they are left out.
+
+    :return:
+    """
+    db.execute_sql('DELETE FROM "historicbreakdown"')
+    partitions = PartitionRouter.list_partitions()
+    for dimension, column in BREAKDOWN_DIMENSIONS.items():
+        select_sql = (
+            'SELECT ?, COALESCE(CAST(t."{column}" AS TEXT), \'\') AS "group_key", '
+            'SUM(COALESCE(s."size", 0)), SUM(t."destination_size"), COUNT(t."id"), '
+            'SUM(MAX(t."finish_time" - t."start_time", 0)), COALESCE(MAX({throughput}), 0) '
+            'FROM "historictasks" AS t '
+            'LEFT JOIN "historictaskprobe" AS s ON s."historictask_id" = t."id" AND s."type" = \'source\' '
+            'WHERE t."task_success" '
+            'GROUP BY "group_key"'
+        ).format(column=column, throughput=_throughput_sql('COALESCE(s."size", 0)'))
+        db.execute_sql(
+            'INSERT INTO "historicbreakdown" '
+            '("dimension", "key", "source_size", "destination_size", "task_count", "processing_duration", '
+            '"max_throughput") ' + select_sql,
+            (dimension,),
+        )
+        changes = {}
+        for _partition, cursor in PartitionRouter.query(select_sql, (dimension,), partitions=partitions):
+            for _dimension, key, source_size, destination_size, task_count, processing_duration, throughput in cursor:
+                change = changes.setdefault((dimension, key), [0, 0, 0, 0, 0])
+                change[0] += source_size
+                change[1] += destination_size
+                change[2] += task_count
+                change[3] += processing_duration
+                change[4] = max(change[4], throughput)
+        _increment_breakdowns(changes)
+
+
+def _rebuild_rollups():
+    """
+    Recalculate the time bucketed rollups from the raw task and probe rows, including the partitions.
+    Buckets from before the retention policy removed the raw rows are left as they are.
+
+    :return:
+    """
+    compacted_before = _read_compaction()["compacted_before"]
+    partitions = PartitionRouter.list_partitions(from_time=compacted_before)
+    for model in ROLLUP_MODELS.values():
+        table_name = model._meta.table_name
+        select_sql = (
+            'SELECT t."finish_time" - (t."finish_time" % {seconds}) AS "bucket", '
+            'SUM(COALESCE(s."size", 0)), SUM(t."destination_size"), COUNT(t."id"), '
+            'SUM(MAX(t."finish_time" - t."start_time", 0)), COALESCE(MAX({throughput}), 0) '
+            'FROM "historictasks" AS t '
+            'LEFT JOIN "historictaskprobe" AS s ON s."historictask_id" = t."id" AND s."type" = \'source\' '
+            'WHERE t."task_success" AND t."finish_time" >= ? '
+            'GROUP BY "bucket"'
+        ).format(seconds=int(model.bucket_seconds), throughput=_throughput_sql('COALESCE(s."size", 0)'))
+        db.execute_sql('DELETE FROM "{}" WHERE "bucket_start" >= ?'.format(table_name), (compacted_before,))
+        db.execute_sql(
+            'INSERT INTO "{}" '
+            '("bucket_start", "source_size", "destination_size", "task_count", "processing_duration", '
+            '"max_throughput") '.format(table_name) + select_sql,
+            (compacted_before,),
+        )
+        for _partition, cursor in PartitionRouter.query(select_sql, (compacted_before,), partitions=partitions):
+            _increment_rollup_buckets(model, cursor.fetchall())
+
+
+# Number of rows copied or updated per transaction while migrating existing data
+MIGRATION_CHUNK_SIZE = 50000
+
+
+def _legacy_epoch_sql(column):
+    # Legacy timestamps were written by a DateTimeField as "YYYY-MM-DD HH:MM:SS[.ffffff][+00:00]".
+    # Naive values are treated as UTC, the same as get_unix_timestamp() does.
+    return (
+        "CASE"
+        " WHEN \"{0}\" IS NULL OR \"{0}\" = '' THEN NULL"
+        " WHEN typeof(\"{0}\") IN ('integer', 'real') THEN CAST(\"{0}\" AS INTEGER)"
+        " ELSE CAST(strftime('%s', substr(replace(\"{0}\", 'T', ' '), 1, 19)) AS INTEGER)"
+        " END"
+    ).format(column)
+
+
+def _copy_table_in_chunks(source_table, target_table, columns, select_expressions, report_progress, copied, total):
+    last_id = db.execute_sql('SELECT COALESCE(MAX("id"), 0) FROM "{}"'.format(target_table)).fetchone()[0]
+    insert_sql = (
+        'INSERT INTO "{target}" ({columns}) '
+        'SELECT {expressions} FROM "{source}" WHERE "id" > ? ORDER BY "id" LIMIT ?'
+    ).format(
+        target=target_table,
+        columns=", ".join('"{}"'.format(c) for c in columns),
+        expressions=", ".join(select_expressions),
+        source=source_table,
+    )
+    while True:
+        with db.atomic():
+            cursor = db.execute_sql(insert_sql, (last_id, MIGRATION_CHUNK_SIZE))
+            row_count = cursor.rowcount
+            last_id = db.execute_sql('SELECT COALESCE(MAX("id"), 0) FROM "{}"'.format(target_table)).fetchone()[0]
+        if row_count <= 0:
+            return copied
+        copied += row_count
+        report_progress(copied, total)
+
+
+def _destination_size_sql(task_id_column):
+    return (
+        '(SELECT COALESCE(SUM(CAST(p."size" AS INTEGER)), 0) FROM "historictaskprobe" AS p '
+        'WHERE p."historictask_id" = {} AND p."type" = \'destination\')'
+    ).format(task_id_column)
+
+
+def _migrate_integer_sizes_and_epochs(report_progress):
+    """
+    Rebuild the legacy tables with INTEGER sizes and epoch timestamps and add the query indexes.
+
+    SQLite cannot change a column type in place, so the rows are copied into new tables one chunk
+    per transaction and the tables are swapped at the end. An interrupted copy resumes from the
+    last copied id the next time the migration runs.
+
+    :param report_progress:
+    :return:
+    """
+    db.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "historictasks_v2" ('
+        '"id" INTEGER NOT NULL PRIMARY KEY, '
+        '"task_label" TEXT NOT NULL, '
+        '"task_success" INTEGER NOT NULL, '
+        '"start_time" INTEGER NOT NULL, '
+        '"finish_time" INTEGER, '
+        '"destination_size" INTEGER NOT NULL DEFAULT 0)'
+    )
+    db.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "historictaskprobe_v2" ('
+        '"id" INTEGER NOT NULL PRIMARY KEY, '
+        '"historictask_id" INTEGER NOT NULL, '
+        '"type" TEXT NOT NULL, '
+        '"abspath" TEXT, '
+        '"basename" TEXT, '
+        '"size" INTEGER NOT NULL, '
+        'FOREIGN KEY ("historictask_id") REFERENCES "historictasks" ("id"))'
+    )
+
+    total = (
+        db.execute_sql('SELECT COUNT(*) FROM "historictasks"').fetchone()[0]
+        + db.execute_sql('SELECT COUNT(*) FROM "historictaskprobe"').fetchone()[0]
+    )
+    copied = _copy_table_in_chunks(
+        "historictasks",
+        "historictasks_v2",
+        ["id", "task_label", "task_success", "start_time", "finish_time", "destination_size"],
+        [
+            '"id"',
+            'COALESCE("task_label", \'UNKNOWN\')',
+            'CASE WHEN "task_success" THEN 1 ELSE 0 END',
+            "COALESCE({}, 0)".format(_legacy_epoch_sql("start_time")),
+            _legacy_epoch_sql("finish_time"),
+            _destination_size_sql('"historictasks"."id"'),
+        ],
+        report_progress,
+        0,
+        total,
+    )
+    _copy_table_in_chunks(
+        "historictaskprobe",
+        "historictaskprobe_v2",
+        ["id", "historictask_id", "type", "abspath", "basename", "size"],
+        [
+            '"id"',
+            '"historictask_id"',
+            '"type"',
+            '"abspath"',
+            '"basename"',
+            'COALESCE(CAST("size" AS INTEGER), 0)',
+        ],
+        report_progress,
+        copied,
+        total,
+    )
+
+    with db.atomic():
+        db.execute_sql('DROP TABLE "historictaskprobe"')
+        db.execute_sql('DROP TABLE "historictasks"')
+        db.execute_sql('ALTER TABLE "historictasks_v2" RENAME TO "historictasks"')
+        db.execute_sql('ALTER TABLE "historictaskprobe_v2" RENAME TO "historictaskprobe"')
+        db.execute_sql('CREATE INDEX IF NOT EXISTS "historictasks_task_success" ON "historictasks" ("task_success")')
+        db.execute_sql('CREATE INDEX IF NOT EXISTS "historictasks_finish_time" ON "historictasks" ("finish_time")')
+        db.execute_sql(
+            'CREATE INDEX IF NOT EXISTS "historictaskprobe_historictask_id" ON "historictaskprobe" ("historictask_id")'
+        )
+        db.execute_sql('CREATE INDEX IF NOT EXISTS "historictaskprobe_type" ON "historictaskprobe" ("type")')
+
+
+def _migrate_running_totals(report_progress):
+    """
+    Create the running totals table and fill it from the existing rows.
+
+    :param report_progress:
+    :return:
+    """
+    with db.atomic():
+        db.execute_sql(
+            'CREATE TABLE IF NOT EXISTS "historictotals" ('
+            '"id" INTEGER NOT NULL PRIMARY KEY, '
+            '"source_size" INTEGER NOT NULL, '
+            '"destination_size" INTEGER NOT NULL, '
+            '"success_count" INTEGER NOT NULL, '
+            '"task_count" INTEGER NOT NULL)'
+        )
+        _store_totals(_compute_totals())
+
+
+def _migrate_time_bucketed_rollups(report_progress):
+    """
+    Create the hourly and daily rollup tables and fill them from the existing rows.
+
+    :param report_progress:
+    :return:
+    """
+    with db.atomic():
+        for table_name in ("historichourlytotals", "historicdailytotals"):
+            db.execute_sql(
+                'CREATE TABLE IF NOT EXISTS "{}" ('
+                '"bucket_start" INTEGER NOT NULL PRIMARY KEY, '
+                '"source_size" INTEGER NOT NULL, '
+                '"destination_size" INTEGER NOT NULL, '
+                '"task_count" INTEGER NOT NULL, '
+                '"processing_duration" INTEGER NOT NULL, '
+                '"max_throughput" INTEGER NOT NULL DEFAULT 0)'.format(table_name)
+            )
+        _rebuild_rollups()
+
+
+def _migrate_list_sort_indexes(report_progress):
+    """
+    Replace the single column probe indexes with the composite indexes used by keyset pagination.
+
+    :param report_progress:
+    :return:
+    """
+    with db.atomic():
+        db.execute_sql('CREATE INDEX IF NOT EXISTS "historictasks_start_time" ON "historictasks" ("start_time")')
+        db.execute_sql(
+            'CREATE INDEX IF NOT EXISTS "historictaskprobe_historictask_id_type" '
+            'ON "historictaskprobe" ("historictask_id", "type")'
+        )
+        db.execute_sql(
+            'CREATE INDEX IF NOT EXISTS "historictaskprobe_type_basename" ON "historictaskprobe" ("type", "basename")'
+        )
+        db.execute_sql('DROP INDEX IF EXISTS "historictaskprobe_historictask_id"')
+        db.execute_sql('DROP INDEX IF EXISTS "historictaskprobe_type"')
+    db.execute_sql("ANALYZE")
+
+
+def _migrate_search_index(report_progress):
+    """
+    Add the FTS5 history search index.
+
+    :param report_progress:
+    :return:
+    """
+    _ensure_search_index(report_progress)
+
+
+def _migrate_retention(report_progress):
+    """
+    Add the table that keeps the totals of rows removed by the retention policy.
+    The switch to incremental auto vacuum needs a full VACUUM of an existing database, so it is left to
+    RetentionManager, which only runs it once there are rows to remove.
+
+    :param report_progress:
+    :return:
+    """
+    db.create_tables([HistoricCompaction], safe=True)
+    HistoricCompaction.insert(id=TOTALS_ROW_ID).on_conflict_ignore().execute()
+
+
+def _migrate_task_destination_size(report_progress):
+    """
+    Store the total size of each task's destination probes on the task row.
+    Databases migrated from the original schema already have the column, it is filled while their rows
+    are copied by version 2.
+
+    :param report_progress:
+    :return:
+    """
+    columns = [column.name for column in db.get_columns("historictasks")]
+    if "destination_size" in columns:
+        return
+    db.execute_sql('ALTER TABLE "historictasks" ADD COLUMN "destination_size" INTEGER NOT NULL DEFAULT 0')
+    last_id = 0
+    done = 0
+    total = db.execute_sql('SELECT COUNT(*) FROM "historictasks"').fetchone()[0]
+    while True:
+        with db.atomic():
+            upper_id = db.execute_sql(
+                'SELECT MAX("id") FROM (SELECT "id" FROM "historictasks" WHERE "id" > ? ORDER BY "id" LIMIT ?)',
+                (last_id, MIGRATION_CHUNK_SIZE),
+            ).fetchone()[0]
+            if upper_id is None:
+                return
+            cursor = db.execute_sql(
+                'UPDATE "historictasks" SET "destination_size" = {} WHERE "id" > ? AND "id" <= ?'.format(
+                    _destination_size_sql('"historictasks"."id"')
+                ),
+                (last_id, upper_id),
+            )
+        done += cursor.rowcount
+        last_id = upper_id
+        report_progress(done, total)
+
+
+def _migrate_distributions(report_progress):
+    """
+    Add the compression ratio, bytes saved and processing duration histograms and fill them from the
+    recorded tasks.
+
+    :param report_progress:
+    :return:
+    """
+    db.create_tables([HistoricDistribution], safe=True)
+    with db.atomic():
+        _rebuild_distributions(report_progress)
+
+
+def _migrate_breakdowns(report_progress):
+    """
+    Store the library and source file extension of each task, and add the breakdown totals grouped by them.
+    The library of a task recorded before this version is not known. The extension is read from the
+    task's source probe.
+
+    :param report_progress:
+    :return:
+    """
+    columns = [column.name for column in db.get_columns("historictasks")]
+    if "library_id" not in columns:
+        db.execute_sql('ALTER TABLE "historictasks" ADD COLUMN "library_id" INTEGER')
+    if "extension" not in columns:
+        db.execute_sql('ALTER TABLE "historictasks" ADD COLUMN "extension" TEXT NOT NULL DEFAULT \'\'')
+    last_id = 0
+    done = 0
+    total = db.execute_sql('SELECT COUNT(*) FROM "historictasks"').fetchone()[0]
+    while True:
+        with db.atomic():
+            upper_id = db.execute_sql(
+                'SELECT MAX("id") FROM (SELECT "id" FROM "historictasks" WHERE "id" > ? ORDER BY "id" LIMIT ?)',
+                (last_id, MIGRATION_CHUNK_SIZE),
+            ).fetchone()[0]
+            if upper_id is None:
+                break
+            # SQLite has no function to find the last dot in a path, so the extensions are read here
+            cursor = db.execute_sql(
+                'SELECT "historictask_id", MIN("abspath") FROM "historictaskprobe" '
+                'WHERE "historictask_id" > ? AND "historictask_id" <= ? AND "type" = \'source\' '
+                'GROUP BY "historictask_id"',
+                (last_id, upper_id),
+            )
+            db.cursor().executemany(
+                'UPDATE "historictasks" SET "extension" = ? WHERE "id" = ?',
+                [(get_file_extension(abspath), task_id) for task_id, abspath in cursor.fetchall()],
+            )
+        done += db.execute_sql(
+            'SELECT COUNT(*) FROM "historictasks" WHERE "id" > ? AND "id" <= ?', (last_id, upper_id)
+        ).fetchone()[0]
+        last_id = upper_id
+        report_progress(done, total)
+    with db.atomic():
+        db.execute_sql('CREATE INDEX IF NOT EXISTS "historictasks_library_id" ON "historictasks" ("library_id")')
+        db.execute_sql('CREATE INDEX IF NOT EXISTS "historictasks_extension" ON "historictasks" ("extension")')
+        db.create_tables([HistoricBreakdown], safe=True)
+        _rebuild_breakdowns()
+
+
+def _migrate_throughput(report_progress):
+    """
+    Store the throughput of each successful task, and add the highest throughput and the processing duration
+    to the rollups and breakdowns.
+    Rollup buckets from before the retention policy removed the raw rows keep a highest throughput of 0.
+
+    :param report_progress:
+    :return:
+    """
+    columns_to_add = (
+        ("historictasks", "throughput", "INTEGER"),
+        ("historichourlytotals", "max_throughput", "INTEGER NOT NULL DEFAULT 0"),
+        ("historicdailytotals", "max_throughput", "INTEGER NOT NULL DEFAULT 0"),
+        ("historicbreakdown", "processing_duration", "INTEGER NOT NULL DEFAULT 0"),
+        ("historicbreakdown", "max_throughput", "INTEGER NOT NULL DEFAULT 0"),
+    )
+    for table_name, column_name, definition in columns_to_add:
+        if column_name not in [column.name for column in db.get_columns(table_name)]:
+            db.execute_sql('ALTER TABLE "{}" ADD COLUMN "{}" {}'.format(table_name, column_name, definition))
+    last_id = 0
+    done = 0
+    total = db.execute_sql('SELECT COUNT(*) FROM "historictasks"').fetchone()[0]
+    while True:
+        with db.atomic():
+            upper_id = db.execute_sql(
+                'SELECT MAX("id") FROM (SELECT "id" FROM "historictasks" WHERE "id" > ? ORDER BY "id" LIMIT ?)',
+                (last_id, MIGRATION_CHUNK_SIZE),
+            ).fetchone()[0]
+            if upper_id is None:
+                break
+            db.execute_sql(
+                'UPDATE "historictasks" SET "throughput" = {} '
+                'WHERE "id" > ? AND "id" <= ? AND "task_success"'.format(
+                    _throughput_sql(
+                        '(SELECT COALESCE(SUM(s."size"), 0) FROM "historictaskprobe" AS s '
+                        'WHERE s."historictask_id" = "historictasks"."id" AND s."type" = \'source\')',
+                        task_table='"historictasks"',
+                    )
+                ),
+                (last_id, upper_id),
+            )
+        done += db.execute_sql(
+            'SELECT COUNT(*) FROM "historictasks" WHERE "id" > ? AND "id" <= ?', (last_id, upper_id)
+        ).fetchone()[0]
+        last_id = upper_id
+        report_progress(done, total)
+    with db.atomic():
+        _rebuild_rollups()
+        _rebuild_breakdowns()
+
+
+def _migrate_partitions(report_progress):
+    """
+    Add the table that lists the monthly partition files.
+    Partitions are only written once the partition_months setting is enabled.
+
+    :param report_progress:
+    :return:
+    """
+    db.create_tables([HistoricPartition], safe=True)
+
+
+class SchemaMigrator(object):
+    """
+    SchemaMigrator
+
+    Brings history.db up to the latest schema version once per process.
+    Migrations run on a background thread so that the panel can keep answering requests while a
+    large database is converted. Writers wait for the migrations to finish before recording data.
+    Version 1 is the original schema that was created before versioning was added.
+    """
+
+    migrations = (
+        (2, "Store sizes as integers and timestamps as epochs, add query indexes", _migrate_integer_sizes_and_epochs),
+        (3, "Add running totals", _migrate_running_totals),
+        (4, "Add hourly and daily rollups", _migrate_time_bucketed_rollups),
+        (5, "Add composite indexes for keyset pagination", _migrate_list_sort_indexes),
+        (6, "Add full-text search index", _migrate_search_index),
+        (7, "Add retention compaction and incremental auto vacuum", _migrate_retention),
+        (8, "Store the total destination size of each task", _migrate_task_destination_size),
+        (9, "Add compression ratio, bytes saved and duration histograms", _migrate_distributions),
+        (10, "Add library and file extension breakdowns", _migrate_breakdowns),
+        (11, "Add task throughput and throughput aggregates", _migrate_throughput),
+        (12, "Add monthly history partitions", _migrate_partitions),
+    )
+    models = (
+        SchemaVersion,
+        HistoricTasks,
+        HistoricTaskProbe,
+        HistoricTotals,
+        HistoricHourlyTotals,
+        HistoricDailyTotals,
+        HistoricCompaction,
+        HistoricDistribution,
+        HistoricBreakdown,
+        HistoricPartition,
+    )
+
+    # Set once the migrations have run. False when SQLite was built without FTS5.
+    search_index_available = False
+
+    _lock = threading.Lock()
+    _ready = threading.Event()
+    _thread = None
+    _status = {
+        "state":       "pending",
+        "version":     None,
+        "description": "",
+        "done":        0,
+        "total":       0,
+    }
+
+    @classmethod
+    def latest_version(cls):
+        return max([1] + [version for version, _description, _function in cls.migrations])
+
+    @classmethod
+    def ready(cls, wait=False, timeout=None):
+        """
+        Start the migrations if they have not been started yet.
+        Returns True once the schema is up to date (or the migrations have given up).
+
+        :param wait:
+        :param timeout:
+        :return:
+        """
+        if cls._ready.is_set():
+            return True
+        with cls._lock:
+            if cls._thread is None:
+                cls._thread = threading.Thread(
+                    target=cls._run,
+                    name="FileSizeMetricsSchemaMigrator",
+                    daemon=True,
+                )
+                cls._thread.start()
+        if wait:
+            cls._ready.wait(timeout)
+        return cls._ready.is_set()
+
+    @classmethod
+    def get_status(cls):
+        return dict(cls._status)
+
+    @classmethod
+    def get_upgrade_message(cls):
+        status = cls.get_status()
+        message = "The metrics database is being upgraded to a new format. This panel will refresh when it is ready."
+        if status.get("total"):
+            percent = min(100, int(status.get("done", 0) * 100 / status.get("total")))
+            message = "{} ({}% complete)".format(message, percent)
+        return message
+
+    @classmethod
+    def _report_progress(cls, done, total):
+        cls._status["done"] = done
+        cls._status["total"] = total
+
+    @staticmethod
+    def _table_exists(table_name):
+        return table_name in db.get_tables()
+
+    @classmethod
+    def _current_version(cls):
+        if not cls._table_exists(SchemaVersion._meta.table_name):
+            db.create_tables([SchemaVersion], safe=True)
+            if cls._table_exists(HistoricTasks._meta.table_name):
+                # Tables created before schema versioning was introduced
+                SchemaVersion.create(version=1, description="Initial schema")
+            else:
+                # Brand new database. Create everything at the latest version.
+                cls._create_latest_schema()
+        return SchemaVersion.select(SchemaVersion.version).order_by(SchemaVersion.version.desc()).scalar() or 1
+
+    @classmethod
+    def _create_latest_schema(cls):
+        db.create_tables(cls.models, safe=True)
+        SchemaVersion.create(version=cls.latest_version(), description="Initial schema")
+
+    @classmethod
+    def _initialise_data(cls):
+        # Create the singleton rows and the search index if they are missing
+        HistoricCompaction.insert(id=TOTALS_ROW_ID).on_conflict_ignore().execute()
+        if _read_totals() is None:
+            _store_totals(_compute_totals())
+        cls.search_index_available = _ensure_search_index(cls._report_progress)
+
+    @classmethod
+    def create_new_database(cls):
+        """
+        Create the latest schema in a new, empty database file.
+        Used after the metrics have been reset. Must be called with a connection open.
+
+        :return:
+        """
+        db.create_tables([SchemaVersion], safe=True)
+        cls._create_latest_schema()
+        cls._initialise_data()
+
+    @classmethod
+    def _run(cls):
+        try:
+            db.connect(reuse_if_open=True)
+            current_version = cls._current_version()
+            for version, description, function in cls.migrations:
+                if version <= current_version:
+                    continue
+                logger.info("Migrating history database to schema version %s - %s", version, description)
+                cls._status.update(
+                    {"state": "migrating", "version": version, "description": description, "done": 0, "total": 0}
+                )
+                started = time.monotonic()
+                # Table rebuilds leave foreign keys dangling part way through. Disable the checks on this
+                # connection only for the duration of the migration.
+                db.execute_sql("PRAGMA foreign_keys = OFF")
+                try:
+                    function(cls._report_progress)
+                finally:
+                    db.execute_sql("PRAGMA foreign_keys = ON")
+                SchemaVersion.create(version=version, description=description)
+                current_version = version
+                logger.info(
+                    "Migrated history database to schema version %s in %.1f seconds",
+                    version,
+                    time.monotonic() - started,
+                )
+            db.create_tables(cls.models, safe=True)
+            cls._initialise_data()
+            cls._status.update({"state": "ready", "version": current_version})
+            DataVersion.bump()
+            RetentionManager.start()
+        except Exception:
+            logger.exception("Failed to migrate the history database schema.")
+            cls._status["state"] = "failed"
+        finally:
+            try:
+                if not db.is_closed():
+                    db.close()
+            except OperationalError:
+                pass
+            cls._ready.set()
+
+
+# Rows fetched from the export cursor, and written to each chunk of the response, at a time
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {
+    "csv":    "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+EXPORT_CSV_COLUMNS = [
+    "task_id",
+    "task_label",
+    "task_success",
+    "start_time",
+    "finish_time",
+    "probe_type",
+    "abspath",
+    "basename",
+    "size",
+]
+
+
+# Task results written per transaction while importing history
+IMPORT_BATCH_SIZE = 5000
+
+
+def _find_data_log_record(entry, depth=0):
+    # Data log records may be wrapped by the log formatter. Look a couple of levels down for the fields.
+    if not isinstance(entry, dict):
+        return None
+    if "source_abspath" in entry and "dest_abspath" in entry:
+        return entry
+    if depth >= 2:
+        return None
+    for value in entry.values():
+        record = _find_data_log_record(value, depth + 1)
+        if record is not None:
+            return record
+    return None
+
+
+def _parse_data_search_key_library(data_search_key):
+    # The search key is written as "<task_id> | <library_id> | <source path>"
+    parts = str(data_search_key or "").split(" | ", 2)
+    if len(parts) == 3 and parts[1].strip().isdigit():
+        return int(parts[1])
+    return None
+
+
+def _parse_data_log_line(line):
+    """
+    Convert a "file_size_metrics" data log line into a task result.
+    Returns None for lines that are not complete file size metric records.
+
+    :param line:
+    :return:
+    """
+    start = line.find("{")
+    if start < 0 or "source_abspath" not in line:
+        return None
+    try:
+        record = _find_data_log_record(json.loads(line[start:]))
+    except ValueError:
+        return None
+    if record is None:
+        return None
+    finish_time = get_epoch_seconds(record.get("finish_time"))
+    start_time = get_epoch_seconds(record.get("start_time"))
+    if finish_time is None:
+        return None
+    if start_time is None:
+        start_time = finish_time - int(float(record.get("processing_duration") or 0))
+    try:
+        destinations = record.get("destination_files")
+        if not destinations:
+            # Records written before every destination file was logged
+            destinations = [{"abspath": record["dest_abspath"], "size": record.get("dest_size")}]
+        return {
+            "source_abspath": record["source_abspath"],
+            "source_size":    int(record.get("source_size") or 0),
+            "library_id":     _parse_data_search_key_library(record.get("data_search_key")),
+            "start_time":     start_time,
+            "destinations":   [
+                {"abspath": destination["abspath"], "size": int(destination.get("size") or 0)}
+                for destination in destinations
+            ],
+            "finish_time":    finish_time,
+        }
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _expand_import_paths(paths):
+    # Accept files, directories and glob patterns
+    expanded = []
+    for path in paths:
+        path = os.path.expanduser(path)
+        if os.path.isdir(path):
+            expanded.extend(sorted(glob.glob(os.path.join(path, "*.log*")) + glob.glob(os.path.join(path, "*.json*"))))
+        elif glob.has_magic(path):
+            expanded.extend(sorted(glob.glob(path)))
+        else:
+            expanded.append(path)
+    return [path for path in expanded if os.path.isfile(path)]
+
+
+def iter_data_log_results(paths):
+    """
+    Yield the task results recorded in Unmanic data log files.
+    Plain and gzip compressed files are read a line at a time.
+
+    :param paths:
+    :return:
+    """
+    for path in _expand_import_paths(paths):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                result = _parse_data_log_line(line)
+                if result is not None:
+                    yield result
+
+
+def get_result_destinations(result):
+    """
+    Return the (abspath, size) pairs of the destination files of a task result.
+    A result lists its files under "destinations", or holds a single file in "destination_abspath" and
+    "destination_size".
+
+    :param result:
+    :return:
+    """
+    destinations = result.get("destinations")
+    if destinations is None:
+        destinations = [{"abspath": result["destination_abspath"], "size": result["destination_size"]}]
+    return [(destination["abspath"], int(destination.get("size") or 0)) for destination in destinations]
+
+
+class LibraryAssignmentCache(object):
+    """
+    LibraryAssignmentCache
+
+    Process-wide cache of whether this plugin is enabled on any Unmanic library.
+    Checking the libraries costs a query against Unmanic's database for every library, so the answer is
+    kept for a while. A negative answer expires sooner so that a newly added plugin is noticed quickly.
+    """
+
+    positive_ttl = 600
+    negative_ttl = 30
+
+    _lock = threading.Lock()
+    _assigned = None
+    _expires_at = 0.0
+
+    @classmethod
+    def get(cls):
+        if cls._assigned is None or time.monotonic() >= cls._expires_at:
+            return None
+        return cls._assigned
+
+    @classmethod
+    def set(cls, assigned):
+        ttl = cls.positive_ttl if assigned else cls.negative_ttl
+        cls._assigned = bool(assigned)
+        cls._expires_at = time.monotonic() + ttl
+
+    @classmethod
+    def invalidate(cls):
+        cls._assigned = None
+        cls._expires_at = 0.0
+
+    @classmethod
+    def is_assigned(cls, lookup):
+        """
+        Return the cached assignment state, calling lookup() to refresh it when it has expired.
+        Only one thread runs the lookup at a time. A failed lookup is not cached.
+
+        :param lookup:
+        :return:
+        """
+        assigned = cls.get()
+        if assigned is not None:
+            return assigned
+        with cls._lock:
+            assigned = cls.get()
+            if assigned is not None:
+                return assigned
+            assigned = lookup()
+            if assigned is not None:
+                cls.set(assigned)
+        return bool(assigned)
+
+
+class LibraryNameCache(object):
+    """
+    LibraryNameCache
+
+    Process-wide cache of the Unmanic library names, by library ID, for the breakdown and throughput
+    responses. Reading them is a query against Unmanic's database, so they are kept for a while.
+    A renamed or newly added library shows its name once the cache expires.
+    """
+
+    ttl = 300
+
+    _lock = threading.Lock()
+    _names = None
+    _expires_at = 0.0
+
+    @classmethod
+    def get_names(cls, lookup):
+        """
+        Return the cached library names, calling lookup() to refresh them when they have expired.
+        Only one thread runs the lookup at a time. A failed lookup returns None and is not cached.
+
+        :param lookup:
+        :return:
+        """
+        names = cls._names
+        if names is not None and time.monotonic() < cls._expires_at:
+            return names
+        with cls._lock:
+            if cls._names is not None and time.monotonic() < cls._expires_at:
+                return cls._names
+            names = lookup()
+            if names is None:
+                return {}
+            cls._names = names
+            cls._expires_at = time.monotonic() + cls.ttl
+        return names
+
+
+class DataVersion(object):
+    """
+    DataVersion
+
+    A number that increases every time the recorded history changes. Panel responses carry it, and a
+    request that sends back the current version is answered with a short "not modified" reply.
+    It is only held in memory. It starts from the process start time in milliseconds, so that it still
+    increases across restarts. Threads can wait for it to change.
+    The generation changes whenever the database file is replaced. Row IDs start again in a new file, so an
+    ID watermark only means something within the generation it was read in. A restart also starts a new
+    generation, in case the file was replaced while Unmanic was stopped.
+    """
+
+    _changed = threading.Condition()
+    _version = int(time.time() * 1000)
+    _generation = _version
+
+    @classmethod
+    def get(cls):
+        return cls._version
+
+    @classmethod
+    def get_generation(cls):
+        return cls._generation
+
+    @classmethod
+    def new_generation(cls):
+        with cls._changed:
+            cls._generation = max(int(time.time() * 1000), cls._generation + 1)
+
+    @classmethod
+    def bump(cls):
+        # Must be called after the change has been committed
+        with cls._changed:
+            cls._version += 1
+            cls._changed.notify_all()
+        ResponseCache.clear()
+
+    @classmethod
+    def wait_for_change(cls, version, timeout):
+        """
+        Wait until the version is no longer the given version, or the timeout in seconds has passed.
+        Returns the current version.
+
+        :param version:
+        :param timeout:
+        :return:
+        """
+        with cls._changed:
+            cls._changed.wait_for(lambda: str(cls._version) != str(version), timeout)
+            return cls._version
+
+    @classmethod
+    def matches(cls, version):
+        return version is not None and str(version) == str(cls._version)
+
+
+class ResponseCache(object):
+    """
+    ResponseCache
+
+    The most recently used panel responses, keyed by endpoint and request parameters.
+    Each entry holds the data version it was built from and is only returned for that version.
+    """
+
+    max_entries = 64
+
+    _lock = threading.Lock()
+    _entries = collections.OrderedDict()
+
+    @classmethod
+    def get(cls, endpoint, key, version):
+        with cls._lock:
+            entry = cls._entries.get((endpoint, key))
+            if entry is None or entry[0] != version:
+                return None
+            cls._entries.move_to_end((endpoint, key))
+            return entry[1]
+
+    @classmethod
+    def set(cls, endpoint, key, version, value):
+        with cls._lock:
+            cls._entries[(endpoint, key)] = (version, value)
+            cls._entries.move_to_end((endpoint, key))
+            while len(cls._entries) > cls.max_entries:
+                cls._entries.popitem(last=False)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+
+
+class PartitionRouter(object):
+    """
+    PartitionRouter
+
+    Sends queries to the monthly partition files that PartitionManager moved old tasks into.
+    Partitions are listed in the HistoricPartition table, so the list is read from the same snapshot as the
+    rest of a request. A partition file never changes once it is listed. It is opened on demand as its own
+    read-only, immutable connection, which SQLite reads without taking any locks. Each file has the same task,
+    probe and search tables as history.db, so the SQL built for history.db runs against it unchanged.
+    """
+
+    @staticmethod
+    def path(name):
+        return os.path.join(partition_directory, "history-{}.db".format(name))
+
+    @staticmethod
+    def list_partitions(from_time=None, to_time=None):
+        """
+        Read the partitions of the months that overlap from_time to to_time (UTC epoch seconds), oldest first.
+        Must be called with a connection open.
+
+        :param from_time:
+        :param to_time:
+        :return:
+        """
+        # The table does not exist yet while the earlier migrations run
+        if not SchemaMigrator.ready() and not HistoricPartition.table_exists():
+            return []
+        query = HistoricPartition.select().order_by(HistoricPartition.month_start)
+        if from_time is not None:
+            query = query.where(HistoricPartition.month_end > from_time)
+        if to_time is not None:
+            query = query.where(HistoricPartition.month_start < to_time)
+        return list(query.dicts())
+
+    @classmethod
+    @contextlib.contextmanager
+    def connect(cls, partition):
+        """
+        Open a partition file read-only. Yields None if the file has gone missing.
+
+        :param partition:
+        :return:
+        """
+        path = cls.path(partition["name"])
+        if not os.path.exists(path):
+            # Retention may have dropped it after this request's snapshot was taken
+            logger.warning("The history partition file '%s' is missing, its tasks are left out.", path)
+            yield None
+            return
+        connection = sqlite3.connect(
+            "file:{}?mode=ro&immutable=1".format(urllib.request.pathname2url(path)),
+            uri=True,
+            check_same_thread=False,
+        )
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def execute(connection, sql, params=None):
+        started = time.perf_counter()
+        cursor = connection.execute(sql, params or ())
+        Instrumentation.record_query(
+            sql,
+            params,
+            (time.perf_counter() - started) * 1000,
+            lambda: explain_query_plan(connection.cursor(), sql, params),
+        )
+        return cursor
+
+    @classmethod
+    def query(cls, sql, params=None, partitions=None):
+        """
+        Run a query against each partition in turn, yielding the partition and the open cursor.
+        The cursor must be read before the next partition is requested.
+
+        :param sql:
+        :param params:
+        :param partitions: defaults to every partition
+        :return:
+        """
+        if partitions is None:
+            partitions = cls.list_partitions()
+        for partition in partitions:
+            with cls.connect(partition) as connection:
+                if connection is not None:
+                    yield partition, cls.execute(connection, sql, params)
+
+
+class DatabaseGate(object):
+    """
+    DatabaseGate
+
+    Lets any number of threads use the database at the same time, or one thread replace the database file
+    while nobody is using it. Threads that arrive while the file is being replaced wait for it to finish,
+    then carry on with the new file.
+    """
+
+    _condition = threading.Condition()
+    _users = 0
+    _exclusive = False
+
+    @classmethod
+    def enter(cls):
+        with cls._condition:
+            while cls._exclusive:
+                cls._condition.wait()
+            cls._users += 1
+
+    @classmethod
+    def leave(cls):
+        with cls._condition:
+            cls._users -= 1
+            if not cls._users:
+                cls._condition.notify_all()
+
+    @classmethod
+    @contextlib.contextmanager
+    def exclusive(cls, timeout=30):
+        """
+        Wait until no other thread is using the database and keep new users out until the block exits.
+        Raises TimeoutError if the database is still in use after timeout seconds.
+        Must not be used by a thread that is inside Data.db_start().
+
+        :param timeout:
+        :return:
+        """
+        deadline = time.monotonic() + timeout
+        with cls._condition:
+            while cls._exclusive:
+                cls._condition.wait()
+            cls._exclusive = True
+            try:
+                while cls._users:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("The history database is still in use.")
+                    cls._condition.wait(remaining)
+            except Exception:
+                cls._exclusive = False
+                cls._condition.notify_all()
+                raise
+        try:
+            yield
+        finally:
+            with cls._condition:
+                cls._exclusive = False
+                cls._condition.notify_all()
+
+
+class DatabaseWriter(object):
+    """
+    DatabaseWriter
+
+    Runs every write in this process one at a time, each in its own IMMEDIATE transaction.
+    Threads in this process queue on a lock rather than in SQLite's busy handler. If another process holds
+    the write lock for longer than the busy timeout, the write is retried a few times before giving up.
+    """
+
+    attempts = 5
+    retry_delay = 0.5
+
+    _lock = threading.RLock()
+
+    @classmethod
+    @contextlib.contextmanager
+    def locked(cls):
+        """
+        Hold back every other write from this process until the block exits.
+        Writes inside the block still go through run(), each in its own transaction.
+
+        :return:
+        """
+        with cls._lock:
+            yield
+
+    @staticmethod
+    def is_busy_error(error):
+        message = str(error).lower()
+        return "locked" in message or "busy" in message
+
+    @classmethod
+    def run(cls, function, *args, **kwargs):
+        """
+        Call function inside a write transaction and return its result.
+        The function may be called again if the transaction could not be started, so it must not have any
+        side effects outside of the database.
+
+        :param function:
+        :return:
+        """
+        for attempt in range(1, cls.attempts + 1):
+            try:
+                with cls._lock:
+                    with db.atomic("IMMEDIATE"):
+                        return function(*args, **kwargs)
+            except OperationalError as e:
+                if attempt >= cls.attempts or not cls.is_busy_error(e):
+                    raise
+                logger.warning("The history database is busy, retrying the write (attempt %s).", attempt)
+            time.sleep(cls.retry_delay * attempt)
+
+
+class Data(object):
+    # Depth of nested db_start() calls on each thread. The thread keeps its connection until the
+    # outermost caller is done with it, then returns it to the pool.
+    _connection_state = threading.local()
+
+    def __init__(self):
+        self.create_db_schema()
+
+    def db_start(self, read_only=False):
+        """
+        Open this thread's connection, or reuse the one already opened by an outer caller.
+        With read_only, the outermost caller takes a connection from the read-only pool and every query until
+        the matching db_stop() reads from the same snapshot. Nested callers keep the outer caller's connection.
+
+        :param read_only:
+        :return:
+        """
+        depth = getattr(self._connection_state, "depth", 0)
+        self._connection_state.depth = depth + 1
+        if depth:
+            return
+        DatabaseGate.enter()
+        db.use_reader(read_only)
+        try:
+            db.connect(reuse_if_open=True)
+            if read_only:
+                # A deferred transaction takes its snapshot at the first read
+                self._connection_state.snapshot = db.transaction()
+                self._connection_state.snapshot.__enter__()
+        except OperationalError:
+            pass
+        except Exception:
+            # No connection could be taken, such as when the pool stays full. The caller does not get to its
+            # db_stop(), so nothing may be left behind for it, including its place in the DatabaseGate.
+            self._connection_state.depth = depth
+            self._connection_state.snapshot = None
+            try:
+                if not db.is_closed():
+                    db.close()
+            finally:
+                db.use_reader(False)
+                DatabaseGate.leave()
+            raise
+
+    def db_stop(self):
+        depth = max(getattr(self._connection_state, "depth", 0) - 1, 0)
+        self._connection_state.depth = depth
+        if depth:
+            return
+        snapshot = getattr(self._connection_state, "snapshot", None)
+        self._connection_state.snapshot = None
+        try:
+            if snapshot is not None:
+                snapshot.__exit__(None, None, None)
+        except OperationalError:
+            pass
+        try:
+            if not db.is_closed():
+                db.close()
+        except OperationalError:
+            pass
+        finally:
+            db.use_reader(False)
+            DatabaseGate.leave()
+
+    @staticmethod
+    def get_empty_state_message():
+        return (
+            "No file size metrics have been collected yet. "
+            "Add this plugin to at least one library, then process files to populate this panel."
+        )
+
+    @staticmethod
+    def is_assigned_to_any_library(has_recorded_tasks=False):
+        if has_recorded_tasks:
+            # Tasks are only recorded by libraries that have this plugin enabled
+            return True
+        return LibraryAssignmentCache.is_assigned(Data.lookup_library_assignment)
+
+    @staticmethod
+    @Instrumentation.measured("library_assignment")
+    def lookup_library_assignment():
+        try:
+            for library in Library.get_all_libraries():
+                enabled_plugins = Library(library.get("id")).get_enabled_plugins()
+                for enabled_plugin in enabled_plugins:
+                    if enabled_plugin.get("plugin_id") == PLUGIN_ID:
+                        return True
+        except Exception:
+            logger.exception(
+                "Failed to determine if file size metrics is assigned to a library."
+            )
+            return None
+        return False
+
+    def clear_all_data(self, keep_backup=False):
+        """
+        Clear all historical data by replacing the database file with a new, empty one.
+        This takes the same short time however large the history is. Threads that try to use the database
+        while the file is replaced wait for it to finish and then carry on with the new file.
+        The monthly partition files are removed with it.
+        If keep_backup is True, the old file and partitions are renamed aside instead of being deleted.
+        Returns True if successful, False otherwise.
+        """
+        if getattr(self._connection_state, "depth", 0):
+            logger.error("Unable to clear historical data while this thread is using the database.")
+            return False
+        try:
+            with DatabaseGate.exclusive():
+                # Nothing is using the pool now, so this closes every connection to the old file.
+                # The last connection to close checkpoints the WAL into the database file.
+                db.close_all()
+                DataVersion.new_generation()
+                backup_suffix = None
+                backup_path = None
+                if keep_backup:
+                    backup_suffix = ".{}.bak".format(time.strftime("%Y%m%d-%H%M%S", time.gmtime()))
+                    backup_path = db_file + backup_suffix
+                for suffix in ("", "-wal", "-shm"):
+                    if not os.path.exists(db_file + suffix):
+                        continue
+                    if backup_path:
+                        os.replace(db_file + suffix, backup_path + suffix)
+                    else:
+                        os.remove(db_file + suffix)
+                if os.path.isdir(partition_directory):
+                    if backup_suffix:
+                        os.replace(partition_directory, partition_directory + backup_suffix)
+                    else:
+                        shutil.rmtree(partition_directory)
+                db.connect()
+                try:
+                    SchemaMigrator.create_new_database()
+                finally:
+                    db.close()
+            # The cleared history can no longer prove that the plugin is assigned
+            LibraryAssignmentCache.invalidate()
+            if backup_path:
+                logger.info("All file size metrics data has been cleared. The old history was kept in '%s'.", backup_path)
+            else:
+                logger.info("All file size metrics data has been cleared.")
+            success = True
+        except Exception:
+            logger.exception("Failed to clear historical data from database.")
+            success = False
+        # Even a failed reset may have removed the old file
+        DataVersion.bump()
+        return success
+
+    def create_db_schema(self):
+        # Create required tables in a new DB or migrate an existing DB to the latest schema version.
+        # This only does any work the first time it is called in a process.
+        if SchemaMigrator.ready():
+            return
+        logger.debug("Ensuring history database schema is up to date")
+        SchemaMigrator.ready(wait=True)
+
+    def get_totals(self):
+        """
+        Read the running totals row.
+        If the row has gone missing, the totals are calculated from the raw rows. A writer stores the result,
+        a reader leaves the row to be recreated by the next write.
+
+        :return:
+        """
+        self.db_start(read_only=True)
+        try:
+            totals = _read_totals()
+            if totals is None:
+                totals = _compute_totals() if db.reading else DatabaseWriter.run(_restore_totals)
+            return totals
+        finally:
+            self.db_stop()
+
+    def verify_totals(self, repair=True):
+        """
+        Recalculate the running totals from the raw rows and compare them with the stored totals.
+        If repair is True and they differ, the stored totals are replaced with the recalculated values.
+
+        :param repair:
+        :return:
+        """
+
+        def compare():
+            stored_totals = _read_totals()
+            computed_totals = _compute_totals()
+            if repair and stored_totals != computed_totals:
+                _store_totals(computed_totals)
+                _rebuild_rollups()
+            return stored_totals, computed_totals
+
+        self.db_start()
+        try:
+            stored, computed = DatabaseWriter.run(compare)
+            consistent = stored == computed
+            if repair and not consistent:
+                DataVersion.bump()
+            if not consistent:
+                logger.warning("Stored file size metrics totals %s did not match the history %s.", stored, computed)
+            return {
+                "consistent": consistent,
+                "repaired":   bool(repair and not consistent),
+                "stored":     stored,
+                "computed":   computed,
+            }
+        finally:
+            self.db_stop()
+
+    @staticmethod
+    def _increment_totals(source_size=0, destination_size=0, success_count=0, task_count=0):
+        # Must be called inside the transaction that writes the rows being counted
+        updated = (
+            HistoricTotals.update(
+                source_size=HistoricTotals.source_size + source_size,
+                destination_size=HistoricTotals.destination_size + destination_size,
+                success_count=HistoricTotals.success_count + success_count,
+                task_count=HistoricTotals.task_count + task_count,
+            )
+            .where(HistoricTotals.id == TOTALS_ROW_ID)
+            .execute()
+        )
+        if not updated:
+            # The totals row is missing. Rebuild it, including the rows written by this transaction.
+            _store_totals(_compute_totals())
+
+    def get_distribution(self, metrics=None):
+        """
+        Read the histograms of the given metrics and estimate their p50, p90 and p99.
+        The cost depends on the number of bins, not the number of tasks.
+
+        :param metrics:
+        :return:
+        """
+        metrics = list(metrics or DISTRIBUTION_METRICS)
+        for metric in metrics:
+            if metric not in DISTRIBUTION_METRICS:
+                raise ValueError("Unsupported distribution metric '{}'".format(metric))
+        self.db_start(read_only=True)
+        try:
+            query = (
+                HistoricDistribution.select(
+                    HistoricDistribution.metric,
+                    HistoricDistribution.bin,
+                    HistoricDistribution.count,
+                )
+                .where(HistoricDistribution.metric.in_(metrics) & (HistoricDistribution.count > 0))
+                .order_by(HistoricDistribution.metric, HistoricDistribution.bin)
+                .tuples()
+            )
+            bins_by_metric = {metric: [] for metric in metrics}
+            for metric, bin_index, count in query:
+                bins_by_metric[metric].append((bin_index, count))
+        finally:
+            self.db_stop()
+
+        results = {}
+        for metric, bins in bins_by_metric.items():
+            spec = DISTRIBUTION_METRICS[metric]
+            # Ratios need decimals, bytes and seconds do not
+            precision = 4 if spec["unit"] == "ratio" else 0
+            total = sum(count for _bin_index, count in bins)
+            result = {
+                "unit":      spec["unit"],
+                "count":     total,
+                "histogram": [],
+            }
+            for percent in (50, 90, 99):
+                value = _distribution_percentile(metric, bins, total, percent)
+                result["p{}".format(percent)] = round(value, precision) if value is not None else None
+            for bin_index, count in bins:
+                lower, upper = _distribution_bin_bounds(metric, bin_index)
+                result["histogram"].append(
+                    {
+                        "lower": round(lower, precision),
+                        "upper": round(upper, precision),
+                        "count": count,
+                    }
+                )
+            results[metric] = result
+        return results
+
+    def get_breakdown(self, dimensions=None):
+        """
+        Read the totals of successful tasks grouped by library and by source file extension.
+        Groups are sorted by the space they saved, largest first. The cost depends on the number of
+        groups, not the number of tasks.
+
+        :param dimensions:
+        :return:
+        """
+        dimensions = list(dimensions or BREAKDOWN_DIMENSIONS)
+        for dimension in dimensions:
+            if dimension not in BREAKDOWN_DIMENSIONS:
+                raise ValueError("Unsupported breakdown dimension '{}'".format(dimension))
+        self.db_start(read_only=True)
+        try:
+            query = (
+                HistoricBreakdown.select(
+                    HistoricBreakdown.dimension,
+                    HistoricBreakdown.key,
+                    HistoricBreakdown.source_size,
+                    HistoricBreakdown.destination_size,
+                    HistoricBreakdown.task_count,
+                )
+                .where(HistoricBreakdown.dimension.in_(dimensions) & (HistoricBreakdown.task_count > 0))
+                .order_by(
+                    HistoricBreakdown.dimension,
+                    (HistoricBreakdown.source_size - HistoricBreakdown.destination_size).desc(),
+                )
+                .tuples()
+            )
+            results = {dimension: [] for dimension in dimensions}
+            for dimension, key, source_size, destination_size, task_count in query:
+                results[dimension].append(
+                    {
+                        "key":         key,
+                        "source":      source_size,
+                        "destination": destination_size,
+                        "saved":       source_size - destination_size,
+                        "task_count":  task_count,
+                    }
+                )
+        finally:
+            self.db_stop()
+
+        if results.get("library"):
+            library_names = self.get_library_names()
+            for group in results["library"]:
+                group["name"] = library_names.get(group["key"])
+        return results
+
+    @staticmethod
+    def get_library_names():
+        # Map library IDs, as breakdown keys, to the library names
+        return LibraryNameCache.get_names(Data.lookup_library_names)
+
+    @staticmethod
+    @Instrumentation.measured("library_names")
+    def lookup_library_names():
+        try:
+            return {str(library.get("id")): library.get("name") for library in Library.get_all_libraries()}
+        except Exception:
+            logger.exception("Failed to read the Unmanic library names.")
+            return None
+
+    @staticmethod
+    def _get_timeseries_range(model, from_time=None, to_time=None):
+        # Align the range to whole buckets. It defaults to the model's default bucket count up to now.
+        seconds = model.bucket_seconds
+        if to_time is None:
+            to_time = int(time.time())
+        to_time = to_time - (to_time % seconds)
+        if from_time is None:
+            from_time = to_time - ((model.default_bucket_count - 1) * seconds)
+        from_time = max(from_time - (from_time % seconds), to_time - ((TIMESERIES_MAX_BUCKETS - 1) * seconds))
+        return from_time, to_time
+
+    def get_throughput(self, bucket="day", from_time=None, to_time=None):
+        """
+        Read the processing throughput of successful tasks for each time bucket between two UTC epoch
+        timestamps, for each library and overall.
+        The mean throughput is the source size processed divided by the time spent processing it, and the
+        max throughput is the highest throughput of a single task, both in bytes per second.
+        The cost depends on the number of buckets and libraries, not the number of tasks.
+
+        :param bucket:
+        :param from_time:
+        :param to_time:
+        :return:
+        """
+        model = ROLLUP_MODELS.get(bucket)
+        if model is None:
+            raise ValueError("Unsupported timeseries bucket '{}'".format(bucket))
+        from_time, to_time = self._get_timeseries_range(model, from_time, to_time)
+
+        def summarise(source_size, task_count, processing_duration, max_throughput):
+            return {
+                "task_count":          task_count,
+                "processing_duration": processing_duration,
+                "mean_throughput":     get_throughput(source_size, processing_duration),
+                "max_throughput":      max_throughput or None,
+            }
+
+        self.db_start(read_only=True)
+        try:
+            bucket_query = (
+                model.select(
+                    model.bucket_start,
+                    model.source_size,
+                    model.task_count,
+                    model.processing_duration,
+                    model.max_throughput,
+                )
+                .where((model.bucket_start >= from_time) & (model.bucket_start <= to_time))
+                .order_by(model.bucket_start)
+                .tuples()
+            )
+            library_query = (
+                HistoricBreakdown.select(
+                    HistoricBreakdown.key,
+                    HistoricBreakdown.source_size,
+                    HistoricBreakdown.task_count,
+                    HistoricBreakdown.processing_duration,
+                    HistoricBreakdown.max_throughput,
+                )
+                .where((HistoricBreakdown.dimension == "library") & (HistoricBreakdown.task_count > 0))
+                .order_by(HistoricBreakdown.key)
+                .tuples()
+            )
+            results = {
+                "bucket":         bucket,
+                "bucket_seconds": model.bucket_seconds,
+                "from":           from_time,
+                "to":             to_time,
+                "data":           [],
+                "libraries":      [],
+            }
+            for bucket_start, source_size, task_count, processing_duration, max_throughput in bucket_query:
+                results["data"].append(
+                    dict(
+                        summarise(source_size, task_count, processing_duration, max_throughput),
+                        bucket_start=bucket_start,
+                    )
+                )
+            # Every task is counted under exactly one library, so the libraries add up to the overall figures
+            overall = [0, 0, 0, 0]
+            for key, source_size, task_count, processing_duration, max_throughput in library_query:
+                results["libraries"].append(
+                    dict(summarise(source_size, task_count, processing_duration, max_throughput), key=key)
+                )
+                overall = [
+                    overall[0] + source_size,
+                    overall[1] + task_count,
+                    overall[2] + processing_duration,
+                    max(overall[3], max_throughput),
+                ]
+            results["overall"] = summarise(*overall)
+        finally:
+            self.db_stop()
+
+        if results["libraries"]:
+            library_names = self.get_library_names()
+            for library in results["libraries"]:
+                library["name"] = library_names.get(library["key"])
+        return results
+
+    def get_timeseries(self, bucket="day", from_time=None, to_time=None):
+        """
+        Read the rollup rows for the given bucket size between two UTC epoch timestamps.
+        The cost depends on the number of buckets in the range, not the number of tasks.
+
+        :param bucket:
+        :param from_time:
+        :param to_time:
+        :return:
+        """
+        model = ROLLUP_MODELS.get(bucket)
+        if model is None:
+            raise ValueError("Unsupported timeseries bucket '{}'".format(bucket))
+        seconds = model.bucket_seconds
+        from_time, to_time = self._get_timeseries_range(model, from_time, to_time)
+
+        self.db_start(read_only=True)
+        try:
+            query = (
+                model.select(
+                    model.bucket_start,
+                    model.source_size,
+                    model.destination_size,
+                    model.task_count,
+                    model.processing_duration,
+                )
+                .where((model.bucket_start >= from_time) & (model.bucket_start <= to_time))
+                .order_by(model.bucket_start)
+                .tuples()
+            )
+            results = {
+                "bucket":         bucket,
+                "bucket_seconds": seconds,
+                "from":           from_time,
+                "to":             to_time,
+                "data":           [],
+            }
+            for bucket_start, source_size, destination_size, task_count, processing_duration in query:
+                results["data"].append(
+                    {
+                        "bucket_start":        bucket_start,
+                        "source":              source_size,
+                        "destination":         destination_size,
+                        "task_count":          task_count,
+                        "processing_duration": processing_duration,
+                    }
+                )
+            return results
+        finally:
+            self.db_stop()
+
+    def get_total_historic_task_list_count(self):
+        # The list has a row for each destination file, which is not the task count when a task wrote several
+        return self.count_historic_task_query()
+
+    def build_historic_task_query(self, search_value=None, search_mode="prefix", walk_sort_index=False):
+        query = HistoricTaskProbe.select(
+            HistoricTaskProbe.id,
+            HistoricTaskProbe.historictask_id,
+            HistoricTaskProbe.type,
+            HistoricTaskProbe.abspath,
+            HistoricTaskProbe.basename,
+            HistoricTasks.task_success,
+            HistoricTasks.start_time,
+            HistoricTasks.finish_time,
+        )
+
+        predicate = (HistoricTaskProbe.historictask_id == HistoricTasks.id) & (
+            HistoricTaskProbe.type == "destination"
+        )
+        query = query.join(HistoricTasks, on=predicate)
+
+        if search_value:
+            match_expression = self.get_search_match_expression(search_value, search_mode)
+            if match_expression:
+                matching_tasks = HistoricTaskSearch.select(HistoricTaskSearch.rowid).where(
+                    HistoricTaskSearch.match(match_expression)
+                )
+                if walk_sort_index:
+                    # "+ 0" stops SQLite from driving the query from the search results. It walks the sort
+                    # index instead and checks each row against the matches, which is faster for broad searches.
+                    query = query.where((HistoricTasks.id + 0).in_(matching_tasks))
+                else:
+                    query = query.where(HistoricTasks.id.in_(matching_tasks))
+            else:
+                query = query.where(HistoricTasks.task_label.contains(search_value))
+
+        return query
+
+    @staticmethod
+    def get_search_match_expression(search_value, search_mode="prefix"):
+        # Substring ("contains") searches and databases without FTS5 use a LIKE scan of the task labels
+        if not SchemaMigrator.search_index_available:
+            return None
+        return _build_search_match_expression(search_value, search_mode)
+
+    def count_historic_task_query(self, search_value=None, search_mode="prefix"):
+        partitions = PartitionRouter.list_partitions()
+        if not search_value:
+            # Every probe belongs to a task, so the join is not needed to count them. The partitions have
+            # counted theirs already.
+            count = HistoricTaskProbe.select().where(HistoricTaskProbe.type == "destination").count()
+            return count + sum(partition["list_count"] for partition in partitions)
+        match_expression = self.get_search_match_expression(search_value, search_mode)
+        if match_expression:
+            # Only tasks with a destination probe are indexed, so the index can answer the count by itself
+            query = HistoricTaskSearch.select(fn.COUNT(HistoricTaskSearch.rowid)).where(
+                HistoricTaskSearch.match(match_expression)
+            )
+        else:
+            query = self.build_historic_task_query(search_value=search_value, search_mode=search_mode).select(
+                fn.COUNT(HistoricTaskProbe.id)
+            )
+        sql, params = query.sql()
+        count = db.execute_sql(sql, params).fetchone()[0]
+        for _partition, cursor in PartitionRouter.query(sql, params, partitions=partitions):
+            count += cursor.fetchone()[0]
+        return count
+
+    def get_historic_task_list_filtered_and_sorted(
+        self,
+        order=None,
+        start=0,
+        length=None,
+        search_value=None,
+        cursor_keys=None,
+        cursor_direction="next",
+        search_mode="prefix",
+        walk_sort_index=False,
+        as_tuples=False,
+    ):
+        """
+        Fetch one page of the /list results.
+
+        When cursor_keys are given, the page is found by seeking to the rows after (or before, for the
+        "prev" direction) that sort key instead of skipping over `start` rows with OFFSET.
+        With as_tuples, rows are returned as plain tuples in LIST_ROW_COLUMNS order instead of dicts.
+        Partitions are read after history.db, and their rows are merged in sort order. Partitions whose time
+        range can not reach the page are skipped.
+
+        :param order:
+        :param start:
+        :param length:
+        :param search_value:
+        :param cursor_keys:
+        :param cursor_direction:
+        :param search_mode:
+        :param walk_sort_index:
+        :param as_tuples:
+        :return:
+        """
+        query = self.build_historic_task_query(
+            search_value=search_value,
+            search_mode=search_mode,
+            walk_sort_index=walk_sort_index,
+        )
+
+        order = order or {}
+        sort_keys = LIST_SORT_KEYS.get(order.get("column"), LIST_SORT_KEYS["finish_time"])
+        sort_fields = [field for field, _row_key in sort_keys]
+        descending = order.get("dir") != "asc"
+        reverse_results = False
+
+        if cursor_keys is not None:
+            # Reading the previous page walks backwards from the first row of the current page
+            if cursor_direction == "prev":
+                descending = not descending
+                reverse_results = True
+            leading_field = sort_fields[0]
+            if descending:
+                # The leading column bound lets SQLite seek within its index. The row value comparison
+                # then skips the rows that share the cursor's sort value.
+                query = query.where(
+                    (leading_field <= cursor_keys[0]) & (Tuple(*sort_fields) < Tuple(*cursor_keys))
+                )
+            else:
+                query = query.where(
+                    (leading_field >= cursor_keys[0]) & (Tuple(*sort_fields) > Tuple(*cursor_keys))
+                )
+
+        if descending:
+            query = query.order_by(*[field.desc() for field in sort_fields])
+        else:
+            query = query.order_by(*[field.asc() for field in sort_fields])
+
+        partitions = PartitionRouter.list_partitions()
+        if partitions:
+            offset = 0 if cursor_keys is not None else int(start or 0)
+            if offset and not search_value and sort_keys[0][1] == "finish_time":
+                query, partitions, offset = self._skip_partitions_before_offset(query, partitions, descending, offset)
+            results = self._merge_partition_pages(
+                query,
+                partitions,
+                sort_keys,
+                descending,
+                offset,
+                int(length) if length is not None and int(length) > 0 else None,
+                cursor_keys,
+            )
+            if not as_tuples:
+                results = [dict(zip(LIST_ROW_COLUMNS, row), task_success=bool(row[5])) for row in results]
+        else:
+            if length is not None and int(length) > 0:
+                query = query.limit(int(length))
+                if cursor_keys is None:
+                    query = query.offset(int(start or 0))
+
+            if as_tuples:
+                # Read the rows straight from the cursor. Every column is already stored in its final form, so
+                # peewee's per-value conversions are skipped.
+                results = db.execute_sql(*query.sql()).fetchall()
+            else:
+                results = list(query.dicts())
+        if reverse_results:
+            results.reverse()
+        return results
+
+    def _skip_partitions_before_offset(self, query, partitions, descending, offset):
+        """
+        Move an offset into an unsearched finish time sort past the partitions that sort wholly before it.
+        Partitions hold separate months, so the number of rows up to the far edge of a partition is the catalog
+        count of it and the partitions before it, plus the history.db rows up to that edge. Tasks without a
+        finish time sort first in an ascending sort and last in a descending one, so a descending sort stops
+        at the first partition that holds any.
+
+        :param query: the sorted query, without a limit or offset
+        :param partitions:
+        :param descending:
+        :param offset:
+        :return: the query limited to the rows after the skipped partitions, the partitions left and the offset left
+        """
+        count_query = self.build_historic_task_query().select(fn.COUNT(HistoricTaskProbe.id))
+        if descending:
+            candidates = sorted(partitions, key=lambda partition: partition["max_finish_time"] or 0, reverse=True)
+            rows_before = 0
+        else:
+            candidates = sorted(partitions, key=lambda partition: partition["min_finish_time"] or 0)
+            rows_before = sum(partition["unfinished_list_count"] for partition in partitions)
+
+        skipped = None
+        for partition in candidates:
+            if partition["min_finish_time"] is None:
+                # Every task in it is unfinished, and an ascending sort has counted them already
+                if descending:
+                    break
+                continue
+            if descending and partition["unfinished_list_count"]:
+                break
+            rows_before += partition["list_count"] - partition["unfinished_list_count"]
+            if descending:
+                edge = partition["min_finish_time"]
+                main_query = count_query.where(HistoricTasks.finish_time >= edge)
+            else:
+                edge = partition["max_finish_time"]
+                main_query = count_query.where(
+                    (HistoricTasks.finish_time <= edge) | HistoricTasks.finish_time.is_null()
+                )
+            total = rows_before + db.execute_sql(*main_query.sql()).fetchone()[0]
+            if total > offset:
+                break
+            skipped = (partition, edge, total)
+
+        if skipped is None:
+            return query, partitions, offset
+        last_skipped, edge, total = skipped
+        if descending:
+            query = query.where((HistoricTasks.finish_time < edge) | HistoricTasks.finish_time.is_null())
+        else:
+            query = query.where(HistoricTasks.finish_time > edge)
+        return query, candidates[candidates.index(last_skipped) + 1:], offset - total
+
+    @staticmethod
+    def _merge_partition_pages(query, partitions, sort_keys, descending, offset, length, cursor_keys=None):
+        """
+        Read one page of a sorted /list query from history.db and the partitions.
+        Each source is asked for enough rows to fill the page on its own, and the sorted results are merged.
+        When the page is sorted by a time, partitions are read from the one nearest the start of the page,
+        and the rest are skipped once they can no longer hold a row that sorts before the end of the page.
+        Tasks without a finish time sort outside every time range, so partitions that hold any are always read.
+
+        :param query: the sorted query, without a limit or offset
+        :param partitions:
+        :param sort_keys: the LIST_SORT_KEYS entry the query is sorted by
+        :param descending:
+        :param offset:
+        :param length:
+        :param cursor_keys:
+        :return:
+        """
+        key_indexes = [LIST_ROW_COLUMNS.index(row_key) for _field, row_key in sort_keys]
+
+        def sort_key(row):
+            # SQLite sorts NULL before every other value
+            return tuple((row[index] is not None, row[index]) for index in key_indexes)
+
+        needed = None if length is None else offset + length
+        if needed is not None:
+            query = query.limit(needed)
+        sql, params = query.sql()
+        pages = [db.execute_sql(sql, params).fetchall()]
+
+        leading_column = sort_keys[0][1]
+        bounded = leading_column in ("start_time", "finish_time")
+        if bounded:
+            low_key, high_key = "min_" + leading_column, "max_" + leading_column
+            if leading_column == "finish_time" and cursor_keys is None:
+                for partition in partitions:
+                    if partition["unfinished_list_count"]:
+                        with PartitionRouter.connect(partition) as connection:
+                            if connection is not None:
+                                pages.append(PartitionRouter.execute(connection, sql, params).fetchall())
+                partitions = [partition for partition in partitions if not partition["unfinished_list_count"]]
+            partitions = [partition for partition in partitions if partition[low_key] is not None]
+            if cursor_keys is not None:
+                # The page only holds rows past the cursor
+                if descending:
+                    partitions = [partition for partition in partitions if partition[low_key] <= cursor_keys[0]]
+                else:
+                    partitions = [partition for partition in partitions if partition[high_key] >= cursor_keys[0]]
+            if descending:
+                partitions.sort(key=lambda partition: partition[high_key], reverse=True)
+            else:
+                partitions.sort(key=lambda partition: partition[low_key])
+
+        for partition in partitions:
+            if bounded and needed is not None:
+                merged = list(itertools.islice(heapq.merge(*pages, key=sort_key, reverse=descending), needed))
+                if len(merged) >= needed:
+                    # The page is full. This partition, and every one after it, only holds rows that sort after
+                    # the last row of the page.
+                    last_value = merged[-1][key_indexes[0]]
+                    if last_value is not None:
+                        if descending and partition[high_key] < last_value:
+                            break
+                        if not descending and partition[low_key] > last_value:
+                            break
+            with PartitionRouter.connect(partition) as connection:
+                if connection is not None:
+                    pages.append(PartitionRouter.execute(connection, sql, params).fetchall())
+
+        merged = heapq.merge(*pages, key=sort_key, reverse=descending)
+        return list(itertools.islice(merged, offset, needed))
+
+    def get_changes(self, since_id, limit=CHANGES_MAX_ROWS, generation=None):
+        """
+        Read the /list rows added after the row with the ID since_id, oldest first.
+        New rows always get a higher ID, including destinations added to a task that was recorded earlier.
+        since_id only holds within the database generation that it was read in. reset is True, and no rows are
+        read, when the given generation is not the current one or since_id is past the last row. Either means
+        that the history has been cleared since, and the client must load everything again.
+        recordsTotal and recordsFiltered are the number of /list rows without a search, as /list reports them.
+        Without a since_id, no rows are read and only the ID to start from is returned.
+
+        :param since_id:
+        :param limit:
+        :param generation:
+        :return:
+        """
+        self.db_start(read_only=True)
+        try:
+            # The file can not be replaced while this thread holds its connection, so the two agree
+            current_generation = DataVersion.get_generation()
+            last_id = HistoricTaskProbe.select(fn.MAX(HistoricTaskProbe.id)).scalar() or 0
+            reset = since_id is not None and (
+                since_id > last_id or (generation is not None and str(generation) != str(current_generation))
+            )
+            rows = []
+            if since_id is not None and not reset:
+                query = (
+                    self.build_historic_task_query()
+                    .where(HistoricTaskProbe.id > since_id)
+                    .order_by(HistoricTaskProbe.id)
+                    .limit(limit + 1)
+                )
+                rows = db.execute_sql(*query.sql()).fetchall()
+            more = len(rows) > limit
+            rows = rows[:limit]
+            records_total_count = self.get_total_historic_task_list_count()
+            results = {
+                "reset":           reset,
+                "generation":      current_generation,
+                "more":            more,
+                # With more rows to come, the next request carries on after the last row returned
+                "last_id":         rows[-1][0] if more else last_id,
+                "recordsTotal":    records_total_count,
+                "recordsFiltered": records_total_count,
+                "totals":          self.get_totals(),
+                "columns":         {name: [row[index] for row in rows] for name, index in LIST_RESPONSE_COLUMNS},
+            }
+            results["columns"]["task_success"] = [bool(row[5]) for row in rows]
+            return results
+        finally:
+            self.db_stop()
+
+    def get_history_probe_data(self, task_probe_id):
+        try:
+            task_probe_id = int(task_probe_id)
+        except (TypeError, ValueError):
+            return []
+        self.db_start(read_only=True)
+        try:
+            task_probe = HistoricTaskProbe.alias()
+            historictask_id = task_probe.select(task_probe.historictask_id).where(task_probe.id == task_probe_id)
+
+            query = HistoricTaskProbe.select(
+                HistoricTaskProbe.id,
+                HistoricTaskProbe.type,
+                HistoricTaskProbe.abspath,
+                HistoricTaskProbe.basename,
+                HistoricTaskProbe.size,
+            )
+
+            query = query.where(
+                (
+                    (HistoricTaskProbe.historictask_id == historictask_id)
+                    & (HistoricTaskProbe.type == "source")
+                )
+                | (HistoricTaskProbe.id == task_probe_id)
+            )
+
+            sql, params = query.sql()
+            rows = db.execute_sql(sql, params).fetchall()
+            if not rows:
+                # The probe may have been moved to the partition whose probe IDs cover it
+                partitions = [
+                    partition
+                    for partition in PartitionRouter.list_partitions()
+                    if partition["first_probe_id"] is not None
+                    and partition["first_probe_id"] <= task_probe_id <= partition["last_probe_id"]
+                ]
+                for _partition, cursor in PartitionRouter.query(sql, params, partitions=partitions):
+                    rows = cursor.fetchall()
+                    if rows:
+                        break
+
+            return [dict(zip(("id", "type", "abspath", "basename", "size"), row)) for row in rows]
+        finally:
+            self.db_stop()
+
+    def import_task_results(self, results, report_progress=None):
+        """
+        Bulk load task results that were recorded outside of this database, such as Unmanic's data logs.
+        Results are written with multi-row inserts, IMPORT_BATCH_SIZE at a time, one transaction per batch.
+        A result is skipped if a task with the same source path and finish time is already recorded, in history.db
+        or a partition, or if it finished before the tasks that the retention policy has removed.
+        Returns a dict with the number of results read, imported and skipped.
+
+        :param results: iterable of task result dicts, as accepted by save_task_results()
+        :param report_progress: optional callable that is passed the running counts after each batch
+        :return:
+        """
+        counts = {
+            "read":     0,
+            "imported": 0,
+            "skipped":  0,
+        }
+        self.db_start()
+        try:
+            batch = []
+            for result in results:
+                counts["read"] += 1
+                batch.append(result)
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    self._import_batch(batch, counts)
+                    batch = []
+                    if report_progress is not None:
+                        report_progress(dict(counts))
+            self._import_batch(batch, counts)
+            if report_progress is not None:
+                report_progress(dict(counts))
+            if counts["imported"]:
+                # Refresh the planner statistics after a large change in the size of the tables
+                db.execute_sql("PRAGMA optimize")
+        finally:
+            self.db_stop()
+        return counts
+
+    def _import_batch(self, batch, counts):
+        if not batch:
+            return
+        # Take the write lock up front, the new task IDs are allocated from the current maximum
+        imported, skipped = DatabaseWriter.run(self._write_import_batch, batch)
+        counts["imported"] += imported
+        counts["skipped"] += skipped
+        DataVersion.bump()
+
+    def _write_import_batch(self, batch):
+        # Must be called inside an IMMEDIATE transaction. Returns the number of results imported and skipped.
+        skipped = 0
+        # Tasks from before the retention cutoff may have been removed, so they can not be checked
+        compacted_before = _read_compaction()["compacted_before"]
+        finish_times = sorted({result["finish_time"] for result in batch if result["finish_time"] >= compacted_before})
+        sources = [(None, finish_times)]
+        if finish_times:
+            for partition in PartitionRouter.list_partitions(from_time=finish_times[0], to_time=finish_times[-1] + 1):
+                partition_times = [
+                    finish_time
+                    for finish_time in finish_times
+                    if partition["month_start"] <= finish_time < partition["month_end"]
+                ]
+                sources.append((partition, partition_times))
+        recorded = set()
+        for partition, source_times in sources:
+            for offset in range(0, len(source_times), 500):
+                chunk = source_times[offset:offset + 500]
+                # CROSS JOIN keeps SQLite on the finish time index instead of walking every source probe
+                sql = (
+                    'SELECT p."abspath", t."finish_time" FROM "historictasks" AS t '
+                    'CROSS JOIN "historictaskprobe" AS p ON p."historictask_id" = t."id" AND p."type" = \'source\' '
+                    'WHERE t."finish_time" IN ({})'.format(", ".join("?" * len(chunk)))
+                )
+                if partition is None:
+                    recorded.update(db.execute_sql(sql, chunk).fetchall())
+                    continue
+                with PartitionRouter.connect(partition) as connection:
+                    if connection is not None:
+                        recorded.update(PartitionRouter.execute(connection, sql, chunk).fetchall())
+
+        next_id = (HistoricTasks.select(fn.MAX(HistoricTasks.id)).scalar() or 0) + 1
+        first_id = next_id
+        tasks = []
+        probes = []
+        totals = {"source_size": 0, "destination_size": 0}
+        rollups = {model: {} for model in ROLLUP_MODELS.values()}
+        distribution_counts = collections.Counter()
+        breakdown_changes = {}
+        for result in batch:
+            key = (result["source_abspath"], result["finish_time"])
+            if key in recorded or result["finish_time"] < compacted_before:
+                skipped += 1
+                continue
+            recorded.add(key)
+            start_time = min(result["start_time"], result["finish_time"])
+            destinations = get_result_destinations(result)
+            destination_size = sum(size for _abspath, size in destinations)
+            library_id = result.get("library_id")
+            extension = get_file_extension(result["source_abspath"])
+            processing_duration = result["finish_time"] - start_time
+            throughput = get_throughput(result["source_size"], processing_duration)
+            tasks.append(
+                (
+                    next_id,
+                    os.path.basename(result["source_abspath"]),
+                    True,
+                    start_time,
+                    result["finish_time"],
+                    destination_size,
+                    library_id,
+                    extension,
+                    throughput,
+                )
+            )
+            for probe_type, abspath, size in [("source", result["source_abspath"], result["source_size"])] + [
+                ("destination", abspath, size) for abspath, size in destinations
+            ]:
+                probes.append((next_id, probe_type, abspath, os.path.basename(abspath), size))
+            totals["source_size"] += result["source_size"]
+            totals["destination_size"] += destination_size
+            distribution_counts.update(
+                _distribution_bins(result["source_size"], destination_size, processing_duration)
+            )
+            _count_breakdowns(
+                breakdown_changes,
+                library_id,
+                extension,
+                source_size=result["source_size"],
+                destination_size=destination_size,
+                task_count=1,
+                processing_duration=processing_duration,
+                throughput=throughput,
+            )
+            for model, buckets in rollups.items():
+                bucket_start = result["finish_time"] - (result["finish_time"] % model.bucket_seconds)
+                bucket = buckets.setdefault(bucket_start, [bucket_start, 0, 0, 0, 0, 0])
+                bucket[1] += result["source_size"]
+                bucket[2] += destination_size
+                bucket[3] += 1
+                bucket[4] += processing_duration
+                bucket[5] = max(bucket[5], throughput or 0)
+            next_id += 1
+        if not tasks:
+            return 0, skipped
+
+        # The rows are already plain values, so they are handed straight to sqlite3's executemany().
+        # Building the same statements through insert_many() costs more than the inserts themselves.
+        cursor = db.cursor()
+        cursor.executemany(
+            'INSERT INTO "historictasks" '
+            '("id", "task_label", "task_success", "start_time", "finish_time", "destination_size", '
+            '"library_id", "extension", "throughput") '
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            tasks,
+        )
+        cursor.executemany(
+            'INSERT INTO "historictaskprobe" ("historictask_id", "type", "abspath", "basename", "size") '
+            "VALUES (?, ?, ?, ?, ?)",
+            probes,
+        )
+        for model, buckets in rollups.items():
+            _increment_rollup_buckets(model, list(buckets.values()))
+        _increment_distributions(distribution_counts)
+        _increment_breakdowns(breakdown_changes)
+        self._increment_totals(
+            source_size=totals["source_size"],
+            destination_size=totals["destination_size"],
+            success_count=len(tasks),
+            task_count=len(tasks),
+        )
+        if SchemaMigrator.search_index_available:
+            _index_tasks_for_search('t."id" >= ?', (first_id,))
+        return len(tasks), skipped
+
+    def iter_export_rows(self, from_time=None, to_time=None, success=None):
+        """
+        Yield every probe of every task in task order, as a tuple matching EXPORT_CSV_COLUMNS.
+        Rows are stepped through on one cursor for history.db and one for each partition that overlaps the date
+        range, so only one batch from each is held in memory at a time.
+
+        :param from_time: only tasks that finished at or after this UTC epoch second
+        :param to_time: only tasks that finished before this UTC epoch second
+        :param success: only successful (True) or failed (False) tasks
+        :return:
+        """
+        conditions = []
+        params = []
+        if from_time is not None:
+            conditions.append('t."finish_time" >= ?')
+            params.append(from_time)
+        if to_time is not None:
+            conditions.append('t."finish_time" < ?')
+            params.append(to_time)
+        if success is not None:
+            conditions.append('t."task_success" = ?')
+            params.append(1 if success else 0)
+        sql = (
+            'SELECT t."id", t."task_label", t."task_success", t."start_time", t."finish_time", '
+            'p."type", p."abspath", p."basename", p."size" '
+            'FROM "historictasks" AS t '
+            'JOIN "historictaskprobe" AS p ON p."historictask_id" = t."id" '
+            "{} "
+            'ORDER BY t."id", p."id"'
+        ).format("WHERE " + " AND ".join(conditions) if conditions else "")
+
+        def iter_rows(cursor):
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
+        self.db_start(read_only=True)
+        try:
+            with contextlib.ExitStack() as partition_connections:
+                cursors = [db.execute_sql(sql, params)]
+                for partition in PartitionRouter.list_partitions(from_time=from_time, to_time=to_time):
+                    connection = partition_connections.enter_context(PartitionRouter.connect(partition))
+                    if connection is not None:
+                        cursors.append(PartitionRouter.execute(connection, sql, params))
+                # Each task is stored in a single file, so merging on the task ID keeps its probes together
+                for row in heapq.merge(*[iter_rows(cursor) for cursor in cursors], key=lambda row: row[0]):
+                    yield row
+        finally:
+            self.db_stop()
+
+    def iter_export(self, export_format="csv", from_time=None, to_time=None, success=None):
+        """
+        Yield the export as encoded chunks.
+        CSV has one line per probe. NDJSON has one object per task, holding a list of its probes.
+
+        :param export_format: "csv" or "ndjson"
+        :param from_time:
+        :param to_time:
+        :param success:
+        :return:
+        """
+        rows = self.iter_export_rows(from_time=from_time, to_time=to_time, success=success)
+        buffer = io.StringIO()
+        buffered = 0
+        if export_format == "csv":
+            writer = csv.writer(buffer, lineterminator="\n")
+            writer.writerow(EXPORT_CSV_COLUMNS)
+            for row in rows:
+                writer.writerow(row)
+                buffered += 1
+                if buffered >= EXPORT_BATCH_SIZE:
+                    yield buffer.getvalue().encode("utf-8")
+                    buffer.seek(0)
+                    buffer.truncate()
+                    buffered = 0
+        else:
+            task = None
+            for task_id, task_label, task_success, start_time, finish_time, probe_type, abspath, basename, size in rows:
+                if task is None or task["id"] != task_id:
+                    if task is not None:
+                        buffer.write(json.dumps(task))
+                        buffer.write("\n")
+                        buffered += 1
+                    task = {
+                        "id":           task_id,
+                        "task_label":   task_label,
+                        "task_success": bool(task_success),
+                        "start_time":   start_time,
+                        "finish_time":  finish_time,
+                        "probes":       [],
+                    }
+                task["probes"].append(
+                    {
+                        "type":     probe_type,
+                        "abspath":  abspath,
+                        "basename": basename,
+                        "size":     size,
+                    }
+                )
+                if buffered >= EXPORT_BATCH_SIZE:
+                    yield buffer.getvalue().encode("utf-8")
+                    buffer.seek(0)
+                    buffer.truncate()
+                    buffered = 0
+            if task is not None:
+                buffer.write(json.dumps(task))
+                buffer.write("\n")
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+
+    def calculate_total_file_size_difference(self):
+        # Only show results for successful records. These are read from the running totals.
+        totals = self.get_totals()
+        results = {
+            "source":              totals.get("source_size", 0),
+            "destination":         totals.get("destination_size", 0),
+            "has_data":            False,
+            "is_assigned":         self.is_assigned_to_any_library(
+                has_recorded_tasks=totals.get("task_count", 0) > 0,
+            ),
+            "empty_state_message": self.get_empty_state_message(),
+        }
+
+        results["has_data"] = bool(
+            results["source"]
+            or results["destination"]
+            or totals.get("task_count", 0)
+        )
+
+        return results
+
+    def prepare_filtered_historic_tasks(self, request_dict):
+        self.db_start(read_only=True)
+        try:
+            draw = int(request_dict.get("draw", 1))
+            start = int(request_dict.get("start", 0))
+            length = int(request_dict.get("length", 15))
+
+            search = request_dict.get("search") or {}
+            search_value = search.get("value")
+            # "prefix" (default) and "token" use the full-text index, "contains" matches any part of the label
+            search_mode = request_dict.get("searchMode", "prefix")
+            search_key = "{}:{}".format(search_mode, search_value) if search_value else ""
+
+            filter_order = (request_dict.get("order") or [{}])[0]
+            order_direction = filter_order.get("dir", "desc")
+            columns = request_dict.get("columns") or []
+            column_index = filter_order.get("column", 2)
+            try:
+                column_index = int(column_index)
+            except Exception:
+                column_index = 2
+            order_column_name = "finish_time"
+            if 0 <= column_index < len(columns):
+                order_column_name = columns[column_index].get("name", "finish_time")
+            if order_column_name not in LIST_SORT_KEYS:
+                order_column_name = "finish_time"
+            order = {
+                "column": order_column_name,
+                "dir":    "asc" if order_direction == "asc" else "desc",
+            }
+
+            # "columns" returns each column as one array instead of an object per row
+            data_format = request_dict.get("dataFormat", "rows")
+
+            # Adjacent pages can be requested with the cursors returned by the previous page.
+            # Anything else falls back to the DataTables start/length offset.
+            cursor_keys = None
+            cursor_direction = request_dict.get("cursorDirection", "next")
+            if request_dict.get("cursor"):
+                cursor_keys = decode_list_cursor(request_dict.get("cursor"), order, search_key)
+
+            records_total_count = self.get_total_historic_task_list_count()
+            records_filtered_count = records_total_count
+            if search_value:
+                records_filtered_count = self.count_historic_task_query(
+                    search_value=search_value,
+                    search_mode=search_mode,
+                )
+            task_results = self.get_historic_task_list_filtered_and_sorted(
+                order=order,
+                start=start,
+                length=length,
+                search_value=search_value,
+                cursor_keys=cursor_keys,
+                cursor_direction=cursor_direction,
+                search_mode=search_mode,
+                # When a search matches a large share of the history, reading the sort index in order finds a
+                # page sooner than sorting every match
+                walk_sort_index=records_filtered_count * 20 >= records_total_count,
+                as_tuples=True,
+            )
+            success_count = sum(1 for row in task_results if row[5])
+
+            return_data = {
+                "draw":              draw,
+                "recordsTotal":      records_total_count,
+                "recordsFiltered":   records_filtered_count,
+                "successCount":      success_count,
+                "failedCount":       len(task_results) - success_count,
+                "hasData":           records_total_count > 0,
+                "isAssigned":        self.is_assigned_to_any_library(has_recorded_tasks=records_total_count > 0),
+                "emptyStateMessage": self.get_empty_state_message(),
+                "paginationMode":    "offset" if cursor_keys is None else "keyset",
+                "nextCursor":        None,
+                "prevCursor":        None,
+                "data":              [],
+            }
+            if task_results:
+                return_data["prevCursor"] = encode_list_cursor(
+                    order, search_key, dict(zip(LIST_ROW_COLUMNS, task_results[0]))
+                )
+                return_data["nextCursor"] = encode_list_cursor(
+                    order, search_key, dict(zip(LIST_ROW_COLUMNS, task_results[-1]))
+                )
+
+            # Timestamps are stored as epoch seconds, so the rows are passed through without any conversion
+            if data_format == "columns":
+                return_data["columns"] = {
+                    name: [row[index] for row in task_results] for name, index in LIST_RESPONSE_COLUMNS
+                }
+                return_data["columns"]["task_success"] = [bool(row[5]) for row in task_results]
+            else:
+                return_data["data"] = [
+                    {
+                        "id":           row[0],
+                        "basename":     row[4],
+                        "abspath":      row[3],
+                        "task_success": bool(row[5]),
+                        "start_time":   row[6],
+                        "finish_time":  row[7],
+                    }
+                    for row in task_results
+                ]
+
+            return return_data
+        finally:
+            self.db_stop()
+
+    def _insert_source_item(self, abspath, size, start_time=None, task_success=False, library_id=None):
+        # Must be called inside a transaction
+        basename = os.path.basename(abspath)
+        task_label = basename
+        start_time = get_epoch_seconds(start_time)
+        if start_time is None:
+            start_time = int(time.time())
+        finish_time = None
+        size = int(size or 0)
+        new_historic_task = HistoricTasks.create(
+            task_label=task_label,
+            task_success=task_success,
+            start_time=start_time,
+            finish_time=finish_time,
+            library_id=library_id,
+            extension=get_file_extension(abspath),
+        )
+        # Create probe entry for source item
+        HistoricTaskProbe.create(
+            historictask_id=new_historic_task,
+            type="source",
+            abspath=abspath,
+            basename=basename,
+            size=size,
+        )
+        self._increment_totals(
+            source_size=size if task_success else 0,
+            success_count=1 if task_success else 0,
+            task_count=1,
+        )
+        if task_success:
+            breakdown_changes = {}
+            _count_breakdowns(
+                breakdown_changes,
+                library_id,
+                new_historic_task.extension,
+                source_size=size,
+                task_count=1,
+            )
+            _increment_breakdowns(breakdown_changes)
+        return new_historic_task.id
+
+    def _insert_destination_items(self, task_id, destinations, finish_time):
+        # Must be called inside a transaction
+        destinations = [(abspath, int(size or 0)) for abspath, size in destinations]
+        added_size = sum(size for _abspath, size in destinations)
+        # Create a probe entry for each destination file
+        HistoricTaskProbe.insert_many(
+            [(task_id, "destination", abspath, os.path.basename(abspath), size) for abspath, size in destinations],
+            fields=[
+                HistoricTaskProbe.historictask_id,
+                HistoricTaskProbe.type,
+                HistoricTaskProbe.abspath,
+                HistoricTaskProbe.basename,
+                HistoricTaskProbe.size,
+            ],
+        ).execute()
+
+        # Update the original entry
+        historic_task, created = HistoricTasks.get_or_create(id=task_id)
+        source_size = int(
+            HistoricTaskProbe.select(fn.SUM(HistoricTaskProbe.size))
+            .where(
+                (HistoricTaskProbe.historictask_id == task_id)
+                & (HistoricTaskProbe.type == "source")
+            )
+            .scalar()
+            or 0
+        )
+        distribution_counts = collections.Counter()
+        if historic_task.task_success:
+            totals = {"destination_size": added_size}
+            # Move the task out of the histogram bins it was counted in with its earlier destinations
+            distribution_counts.subtract(
+                _distribution_bins(
+                    source_size,
+                    historic_task.destination_size,
+                    (historic_task.finish_time or historic_task.start_time) - historic_task.start_time,
+                )
+            )
+        else:
+            # The task is now counted as successful, so all of its probes are added to the totals
+            totals = {
+                "success_count":    1,
+                "source_size":      source_size,
+                "destination_size": historic_task.destination_size + added_size,
+            }
+        if created:
+            totals["task_count"] = 1
+        finish_time = get_epoch_seconds(finish_time)
+        if finish_time is None:
+            finish_time = int(time.time())
+        processing_duration = finish_time - (historic_task.start_time or finish_time)
+        distribution_counts.update(
+            _distribution_bins(source_size, historic_task.destination_size + added_size, processing_duration)
+        )
+        _increment_distributions(distribution_counts)
+        historic_task.destination_size += added_size
+        historic_task.finish_time = finish_time
+        historic_task.task_success = True
+        historic_task.throughput = get_throughput(source_size, processing_duration)
+        historic_task.save()
+        self._increment_totals(**totals)
+        # The duration and throughput are counted when the task first succeeds, like the sizes
+        counted_duration = max(processing_duration, 0) if totals.get("success_count") else 0
+        counted_throughput = historic_task.throughput if totals.get("success_count") else None
+        breakdown_changes = {}
+        _count_breakdowns(
+            breakdown_changes,
+            historic_task.library_id,
+            historic_task.extension,
+            source_size=totals.get("source_size", 0),
+            destination_size=totals.get("destination_size", 0),
+            task_count=totals.get("success_count", 0),
+            processing_duration=counted_duration,
+            throughput=counted_throughput,
+        )
+        _increment_breakdowns(breakdown_changes)
+        _increment_rollups(
+            finish_time,
+            source_size=totals.get("source_size", 0),
+            destination_size=totals.get("destination_size", 0),
+            task_count=totals.get("success_count", 0),
+            processing_duration=counted_duration,
+            throughput=counted_throughput,
+        )
+        if SchemaMigrator.search_index_available:
+            _index_tasks_for_search('t."id" = ?', (historic_task.id,))
+
+    def save_task_results(self, results):
+        """
+        Write a batch of task results in a single transaction.
+        Each result is written in its own savepoint so that one bad result does not roll back the others.
+        Returns a list of flags marking which results were written.
+
+        :param results:
+        :return:
+        """
+
+        def write_results():
+            written = []
+            for result in results:
+                try:
+                    with db.atomic():
+                        task_id = self._insert_source_item(
+                            result["source_abspath"],
+                            result["source_size"],
+                            start_time=result["start_time"],
+                            library_id=result.get("library_id"),
+                        )
+                        self._insert_destination_items(
+                            task_id,
+                            get_result_destinations(result),
+                            result["finish_time"],
+                        )
+                    written.append(True)
+                except Exception:
+                    written.append(False)
+                    logger.exception("Failed to save historic data to database.")
+            return written
+
+        self.db_start()
+        try:
+            written = DatabaseWriter.run(write_results)
+        finally:
+            self.db_stop()
+        if True in written:
+            DataVersion.bump()
+        return written
+
+
+class ResultWriter(object):
+    """
+    ResultWriter
+
+    Optional write-behind queue for task results.
+    Results are written by a single background thread, which groups everything that arrives within the
+    batch interval (up to the batch size) into one transaction. This replaces a transaction, and a WAL
+    sync, per task with one per batch, and workers no longer compete for the database write lock.
+    """
+
+    _lock = threading.Lock()
+    _queue = None
+    _thread = None
+    _config = {}
+    _counters = {
+        "queued":  0,
+        "written": 0,
+        "dropped": 0,
+        "failed":  0,
+        "batches": 0,
+    }
+
+    # Queue markers that ask the writer thread to write what it has and then signal or stop
+    _FLUSH = "flush"
+    _STOP = "stop"
+
+    @staticmethod
+    def is_enabled():
+        return bool(Settings().get_setting("write_behind_enabled"))
+
+    @classmethod
+    def get_stats(cls):
+        with cls._lock:
+            stats = dict(cls._counters)
+        stats["queue_depth"] = cls._queue.qsize() if cls._queue is not None else 0
+        stats["running"] = cls._thread is not None and cls._thread.is_alive()
+        return stats
+
+    @classmethod
+    def _count(cls, **increments):
+        # Workers submit results from many threads at once
+        with cls._lock:
+            for name, increment in increments.items():
+                cls._counters[name] += increment
+
+    @classmethod
+    def _start(cls):
+        with cls._lock:
+            if cls._thread is not None and cls._thread.is_alive():
+                return
+            plugin_settings = Settings()
+            cls._config = {
+                "batch_size":     max(1, int(plugin_settings.get_setting("write_batch_size") or 100)),
+                "batch_interval": max(0.1, float(plugin_settings.get_setting("write_batch_interval") or 2)),
+                "durability":     plugin_settings.get_setting("write_durability") or "committed",
+            }
+            cls._queue = queue.Queue(maxsize=max(1, int(plugin_settings.get_setting("write_queue_size") or 1000)))
+            cls._thread = threading.Thread(target=cls._run, name="FileSizeMetricsResultWriter", daemon=True)
+            cls._thread.start()
+
+    @classmethod
+    def submit(cls, result, timeout=30):
+        """
+        Queue a task result to be written.
+        With "committed" durability this waits until the batch holding the result has been written.
+        Returns False if the result was dropped because the queue was full or the write failed.
+
+        :param result:
+        :param timeout:
+        :return:
+        """
+        cls._start()
+        done = threading.Event() if cls._config.get("durability") == "committed" else None
+        item = {"result": result, "done": done, "written": False}
+        try:
+            cls._queue.put(item, timeout=1)
+        except queue.Full:
+            cls._count(dropped=1)
+            logger.warning(
+                "The file size metrics write queue is full. Dropped the result for '%s'.",
+                result.get("source_abspath"),
+            )
+            return False
+        cls._count(queued=1)
+        if done is None:
+            return True
+        done.wait(timeout)
+        return item["written"]
+
+    @classmethod
+    def flush(cls, timeout=30):
+        """
+        Wait until every result queued so far has been written.
+
+        :param timeout:
+        :return:
+        """
+        if cls._thread is None or not cls._thread.is_alive():
+            return
+        done = threading.Event()
+        cls._queue.put({"marker": cls._FLUSH, "done": done})
+        done.wait(timeout)
+
+    @classmethod
+    def stop(cls, timeout=30):
+        if cls._thread is None or not cls._thread.is_alive():
+            return
+        cls._queue.put({"marker": cls._STOP, "done": None})
+        cls._thread.join(timeout)
+        logger.info("Stopped the file size metrics result writer. %s", cls.get_stats())
+
+    @classmethod
+    def _write_batch(cls, batch):
+        if not batch:
+            return
+        results = [item["result"] for item in batch]
+        try:
+            with Instrumentation.measure("writer.batch"):
+                written = Data().save_task_results(results)
+        except Exception:
+            logger.exception("Failed to write a batch of %s task results.", len(results))
+            written = [False] * len(results)
+        cls._count(batches=1, written=written.count(True), failed=written.count(False))
+        for item, item_written in zip(batch, written):
+            item["written"] = item_written
+            if item["done"] is not None:
+                item["done"].set()
+
+    @classmethod
+    def _run(cls):
+        batch_size = cls._config["batch_size"]
+        batch_interval = cls._config["batch_interval"]
+        while True:
+            item = cls._queue.get()
+            batch = []
+            deadline = time.monotonic() + batch_interval
+            while True:
+                marker = item.get("marker")
+                if marker is not None:
+                    cls._write_batch(batch)
+                    batch = []
+                    if item["done"] is not None:
+                        item["done"].set()
+                    if marker == cls._STOP:
+                        return
+                    break
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = cls._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            cls._write_batch(batch)
+
+
+class RetentionManager(object):
+    """
+    RetentionManager
+
+    Background pass that enforces the retention_days setting, then moves old months into partitions with
+    PartitionManager when the partition_months setting is enabled.
+    Tasks that finished (or started, if they never finished) more than retention_days ago are removed in
+    small transactions so that workers recording results are never blocked for long. Their sizes and counts
+    are first added to the HistoricCompaction row, so the totals stay exact. The newest task is kept until a
+    newer one is recorded, so that its IDs are never reused. Partitions are dropped as a whole once their
+    month has ended before the cutoff. The daily rollups keep their history, hourly rollups
+    older than the cutoff are removed. The freed pages are then returned to the disk with incremental vacuum.
+    """
+
+    interval = 3600
+    chunk_size = 500
+    vacuum_pages = 2000
+
+    _lock = threading.Lock()
+    _thread = None
+    _wake = threading.Event()
+    _status = {
+        "state":        "idle",
+        "cutoff":       None,
+        "pruned_tasks": 0,
+        "last_run":     None,
+    }
+
+    @classmethod
+    def get_status(cls):
+        return dict(cls._status)
+
+    @classmethod
+    def start(cls):
+        with cls._lock:
+            if cls._thread is not None and cls._thread.is_alive():
+                return
+            cls._thread = threading.Thread(target=cls._run, name="FileSizeMetricsRetention", daemon=True)
+            cls._thread.start()
+
+    @classmethod
+    def run_now(cls):
+        cls.start()
+        cls._wake.set()
+
+    @classmethod
+    def _run(cls):
+        while True:
+            settings = Settings()
+            try:
+                retention_days = int(settings.get_setting("retention_days") or 0)
+                if retention_days > 0:
+                    cls.prune(retention_days)
+            except Exception:
+                logger.exception("Failed to apply the file size metrics retention policy.")
+                cls._status["state"] = "failed"
+            try:
+                partition_months = int(settings.get_setting("partition_months") or 0)
+                if partition_months > 0:
+                    PartitionManager.archive(partition_months)
+            except Exception:
+                logger.exception("Failed to move old file size metrics into monthly partitions.")
+                PartitionManager.set_failed()
+            cls._wake.wait(cls.interval)
+            cls._wake.clear()
+
+    @classmethod
+    def prune(cls, retention_days, now=None):
+        """
+        Remove the tasks that are older than retention_days, keeping their totals.
+        Returns the number of tasks removed.
+
+        :param retention_days:
+        :param now:
+        :return:
+        """
+        now = int(time.time()) if now is None else int(now)
+        # Cut at a day boundary so that every daily rollup bucket is either all raw rows or all compacted
+        cutoff = now - retention_days * 86400
+        cutoff -= cutoff % HistoricDailyTotals.bucket_seconds
+        cls._status.update({"state": "pruning", "cutoff": cutoff, "pruned_tasks": 0})
+        pruned = 0
+        data_handler = Data()
+        data_handler.db_start()
+        try:
+            while True:
+                removed = DatabaseWriter.run(cls._prune_chunk, cutoff)
+                if not removed:
+                    break
+                DataVersion.bump()
+                pruned += removed
+                cls._status["pruned_tasks"] = pruned
+                # Give waiting writers a chance to take the write lock between chunks
+                time.sleep(0.01)
+            for partition in PartitionRouter.list_partitions(to_time=cutoff):
+                if partition["month_end"] > cutoff:
+                    continue
+                DatabaseWriter.run(cls._drop_partition, partition, cutoff)
+                try:
+                    os.remove(PartitionRouter.path(partition["name"]))
+                except FileNotFoundError:
+                    pass
+                DataVersion.bump()
+                pruned += partition["task_count"]
+                cls._status["pruned_tasks"] = pruned
+            DatabaseWriter.run(cls._prune_rollups, cutoff)
+            DataVersion.bump()
+            cls.incremental_vacuum()
+        finally:
+            data_handler.db_stop()
+        if pruned:
+            logger.info("Removed %s file size metrics tasks from before %s.", pruned, cutoff)
+        cls._status.update({"state": "idle", "last_run": now})
+        return pruned
+
+    @classmethod
+    def _drop_partition(cls, partition, cutoff):
+        # Must be called inside a transaction
+        HistoricCompaction.update(
+            compacted_before=fn.MAX(HistoricCompaction.compacted_before, cutoff),
+            source_size=HistoricCompaction.source_size + partition["source_size"],
+            destination_size=HistoricCompaction.destination_size + partition["destination_size"],
+            success_count=HistoricCompaction.success_count + partition["success_count"],
+            task_count=HistoricCompaction.task_count + partition["task_count"],
+        ).execute()
+        HistoricPartition.delete().where(HistoricPartition.id == partition["id"]).execute()
+
+    @classmethod
+    def _prune_rollups(cls, cutoff):
+        # Must be called inside a transaction
+        for model in ROLLUP_MODELS.values():
+            if model is not HistoricDailyTotals:
+                model.delete().where(model.bucket_start < cutoff).execute()
+
+    @classmethod
+    def _prune_chunk(cls, cutoff):
+        # Must be called inside a transaction
+        # As with PartitionManager, the newest task and probe stay, otherwise SQLite would give their IDs to the
+        # next task while partitions may still hold rows with those IDs
+        task_ids = [
+            row[0]
+            for row in db.execute_sql(
+                'SELECT "id" FROM "historictasks" '
+                'WHERE ("finish_time" < ? OR ("finish_time" IS NULL AND "start_time" < ?)) '
+                'AND "id" < (SELECT MAX("id") FROM "historictasks") '
+                'AND "id" NOT IN (SELECT "historictask_id" FROM "historictaskprobe" ORDER BY "id" DESC LIMIT 1) '
+                "LIMIT ?",
+                (cutoff, cutoff, cls.chunk_size),
+            )
+        ]
+        if not task_ids:
+            HistoricCompaction.update(
+                compacted_before=fn.MAX(HistoricCompaction.compacted_before, cutoff)
+            ).execute()
+            return 0
+        placeholders = ", ".join("?" * len(task_ids))
+        source_size = db.execute_sql(
+            'SELECT SUM(p."size") FROM "historictaskprobe" AS p JOIN "historictasks" AS t ON t."id" = p."historictask_id" '
+            'WHERE p."type" = \'source\' AND t."task_success" AND t."id" IN ({})'.format(placeholders),
+            task_ids,
+        ).fetchone()[0]
+        destination_size, success_count = db.execute_sql(
+            'SELECT SUM("destination_size"), COUNT(*) FROM "historictasks" '
+            'WHERE "task_success" AND "id" IN ({})'.format(placeholders),
+            task_ids,
+        ).fetchone()
+        HistoricCompaction.update(
+            compacted_before=fn.MAX(HistoricCompaction.compacted_before, cutoff),
+            source_size=HistoricCompaction.source_size + (source_size or 0),
+            destination_size=HistoricCompaction.destination_size + (destination_size or 0),
+            success_count=HistoricCompaction.success_count + success_count,
+            task_count=HistoricCompaction.task_count + len(task_ids),
+        ).execute()
+        _delete_tasks(task_ids)
+        return len(task_ids)
+
+    @classmethod
+    def incremental_vacuum(cls):
+        # Free the pages a few at a time so that each step only holds the write lock briefly
+        if not cls.enable_incremental_vacuum():
+            return
+        while DatabaseWriter.run(cls._vacuum_step):
+            pass
+
+    @classmethod
+    def enable_incremental_vacuum(cls):
+        """
+        Switch a database that was created before the retention policy to incremental auto vacuum.
+        That takes a full VACUUM, which rewrites the whole file, so it is only done the first time that rows are
+        removed, and only when there is room on the disk for a second copy of the file. Writers in this process
+        wait for it. Until then, freed pages are reused by new rows instead of being returned to the disk.
+        Returns True if the database uses incremental auto vacuum. Must be called with a connection open.
+
+        :return:
+        """
+        if db.execute_sql("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return True
+        database_size = os.path.getsize(db_file)
+        free_space = shutil.disk_usage(os.path.dirname(db_file)).free
+        if free_space < database_size * 2:
+            logger.warning(
+                "Not enough free disk space to switch the file size metrics database to incremental vacuum. "
+                "Space freed by the retention policy is reused, but not returned to the disk."
+            )
+            return False
+        logger.info("Switching the file size metrics database to incremental vacuum. This rewrites the file once.")
+        with DatabaseWriter.locked():
+            # Changing the auto vacuum mode of an existing database only takes effect after a full VACUUM
+            db.execute_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            db.execute_sql("VACUUM")
+        return db.execute_sql("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    @classmethod
+    def _vacuum_step(cls):
+        # Must be called inside a transaction. Returns False once there are no free pages left.
+        if not db.execute_sql("PRAGMA freelist_count").fetchone()[0]:
+            return False
+        db.execute_sql("PRAGMA incremental_vacuum({})".format(int(cls.vacuum_pages))).fetchall()
+        return True
+
+
+class PartitionManager(object):
+    """
+    PartitionManager
+
+    Moves the tasks of old months out of history.db into one partition file per month, so that vacuums,
+    index rebuilds and backups of history.db only cover recent history. PartitionRouter reads them back.
+    A month is moved once it is more than partition_months months old. Its rows are copied into a new file
+    through an attached database, the file is compacted and moved into place, then it is listed in
+    HistoricPartition in the same transaction that removes the rows from history.db. No other write from
+    this process runs in between. The running totals, rollups, histograms and breakdowns are not changed.
+    Tasks recorded later for a month that already has a partition stay in history.db. The newest task is
+    never moved, so SQLite keeps allocating IDs after every ID in use.
+    """
+
+    _status = {
+        "state":       "idle",
+        "moved_tasks": 0,
+        "partitions":  None,
+        "last_run":    None,
+    }
+
+    @classmethod
+    def get_status(cls):
+        return dict(cls._status)
+
+    @classmethod
+    def set_failed(cls):
+        cls._status["state"] = "failed"
+
+    @staticmethod
+    def month_start(timestamp, months=0):
+        """
+        Return the start of the UTC month that timestamp falls in, moved on by a number of months.
+
+        :param timestamp:
+        :param months:
+        :return:
+        """
+        moment = datetime.datetime.fromtimestamp(int(timestamp), tz=datetime.timezone.utc)
+        month_index = moment.year * 12 + moment.month - 1 + months
+        return int(
+            datetime.datetime(month_index // 12, month_index % 12 + 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+        )
+
+    @classmethod
+    def archive(cls, partition_months, now=None):
+        """
+        Move each month that is more than partition_months months old into its own partition.
+        The current month is always kept in history.db. Returns the number of tasks moved.
+
+        :param partition_months:
+        :param now:
+        :return:
+        """
+        now = int(time.time()) if now is None else int(now)
+        keep_before = cls.month_start(now, 1 - max(int(partition_months), 1))
+        cls._status.update({"state": "partitioning", "moved_tasks": 0})
+        moved = 0
+        data_handler = Data()
+        data_handler.db_start()
+        try:
+            partitioned = {partition["month_start"] for partition in PartitionRouter.list_partitions()}
+            oldest = [
+                value
+                for value in db.execute_sql(
+                    'SELECT (SELECT MIN("finish_time") FROM "historictasks"), '
+                    '(SELECT MIN("start_time") FROM "historictasks" WHERE "finish_time" IS NULL)'
+                ).fetchone()
+                if value is not None
+            ]
+            month = cls.month_start(min(oldest)) if oldest else keep_before
+            while month < keep_before:
+                next_month = cls.month_start(month, 1)
+                if month not in partitioned:
+                    moved += cls._archive_month(month, next_month)
+                    cls._status["moved_tasks"] = moved
+                month = next_month
+            if moved:
+                RetentionManager.incremental_vacuum()
+            partition_count = HistoricPartition.select().count()
+        finally:
+            data_handler.db_stop()
+        if moved:
+            logger.info("Moved %s file size metrics tasks to monthly partitions.", moved)
+        cls._status.update({"state": "idle", "partitions": partition_count, "last_run": now})
+        return moved
+
+    @classmethod
+    def _archive_month(cls, month_start, month_end):
+        name = time.strftime("%Y-%m", time.gmtime(month_start))
+        path = PartitionRouter.path(name)
+        building_path = path + ".tmp"
+        os.makedirs(partition_directory, exist_ok=True)
+        if os.path.exists(building_path):
+            os.remove(building_path)
+        with DatabaseWriter.locked():
+            cls._create_partition_file(building_path)
+            db.execute_sql('ATTACH DATABASE ? AS "partition"', (building_path,))
+            try:
+                summary, task_ids = DatabaseWriter.run(cls._copy_month, month_start, month_end)
+            finally:
+                db.execute_sql('DETACH DATABASE "partition"')
+            if not task_ids:
+                os.remove(building_path)
+                return 0
+            cls._compact_partition_file(building_path)
+            os.replace(building_path, path)
+            DatabaseWriter.run(cls._register_partition, name, month_start, month_end, summary, task_ids)
+        return len(task_ids)
+
+    @staticmethod
+    def _create_partition_file(path):
+        # Give the partition the same tables and indexes as history.db
+        definitions = [
+            row[0]
+            for row in db.execute_sql(
+                'SELECT "sql" FROM "sqlite_master" WHERE "tbl_name" IN (?, ?, ?) AND "sql" IS NOT NULL '
+                # Tables before their indexes
+                'ORDER BY "type" DESC',
+                (
+                    HistoricTasks._meta.table_name,
+                    HistoricTaskProbe._meta.table_name,
+                    HistoricTaskSearch._meta.table_name,
+                ),
+            )
+        ]
+        connection = sqlite3.connect(path, isolation_level=None)
+        try:
+            for definition in definitions:
+                connection.execute(definition)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _copy_month(month_start, month_end):
+        # Must be called inside a transaction, with the new partition file attached as "partition"
+        db.execute_sql(
+            'INSERT INTO "partition"."historictasks" SELECT t.* FROM "main"."historictasks" AS t '
+            'WHERE ((t."finish_time" >= ? AND t."finish_time" < ?) '
+            'OR (t."finish_time" IS NULL AND t."start_time" >= ? AND t."start_time" < ?)) '
+            'AND t."id" < (SELECT MAX("id") FROM "main"."historictasks") '
+            'AND t."id" NOT IN (SELECT "historictask_id" FROM "main"."historictaskprobe" ORDER BY "id" DESC LIMIT 1) '
+            'ORDER BY t."id"',
+            (month_start, month_end, month_start, month_end),
+        )
+        db.execute_sql(
+            'INSERT INTO "partition"."historictaskprobe" SELECT p.* FROM "main"."historictaskprobe" AS p '
+            'WHERE p."historictask_id" IN (SELECT "id" FROM "partition"."historictasks") '
+            'ORDER BY p."id"'
+        )
+        if SchemaMigrator.search_index_available:
+            db.execute_sql(
+                'INSERT INTO "partition"."historictasksearch" ("rowid", "task_label", "basename", "abspath") '
+                'SELECT "rowid", "task_label", "basename", "abspath" FROM "main"."historictasksearch" '
+                'WHERE "rowid" IN (SELECT "id" FROM "partition"."historictasks")'
+            )
+        task_ids = [row[0] for row in db.execute_sql('SELECT "id" FROM "partition"."historictasks"')]
+        summary = {}
+        (
+            summary["task_count"],
+            summary["success_count"],
+            summary["destination_size"],
+            summary["first_task_id"],
+            summary["last_task_id"],
+            summary["min_start_time"],
+            summary["max_start_time"],
+            summary["min_finish_time"],
+            summary["max_finish_time"],
+        ) = db.execute_sql(
+            'SELECT COUNT(*), COALESCE(SUM("task_success"), 0), '
+            'COALESCE(SUM(CASE WHEN "task_success" THEN "destination_size" ELSE 0 END), 0), '
+            'MIN("id"), MAX("id"), MIN("start_time"), MAX("start_time"), MIN("finish_time"), MAX("finish_time") '
+            'FROM "partition"."historictasks"'
+        ).fetchone()
+        summary["source_size"] = db.execute_sql(
+            'SELECT COALESCE(SUM(p."size"), 0) FROM "partition"."historictaskprobe" AS p '
+            'JOIN "partition"."historictasks" AS t ON t."id" = p."historictask_id" '
+            'WHERE p."type" = \'source\' AND t."task_success"'
+        ).fetchone()[0]
+        summary["list_count"], summary["first_probe_id"], summary["last_probe_id"] = db.execute_sql(
+            'SELECT COUNT(CASE WHEN "type" = \'destination\' THEN 1 END), MIN("id"), MAX("id") '
+            'FROM "partition"."historictaskprobe"'
+        ).fetchone()
+        summary["unfinished_list_count"] = db.execute_sql(
+            'SELECT COUNT(*) FROM "partition"."historictaskprobe" AS p '
+            'JOIN "partition"."historictasks" AS t ON t."id" = p."historictask_id" '
+            'WHERE p."type" = \'destination\' AND t."finish_time" IS NULL'
+        ).fetchone()[0]
+        return summary, task_ids
+
+    @staticmethod
+    def _compact_partition_file(path):
+        # The file is only ever read from now on
+        connection = sqlite3.connect(path, isolation_level=None)
+        try:
+            connection.execute("PRAGMA journal_mode = DELETE")
+            if connection.execute(
+                'SELECT 1 FROM "sqlite_master" WHERE "name" = ?', (HistoricTaskSearch._meta.table_name,)
+            ).fetchone():
+                connection.execute(
+                    'INSERT INTO "historictasksearch" ("historictasksearch") VALUES (\'optimize\')'
+                )
+            connection.execute("ANALYZE")
+            connection.execute("VACUUM")
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _register_partition(name, month_start, month_end, summary, task_ids):
+        # Must be called inside a transaction
+        HistoricPartition.insert(name=name, month_start=month_start, month_end=month_end, **summary).execute()
+        _delete_tasks(task_ids)
+
+
+class HistoryImporter(object):
+    """
+    HistoryImporter
+
+    Runs a history import on a background thread so that the panel request that started it returns
+    straight away. Only one import runs at a time. Progress is reported through get_status().
+    """
+
+    _lock = threading.Lock()
+    _thread = None
+    _status = {
+        "state":    "idle",
+        "paths":    [],
+        "read":     0,
+        "imported": 0,
+        "skipped":  0,
+        "seconds":  0,
+    }
+
+    @classmethod
+    def get_status(cls):
+        return dict(cls._status)
+
+    @classmethod
+    def start(cls, paths):
+        """
+        Start importing the data log files matched by paths.
+        Returns False if an import is already running.
+
+        :param paths:
+        :return:
+        """
+        with cls._lock:
+            if cls._thread is not None and cls._thread.is_alive():
+                return False
+            cls._status = {
+                "state":    "importing",
+                "paths":    _expand_import_paths(paths),
+                "read":     0,
+                "imported": 0,
+                "skipped":  0,
+                "seconds":  0,
+            }
+            cls._thread = threading.Thread(
+                target=cls._run,
+                args=(list(cls._status["paths"]),),
+                name="FileSizeMetricsHistoryImporter",
+                daemon=True,
+            )
+            cls._thread.start()
+        return True
 
-        # Only show results for successful records
-        results = {
-            "source":              0,
-            "destination":         0,
-            "has_data":            False,
-            "is_assigned":         self.is_assigned_to_any_library(),
-            "empty_state_message": self.get_empty_state_message(),
-        }
-        from peewee import fn
+    @classmethod
+    def _run(cls, paths):
+        started = time.monotonic()
 
-        # Get all source files
-        source_query = HistoricTaskProbe.select(
-            fn.SUM(HistoricTaskProbe.size).alias("total")
-        )
-        source_query = source_query.where(
-            (HistoricTaskProbe.type == "source") & (HistoricTasks.task_success)
-        )
-        predicate = HistoricTaskProbe.historictask_id == HistoricTasks.id
-        source_query = source_query.join(HistoricTasks, on=predicate)
+        def report_progress(counts):
+            cls._status.update(counts)
+            cls._status["seconds"] = round(time.monotonic() - started, 1)
 
-        # Get all destination files
-        destination_query = HistoricTaskProbe.select(
-            fn.SUM(HistoricTaskProbe.size).alias("total")
-        )
-        destination_query = destination_query.where(
-            (HistoricTaskProbe.type == "destination") & (HistoricTasks.task_success)
-        )
-        predicate = HistoricTaskProbe.historictask_id == HistoricTasks.id
-        destination_query = destination_query.join(HistoricTasks, on=predicate)
+        try:
+            logger.info("Importing file size metrics history from %s", ", ".join(paths))
+            data_handler = Data()
+            counts = data_handler.import_task_results(iter_data_log_results(paths), report_progress=report_progress)
+            report_progress(counts)
+            cls._status["state"] = "complete"
+            logger.info(
+                "Imported %s of %s file size metrics records (%s already recorded) in %.1f seconds",
+                counts["imported"],
+                counts["read"],
+                counts["skipped"],
+                time.monotonic() - started,
+            )
+        except Exception:
+            logger.exception("Failed to import file size metrics history.")
+            cls._status["state"] = "failed"
 
-        for r in source_query:
-            results["source"] = int(r.total or 0)
-        for r in destination_query:
-            results["destination"] = int(r.total or 0)
 
-        results["has_data"] = bool(
-            results["source"]
-            or results["destination"]
-            or self.get_total_historic_task_list_count()
-        )
+class SourceSizeProbe(object):
+    """
+    SourceSizeProbe
 
-        self.db_stop()
-        return results
+    Reads source file sizes for emit_task_scheduled without holding up task dispatch.
+    Library files are often on network mounts, where a stat can stall for seconds. The stat runs on a
+    small thread pool and the scheduler only waits for it for a short time. If it takes longer, the size
+    that Unmanic sent in source_data is used if there is one, otherwise the postprocessor runner collects
+    the result later. Sizes are cached for a few seconds so that a file that is scheduled again straight
+    away is not read again, and the paths of a finished task are dropped from the cache because the task
+    may have replaced them. Only one stat of a path runs at a time.
+    """
 
-    def prepare_filtered_historic_tasks(self, request_dict):
-        self.db_start()
-        try:
-            draw = int(request_dict.get("draw", 1))
-            start = int(request_dict.get("start", 0))
-            length = int(request_dict.get("length", 15))
+    timeout = 2.0
+    collect_timeout = 30.0
+    cache_ttl = 10
+    max_entries = 1000
+    max_workers = 4
 
-            search = request_dict.get("search") or {}
-            search_value = search.get("value")
+    _lock = threading.Lock()
+    _executor = None
+    # abspath -> (size, expires_at)
+    _cache = collections.OrderedDict()
+    # abspath -> future of the stat that is running
+    _in_flight = {}
+    # task_id -> future of a stat that did not finish before the task was dispatched
+    _deferred = collections.OrderedDict()
 
-            filter_order = (request_dict.get("order") or [{}])[0]
-            order_direction = filter_order.get("dir", "desc")
-            columns = request_dict.get("columns") or []
-            column_index = filter_order.get("column", 2)
-            try:
-                column_index = int(column_index)
-            except Exception:
-                column_index = 2
-            order_column_name = "finish_time"
-            if 0 <= column_index < len(columns):
-                order_column_name = columns[column_index].get("name", "finish_time")
-            order = {
-                "column": order_column_name,
-                "dir":    order_direction,
-            }
+    @classmethod
+    def _stat(cls, abspath):
+        stat_result = os.stat(abspath)
+        with cls._lock:
+            cls._cache[abspath] = (stat_result.st_size, time.monotonic() + cls.cache_ttl)
+            cls._cache.move_to_end(abspath)
+            while len(cls._cache) > cls.max_entries:
+                cls._cache.popitem(last=False)
+        return stat_result.st_size
 
-            records_total_count = HistoricTasks.select().count()
-            filtered_query = self.build_historic_task_query(search_value=search_value)
-            records_filtered_count = filtered_query.count()
-            task_results = self.get_historic_task_list_filtered_and_sorted(
-                order=order,
-                start=start,
-                length=length,
-                search_value=search_value,
-            )
+    @classmethod
+    def _submit(cls, abspath):
+        with cls._lock:
+            future = cls._in_flight.get(abspath)
+            started = future is None
+            if started:
+                if cls._executor is None:
+                    cls._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=cls.max_workers,
+                        thread_name_prefix="FileSizeMetricsStat",
+                    )
+                future = cls._executor.submit(cls._stat, abspath)
+                cls._in_flight[abspath] = future
+        if started:
+            # Added outside the lock, a stat that has already finished runs the callback straight away
+            future.add_done_callback(lambda finished: cls._finish(abspath, finished))
+        return future
 
-            return_data = {
-                "draw":              draw,
-                "recordsTotal":      records_total_count,
-                "recordsFiltered":   records_filtered_count,
-                "successCount":      0,
-                "failedCount":       0,
-                "hasData":           records_total_count > 0,
-                "isAssigned":        self.is_assigned_to_any_library(),
-                "emptyStateMessage": self.get_empty_state_message(),
-                "data":              [],
-            }
+    @classmethod
+    def _finish(cls, abspath, future):
+        with cls._lock:
+            if cls._in_flight.get(abspath) is future:
+                del cls._in_flight[abspath]
 
-            for task in task_results:
-                start_time = get_unix_timestamp(task.get("start_time"))
-                finish_time = get_unix_timestamp(task.get("finish_time"))
-                item = {
-                    "id":           task.get("id"),
-                    "basename":     task.get("basename"),
-                    "abspath":      task.get("abspath"),
-                    "task_success": task.get("task_success"),
-                    "start_time":   start_time,
-                    "finish_time":  finish_time,
-                }
-                if item["task_success"]:
-                    return_data["successCount"] += 1
-                else:
-                    return_data["failedCount"] += 1
-                return_data["data"].append(item)
+    @classmethod
+    def get_cached(cls, abspath):
+        with cls._lock:
+            entry = cls._cache.get(abspath)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            return entry[0]
 
-            return return_data
-        finally:
-            self.db_stop()
+    @classmethod
+    def forget(cls, *abspaths):
+        with cls._lock:
+            for abspath in abspaths:
+                cls._cache.pop(abspath, None)
 
-    def save_source_item(self, abspath, size, start_time=None, task_success=False):
-        self.db_start()
+    @classmethod
+    def measure(cls, abspath, task_id=None, fallback_size=None):
+        """
+        Return the size of a file, waiting at most timeout seconds for the stat.
+        When the stat is slower, fallback_size is returned if it is set. Otherwise the stat is left to
+        finish in the background for collect(task_id) and None is returned.
+        Errors from the stat, like a missing file, are raised.
 
-        basename = os.path.basename(abspath)
-        task_label = basename
-        start_time = (
-            start_time
-            if start_time is not None
-            else datetime.datetime.now(datetime.timezone.utc)
-        )
-        finish_time = None
+        :param abspath:
+        :param task_id:
+        :param fallback_size:
+        :return:
+        """
+        size = cls.get_cached(abspath)
+        if size is not None:
+            return size
+        future = cls._submit(abspath)
         try:
-            new_historic_task = HistoricTasks.create(
-                task_label=task_label,
-                task_success=task_success,
-                start_time=start_time,
-                finish_time=finish_time,
-            )
-            # Create probe entry for source item
-            HistoricTaskProbe.create(
-                historictask_id=new_historic_task,
-                type="source",
-                abspath=abspath,
-                basename=basename,
-                size=size,
-            )
-            task_id = new_historic_task.id
-        except Exception:
-            task_id = None
-            logger.exception("Failed to save historic data to database.")
-        self.db_stop()
-        return task_id
+            return future.result(timeout=cls.timeout)
+        except concurrent.futures.TimeoutError:
+            pass
+        logger.warning("Reading the size of '%s' took longer than %s seconds.", abspath, cls.timeout)
+        if fallback_size is not None:
+            return int(fallback_size)
+        if task_id is not None:
+            with cls._lock:
+                cls._deferred[task_id] = future
+                while len(cls._deferred) > cls.max_entries:
+                    cls._deferred.popitem(last=False)
+        return None
 
-    def save_destination_item(self, task_id, abspath, size, finish_time):
-        self.db_start()
+    @classmethod
+    def collect(cls, task_id):
+        """
+        Return the size measured by a stat that was deferred for a task, waiting for it if it is still running.
+        Returns None if there is no deferred stat for the task or it failed.
 
-        basename = os.path.basename(abspath)
+        :param task_id:
+        :return:
+        """
+        with cls._lock:
+            future = cls._deferred.pop(task_id, None)
+        if future is None:
+            return None
         try:
-            # Create probe entry for source item
-            HistoricTaskProbe.create(
-                historictask_id=task_id,
-                type="destination",
-                abspath=abspath,
-                basename=basename,
-                size=size,
-            )
-        except Exception:
-            logger.exception("Failed to save historic data to database.")
-            self.db_stop()
-            return False
+            return future.result(timeout=cls.collect_timeout)
+        except Exception as e:
+            logger.error("Failed to read the source file size for task %s: %s", task_id, e)
+            return None
 
-        # Update the original entry
-        try:
-            historic_task, created = HistoricTasks.get_or_create(id=task_id)
-            historic_task.finish_time = finish_time
-            historic_task.task_success = True
-            historic_task.save()
-        except Exception:
-            logger.exception("Failed to save historic data to database.")
-            self.db_stop()
-            return False
 
-        self.db_stop()
-        return True
+# Write out anything still queued when Unmanic shuts down
+atexit.register(ResultWriter.stop)
 
 
 def get_historical_data(data):
@@ -526,23 +4751,50 @@ def get_historical_data(data):
         request_body = arguments.get("data", [])
         if request_body:
             request_dict = json.loads(_decode_argument(request_body))
-        data = Data()
-        results = data.prepare_filtered_historic_tasks(request_dict)
+        if not SchemaMigrator.ready():
+            results = _empty_historical_data(request_dict)
+            results["schemaUpgrading"] = True
+            results["emptyStateMessage"] = SchemaMigrator.get_upgrade_message()
+            return json.dumps(results, indent=2)
+        draw = int(request_dict.get("draw", 1))
+        version = DataVersion.get()
+        if DataVersion.matches(request_dict.get("version")):
+            return json.dumps({"draw": draw, "notModified": True, "version": version})
+        # The draw counter changes with every request, so it is not part of the cache key
+        cache_key = json.dumps(
+            {key: value for key, value in request_dict.items() if key not in ["draw", "version"]},
+            sort_keys=True,
+        )
+        results = ResponseCache.get("list", cache_key, version)
+        if results is None:
+            data = Data()
+            results = data.prepare_filtered_historic_tasks(request_dict)
+            # Without any history the reply depends on the library assignment, which is not versioned
+            if results.get("hasData"):
+                results["version"] = version
+                ResponseCache.set("list", cache_key, version, results)
+        results = dict(results, draw=draw)
     except Exception:
         logger.exception("Failed to fetch historical file size metrics data.")
-        results = {
-            "draw":              int(request_dict.get("draw", 1)),
-            "recordsTotal":      0,
-            "recordsFiltered":   0,
-            "successCount":      0,
-            "failedCount":       0,
-            "hasData":           False,
-            "isAssigned":        False,
-            "emptyStateMessage": Data.get_empty_state_message(),
-            "data":              [],
-        }
+        results = _empty_historical_data(request_dict)
+
+    # Pages can hold hundreds of rows, so skip the indentation
+    with Instrumentation.stage("json"):
+        return json.dumps(results, separators=(",", ":"))
 
-    return json.dumps(results, indent=2)
+
+def _empty_historical_data(request_dict):
+    return {
+        "draw":              int(request_dict.get("draw", 1)),
+        "recordsTotal":      0,
+        "recordsFiltered":   0,
+        "successCount":      0,
+        "failedCount":       0,
+        "hasData":           False,
+        "isAssigned":        False,
+        "emptyStateMessage": Data.get_empty_state_message(),
+        "data":              [],
+    }
 
 
 def get_historical_data_details(data):
@@ -550,7 +4802,7 @@ def get_historical_data_details(data):
     try:
         arguments = data.get("arguments") or {}
         task_id = _decode_argument(arguments.get("task_id"))
-        if task_id:
+        if task_id and SchemaMigrator.ready():
             data = Data()
             results = data.get_history_probe_data(task_id)
     except Exception:
@@ -561,28 +4813,276 @@ def get_historical_data_details(data):
 
 def get_total_size_change_data_details(data):
     try:
-        data = Data()
-        results = data.calculate_total_file_size_difference()
+        if not SchemaMigrator.ready():
+            results = _empty_total_size_change_data()
+            results["schema_upgrading"] = True
+            results["empty_state_message"] = SchemaMigrator.get_upgrade_message()
+            return json.dumps(results, indent=2)
+        arguments = data.get("arguments") or {}
+        version = DataVersion.get()
+        if DataVersion.matches(_decode_argument(arguments.get("version"))):
+            return json.dumps({"not_modified": True, "version": version}, indent=2)
+        results = ResponseCache.get("totalSizeChange", "", version)
+        if results is None:
+            data = Data()
+            results = data.calculate_total_file_size_difference()
+            # Without any history the reply depends on the library assignment, which is not versioned
+            if results.get("has_data"):
+                results["version"] = version
+                ResponseCache.set("totalSizeChange", "", version, results)
     except Exception:
         logger.exception("Failed to fetch total file size metrics data.")
+        results = _empty_total_size_change_data()
+
+    return json.dumps(results, indent=2)
+
+
+def _empty_total_size_change_data():
+    return {
+        "source":              0,
+        "destination":         0,
+        "has_data":            False,
+        "is_assigned":         False,
+        "empty_state_message": Data.get_empty_state_message(),
+    }
+
+
+def get_timeseries_data(data):
+    """
+    Return the time bucketed totals for charting.
+    Accepts the query arguments bucket ("hour" or "day"), from and to (UTC epoch seconds or ISO dates).
+    Pass the version of an earlier reply to get {"not_modified": true} if the data has not changed since.
+    """
+    arguments = data.get("arguments") or {}
+    bucket = _decode_argument(arguments.get("bucket"), "day") or "day"
+    results = {
+        "bucket": bucket,
+        "data":   [],
+    }
+    try:
+        if bucket not in ROLLUP_MODELS:
+            results["error"] = "Unsupported bucket. Use one of: {}".format(", ".join(ROLLUP_MODELS))
+            return json.dumps(results, indent=2)
+        if not SchemaMigrator.ready():
+            results["schema_upgrading"] = True
+            return json.dumps(results, indent=2)
+        from_time = get_epoch_seconds(_decode_argument(arguments.get("from")))
+        to_time = get_epoch_seconds(_decode_argument(arguments.get("to")))
+        version = DataVersion.get()
+        if to_time is None:
+            # The default range moves forward with the clock, so the reply also changes with each new bucket
+            version = "{}-{}".format(version, int(time.time()) // ROLLUP_MODELS[bucket].bucket_seconds)
+        if str(_decode_argument(arguments.get("version"))) == str(version):
+            return json.dumps({"not_modified": True, "version": version}, indent=2)
+        cache_key = json.dumps([bucket, from_time, to_time])
+        cached = ResponseCache.get("timeseries", cache_key, version)
+        if cached is not None:
+            return json.dumps(cached, indent=2)
+        data_handler = Data()
+        results = data_handler.get_timeseries(bucket=bucket, from_time=from_time, to_time=to_time)
+        results["version"] = version
+        ResponseCache.set("timeseries", cache_key, version, results)
+    except Exception:
+        logger.exception("Failed to fetch file size metrics timeseries data.")
+
+    return json.dumps(results, indent=2)
+
+
+def get_distribution_data(data):
+    """
+    Return the compression ratio, bytes saved and processing duration histograms with their p50, p90 and p99.
+    Accepts the query argument metric to return a single metric.
+    Pass the version of an earlier reply to get {"not_modified": true} if the data has not changed since.
+    """
+    arguments = data.get("arguments") or {}
+    metric = _decode_argument(arguments.get("metric"))
+    results = {}
+    try:
+        if metric and metric not in DISTRIBUTION_METRICS:
+            results["error"] = "Unsupported metric. Use one of: {}".format(", ".join(DISTRIBUTION_METRICS))
+            return json.dumps(results, indent=2)
+        if not SchemaMigrator.ready():
+            results["schema_upgrading"] = True
+            return json.dumps(results, indent=2)
+        version = DataVersion.get()
+        if DataVersion.matches(_decode_argument(arguments.get("version"))):
+            return json.dumps({"not_modified": True, "version": version}, indent=2)
+        cached = ResponseCache.get("distribution", metric or "", version)
+        if cached is not None:
+            return json.dumps(cached, indent=2)
+        data_handler = Data()
         results = {
-            "source":              0,
-            "destination":         0,
-            "has_data":            False,
-            "is_assigned":         False,
-            "empty_state_message": Data.get_empty_state_message(),
+            "metrics": data_handler.get_distribution([metric] if metric else None),
+            "version": version,
+        }
+        ResponseCache.set("distribution", metric or "", version, results)
+    except Exception:
+        logger.exception("Failed to fetch file size metrics distribution data.")
+
+    return json.dumps(results, indent=2)
+
+
+def get_breakdown_data(data):
+    """
+    Return the totals of successful tasks grouped by library and by source file extension.
+    Accepts the query argument dimension ("library" or "extension") to return a single grouping.
+    Pass the version of an earlier reply to get {"not_modified": true} if the data has not changed since.
+    """
+    arguments = data.get("arguments") or {}
+    dimension = _decode_argument(arguments.get("dimension"))
+    results = {}
+    try:
+        if dimension and dimension not in BREAKDOWN_DIMENSIONS:
+            results["error"] = "Unsupported dimension. Use one of: {}".format(", ".join(BREAKDOWN_DIMENSIONS))
+            return json.dumps(results, indent=2)
+        if not SchemaMigrator.ready():
+            results["schema_upgrading"] = True
+            return json.dumps(results, indent=2)
+        version = DataVersion.get()
+        if DataVersion.matches(_decode_argument(arguments.get("version"))):
+            return json.dumps({"not_modified": True, "version": version}, indent=2)
+        cached = ResponseCache.get("breakdown", dimension or "", version)
+        if cached is not None:
+            return json.dumps(cached, indent=2)
+        data_handler = Data()
+        results = {
+            "dimensions": data_handler.get_breakdown([dimension] if dimension else None),
+            "version":    version,
         }
+        ResponseCache.set("breakdown", dimension or "", version, results)
+    except Exception:
+        logger.exception("Failed to fetch file size metrics breakdown data.")
+
+    return json.dumps(results, indent=2)
+
+
+def get_throughput_data(data):
+    """
+    Return the processing throughput for each time bucket, for each library and overall.
+    Accepts the same query arguments as the timeseries endpoint: bucket ("hour" or "day"), from and to.
+    Pass the version of an earlier reply to get {"not_modified": true} if the data has not changed since.
+    """
+    arguments = data.get("arguments") or {}
+    bucket = _decode_argument(arguments.get("bucket"), "day") or "day"
+    results = {
+        "bucket": bucket,
+        "data":   [],
+    }
+    try:
+        if bucket not in ROLLUP_MODELS:
+            results["error"] = "Unsupported bucket. Use one of: {}".format(", ".join(ROLLUP_MODELS))
+            return json.dumps(results, indent=2)
+        if not SchemaMigrator.ready():
+            results["schema_upgrading"] = True
+            return json.dumps(results, indent=2)
+        from_time = get_epoch_seconds(_decode_argument(arguments.get("from")))
+        to_time = get_epoch_seconds(_decode_argument(arguments.get("to")))
+        version = DataVersion.get()
+        if to_time is None:
+            # The default range moves forward with the clock, so the reply also changes with each new bucket
+            version = "{}-{}".format(version, int(time.time()) // ROLLUP_MODELS[bucket].bucket_seconds)
+        if str(_decode_argument(arguments.get("version"))) == str(version):
+            return json.dumps({"not_modified": True, "version": version}, indent=2)
+        cache_key = json.dumps([bucket, from_time, to_time])
+        cached = ResponseCache.get("throughput", cache_key, version)
+        if cached is not None:
+            return json.dumps(cached, indent=2)
+        data_handler = Data()
+        results = data_handler.get_throughput(bucket=bucket, from_time=from_time, to_time=to_time)
+        results["version"] = version
+        ResponseCache.set("throughput", cache_key, version, results)
+    except Exception:
+        logger.exception("Failed to fetch file size metrics throughput data.")
+
+    return json.dumps(results, indent=2)
+
+
+def get_changes_data(data):
+    """
+    Return the /list rows added since a watermark, with the current totals, so that the panel can add
+    them to what it is already showing instead of loading everything again.
+    Accepts the query arguments:
+        since      - the last_id of the previous reply. Without it, only the current last_id is returned.
+        generation - the generation of the previous reply. The reply is a reset if the database has been
+                     replaced since.
+        version    - the version of the previous reply. If nothing has changed since, the reply is
+                     {"not_modified": true} and the database is not read.
+        wait       - seconds to wait for a change before replying "not modified", up to CHANGES_MAX_WAIT.
+                     The write path wakes the waiting request as soon as a change is committed. A waiting
+                     request holds the thread that serves it, so the bundled panel polls with wait=0.
+    """
+    arguments = data.get("arguments") or {}
+    results = {}
+    try:
+        if not SchemaMigrator.ready():
+            results["schema_upgrading"] = True
+            return json.dumps(results, indent=2)
+        since = _decode_argument(arguments.get("since"))
+        since_id = int(since) if since not in [None, ""] else None
+        wait = min(max(float(_decode_argument(arguments.get("wait"), 0) or 0), 0), CHANGES_MAX_WAIT)
+        client_version = _decode_argument(arguments.get("version"))
+        client_generation = _decode_argument(arguments.get("generation")) or None
+        if wait and DataVersion.matches(client_version):
+            with Instrumentation.stage("wait"):
+                DataVersion.wait_for_change(client_version, wait)
+        # Read the version before the rows, so that a change made in between is sent again next time
+        version = DataVersion.get()
+        if DataVersion.matches(client_version):
+            return json.dumps({"not_modified": True, "version": version, "last_id": since_id}, indent=2)
+        data_handler = Data()
+        results = data_handler.get_changes(since_id, generation=client_generation)
+        results["version"] = version
+    except ValueError:
+        results["error"] = "The since and wait arguments must be numbers."
+    except Exception:
+        logger.exception("Failed to fetch file size metrics changes.")
+
+    return json.dumps(results, separators=(",", ":"))
+
 
+def verify_total_size_change_data(data):
+    """
+    Recalculate the running totals from the raw history rows.
+    Pass verify_only=true to report differences without repairing them.
+    Returns JSON with the stored and recalculated totals.
+    """
+    arguments = data.get("arguments") or {}
+    verify_only = str(_decode_argument(arguments.get("verify_only"), "")).lower() in ["1", "true", "yes"]
+    if not SchemaMigrator.ready():
+        results = {
+            "success": False,
+            "message": SchemaMigrator.get_upgrade_message(),
+        }
+        return json.dumps(results, indent=2)
+    try:
+        data_handler = Data()
+        results = data_handler.verify_totals(repair=not verify_only)
+        results["success"] = True
+    except Exception:
+        logger.exception("Failed to verify file size metrics totals.")
+        results = {
+            "success": False,
+            "message": "Failed to verify totals.",
+        }
     return json.dumps(results, indent=2)
 
 
 def reset_all_metrics(data):
     """
-    Reset all metrics data by clearing the database.
+    Reset all metrics data by replacing the database with an empty one.
+    Pass backup=true to keep the old database file alongside the new one.
     Returns JSON with success status.
     """
+    if not SchemaMigrator.ready():
+        results = {
+            "success": False,
+            "message": SchemaMigrator.get_upgrade_message(),
+        }
+        return json.dumps(results, indent=2)
+    arguments = data.get("arguments") or {}
+    keep_backup = str(_decode_argument(arguments.get("backup"), "")).lower() in ["1", "true", "yes"]
     data_handler = Data()
-    success = data_handler.clear_all_data()
+    success = data_handler.clear_all_data(keep_backup=keep_backup)
     results = {
         "success": success,
         "message": "All metrics have been reset."
@@ -592,6 +5092,103 @@ def reset_all_metrics(data):
     return json.dumps(results, indent=2)
 
 
+def export_historical_data(data):
+    """
+    Export the full history as CSV or NDJSON.
+    Accepts the query arguments format ("csv" or "ndjson"), from and to (UTC epoch seconds or ISO dates,
+    matched against the finish time) and success ("true" or "false").
+    Returns the content type and the encoded export.
+    """
+    arguments = data.get("arguments") or {}
+    export_format = str(_decode_argument(arguments.get("format"), "csv") or "csv").lower()
+    if export_format not in EXPORT_FORMATS:
+        results = {
+            "success": False,
+            "message": "Unsupported format. Use one of: {}".format(", ".join(EXPORT_FORMATS)),
+        }
+        return "application/json", json.dumps(results, indent=2)
+    if not SchemaMigrator.ready():
+        results = {
+            "success": False,
+            "message": SchemaMigrator.get_upgrade_message(),
+        }
+        return "application/json", json.dumps(results, indent=2)
+    success = str(_decode_argument(arguments.get("success"), "")).lower()
+    success = {"1": True, "true": True, "yes": True, "0": False, "false": False, "no": False}.get(success)
+    try:
+        data_handler = Data()
+        # The panel handler writes the content in one go, so the chunks are joined here. Only the encoded
+        # export is held in memory, never the rows it was built from.
+        content = b"".join(
+            data_handler.iter_export(
+                export_format=export_format,
+                from_time=get_epoch_seconds(_decode_argument(arguments.get("from"))),
+                to_time=get_epoch_seconds(_decode_argument(arguments.get("to"))),
+                success=success,
+            )
+        )
+    except Exception:
+        logger.exception("Failed to export file size metrics data.")
+        results = {
+            "success": False,
+            "message": "Failed to export metrics.",
+        }
+        return "application/json", json.dumps(results, indent=2)
+    return EXPORT_FORMATS[export_format], content
+
+
+def import_historical_data(data):
+    """
+    Import task results from Unmanic's "file_size_metrics" data log files.
+    Pass one or more path arguments (files, directories or glob patterns on the Unmanic host) to start an
+    import. Without a path, the status of the current or last import is returned.
+    """
+    arguments = data.get("arguments") or {}
+    paths = [_decode_argument(path) for path in (arguments.get("path") or [])]
+    paths = [path for path in paths if path]
+    if not paths:
+        results = HistoryImporter.get_status()
+        results["success"] = True
+        return json.dumps(results, indent=2)
+    if not SchemaMigrator.ready():
+        results = {
+            "success": False,
+            "message": SchemaMigrator.get_upgrade_message(),
+        }
+        return json.dumps(results, indent=2)
+    if not _expand_import_paths(paths):
+        results = {
+            "success": False,
+            "message": "No files were found to import.",
+        }
+        return json.dumps(results, indent=2)
+    started = HistoryImporter.start(paths)
+    results = HistoryImporter.get_status()
+    results["success"] = started
+    if not started:
+        results["message"] = "An import is already running."
+    return json.dumps(results, indent=2)
+
+
+def get_stats_data(data):
+    """
+    Return the timings and query counts collected by Instrumentation since Unmanic started, along with
+    the state of the background writer, retention policy, partitions, importer and schema migrations.
+    """
+    results = Instrumentation.get_stats()
+    results.update(
+        {
+            "slow_query_ms": Instrumentation.get_slow_query_ms(),
+            "writer":        ResultWriter.get_stats(),
+            "retention":     RetentionManager.get_status(),
+            "partitions":    PartitionManager.get_status(),
+            "importer":      HistoryImporter.get_status(),
+            "schema":        SchemaMigrator.get_status(),
+        }
+    )
+    return json.dumps(results, indent=2)
+
+
 def _decode_argument(value, default=None):
     if value is None:
         return default
@@ -604,22 +5201,21 @@ def _decode_argument(value, default=None):
     return value
 
 
-def save_source_details(abspath, size, start_time=None):
-    # Return a list of historical tasks based on the request JSON body
-    data = Data()
-    task_id = data.save_source_item(abspath, size, start_time=start_time)
-
-    return task_id
-
+def save_task_result(result):
+    """
+    Record the source and destination of a completed task.
+    The result is written by the background writer when it is enabled, otherwise in a single transaction.
 
-def save_destination_size(task_id, abspath, size, finish_time):
-    # Return a list of historical tasks based on the request JSON body
+    :param result:
+    :return:
+    """
+    if ResultWriter.is_enabled():
+        return ResultWriter.submit(result)
     data = Data()
-    success = data.save_destination_item(task_id, abspath, size, finish_time)
-
-    return success
+    return data.save_task_results([result]) == [True]
 
 
+@Instrumentation.measured("runner.emit_task_scheduled")
 def emit_task_scheduled(data, task_data_store: type[TaskDataStore] | None = None):
     """
     Runner function - emit data when a task is scheduled for execution on a worker.
@@ -646,15 +5242,27 @@ def emit_task_scheduled(data, task_data_store: type[TaskDataStore] | None = None
         # This plugin will only run for tasks on the main installation. Remote tasks are duplicates created on remote installations.
         return
 
+    # This runner is only called for libraries that have the plugin enabled
+    LibraryAssignmentCache.set(True)
+
     # Get the path to the file
-    abspath = data.get("source_data", {})["abspath"]
-    source_size = os.path.getsize(abspath)
+    source_data = data.get("source_data", {})
+    abspath = source_data["abspath"]
+    source_size = SourceSizeProbe.measure(
+        abspath,
+        task_id=data.get("task_id"),
+        fallback_size=source_data.get("size"),
+    )
+    if source_size is None:
+        # The stat is still running. The postprocessor runner collects the size when it needs it.
+        return
 
     # Store this data in the shared state
     if task_data_store is not None:
         task_data_store.set_runner_value("source_size", source_size)
 
 
+@Instrumentation.measured("runner.on_postprocessor_task_results")
 def on_postprocessor_task_results(data, task_data_store: type[TaskDataStore] | None = None):
     """
     Runner function - provides a means for additional postprocessor functions based on the task success.
@@ -676,6 +5284,9 @@ def on_postprocessor_task_results(data, task_data_store: type[TaskDataStore] | N
     :return:
 
     """
+    # This runner is only called for libraries that have the plugin enabled
+    LibraryAssignmentCache.set(True)
+
     # Only run this for successfully processed tasks
     if not data.get("task_processing_success", False):
         logger.info("Ignoring recording task results for task as it did not succeed.")
@@ -692,12 +5303,12 @@ def on_postprocessor_task_results(data, task_data_store: type[TaskDataStore] | N
     if not unix_start_time:
         logger.error("The 'start_time' is missing the data.")
         return
-    start_time = datetime.datetime.fromtimestamp(unix_start_time, tz=datetime.timezone.utc)
+    start_time = int(unix_start_time)
     unix_finish_time = data.get("finish_time")
     if not unix_finish_time:
         logger.error("The 'finish_time' is missing the data.")
         return
-    finish_time = datetime.datetime.fromtimestamp(unix_finish_time, tz=datetime.timezone.utc)
+    finish_time = int(unix_finish_time)
 
     # Read source_size from data store
     if task_data_store is None:
@@ -705,24 +5316,31 @@ def on_postprocessor_task_results(data, task_data_store: type[TaskDataStore] | N
         return
 
     source_size = task_data_store.get_runner_value("source_size", runner="emit_task_scheduled")
+    if source_size is None:
+        # The stat may have been too slow to finish while the task was scheduled
+        source_size = SourceSizeProbe.collect(data.get("task_id"))
     if source_size is None:
         # Something is going wrong here. The data is no longer in the store.
         logger.error("The 'source_size' is missing from the task data store.")
+        return
 
     # For each of the destination files, write a file size metric entry
-    dest_abspath = None
-    dest_size = None
+    destinations = []
     for dest_file in data.get("destination_files", []):
         dest_abspath = os.path.abspath(dest_file)
         # Add a destination file entry if the file actually exists
         if os.path.exists(dest_abspath):
-            dest_size = os.path.getsize(dest_abspath)
+            destinations.append({"abspath": dest_abspath, "size": os.path.getsize(dest_abspath)})
         else:
             logger.info("Skipping file '{}' as it does not exist.".format(dest_abspath))
 
-    if dest_abspath is None or dest_size is None:
+    if not destinations:
         logger.error("Failed to get the file size of the destination file.")
         return
+    # The task may have written over its source, the file is read again if it is scheduled
+    SourceSizeProbe.forget(original_source_path, *[destination["abspath"] for destination in destinations])
+    dest_abspath = destinations[0]["abspath"]
+    dest_size = sum(destination["size"] for destination in destinations)
 
     size_difference = dest_size - source_size
     processing_duration = unix_finish_time - unix_start_time
@@ -734,6 +5352,7 @@ def on_postprocessor_task_results(data, task_data_store: type[TaskDataStore] | N
         data_search_key=data_search_key,
         source_abspath=original_source_path,
         dest_abspath=dest_abspath,
+        destination_files=destinations,
         source_size=source_size,
         dest_size=dest_size,
         size_difference=size_difference,
@@ -742,13 +5361,97 @@ def on_postprocessor_task_results(data, task_data_store: type[TaskDataStore] | N
         processing_duration=processing_duration,
     )
 
-    task_id = save_source_details(original_source_path, source_size, start_time)
-    if task_id is None:
-        logger.error("Failed to create source size entry for this file")
-    save_destination_size(task_id, dest_abspath, dest_size, finish_time)
+    saved = save_task_result(
+        {
+            "source_abspath": original_source_path,
+            "source_size":    source_size,
+            "library_id":     data.get("library_id"),
+            "start_time":     start_time,
+            "destinations":   destinations,
+            "finish_time":    finish_time,
+        }
+    )
+    if not saved:
+        logger.error("Failed to record the file size metrics for this file")
+
+
+class PanelPage(object):
+    """
+    PanelPage
+
+    The panel HTML, built once per process.
+    Every static asset URL in the template is given a hash of the asset's content as its cache buster, so
+    the URLs only change when an asset changes, normally with a new plugin version. Browsers can then keep
+    the assets between visits instead of downloading them again each time the panel is opened.
+    """
+
+    static_directory = os.path.abspath(os.path.join(os.path.dirname(__file__), "static"))
+
+    _lock = threading.Lock()
+    _content = None
+
+    @classmethod
+    def get(cls):
+        if cls._content is None:
+            with cls._lock:
+                if cls._content is None:
+                    cls._content = cls._build()
+        return cls._content
+
+    @staticmethod
+    def _content_hash(content):
+        return hashlib.sha256(content).hexdigest()[:12]
+
+    @classmethod
+    def _build(cls):
+        with open(os.path.join(cls.static_directory, "index.html"), "rb") as f:
+            template = f.read()
+        # Used for any asset that cannot be read
+        template_hash = cls._content_hash(template)
+
+        def versioned_url(match):
+            asset_path = os.path.normpath(os.path.join(cls.static_directory, match.group(1)))
+            asset_hash = template_hash
+            if asset_path.startswith(cls.static_directory + os.sep):
+                try:
+                    with open(asset_path, "rb") as asset:
+                        asset_hash = cls._content_hash(asset.read())
+                except OSError:
+                    logger.warning("Unable to read panel asset '%s' to version it.", asset_path)
+            # Tornado's static file handler lets browsers cache URLs with a "v" argument for a long time
+            return "./static/{}?v={}".format(match.group(1), asset_hash)
+
+        content = re.sub(r"\./static/([^\"'?\s]+)\?\{cache_buster\}", versioned_url, template.decode("utf-8"))
+        return content.replace("{cache_buster}", template_hash)
+
+
+# Paths that are measured as their own operation. Everything else serves the panel page.
+PANEL_OPERATIONS = (
+    "list",
+    "conversionDetails",
+    "totalSizeChange",
+    "timeseries",
+    "distribution",
+    "breakdown",
+    "throughput",
+    "changes",
+    "verifyTotals",
+    "export",
+    "importHistory",
+    "resetMetrics",
+    "stats",
+)
 
 
 def render_frontend_panel(data):
+    operation = str(data.get("path") or "").strip("/")
+    if operation not in PANEL_OPERATIONS:
+        operation = "index"
+    with Instrumentation.measure("panel.{}".format(operation)):
+        return _render_frontend_panel(data)
+
+
+def _render_frontend_panel(data):
     if data.get("path") in ["list", "/list", "/list/"]:
         data["content_type"] = "application/json"
         data["content"] = get_historical_data(data)
@@ -768,15 +5471,55 @@ def render_frontend_panel(data):
         data["content"] = get_total_size_change_data_details(data)
         return
 
+    if data.get("path") in ["timeseries", "/timeseries", "/timeseries/"]:
+        data["content_type"] = "application/json"
+        data["content"] = get_timeseries_data(data)
+        return
+
+    if data.get("path") in ["distribution", "/distribution", "/distribution/"]:
+        data["content_type"] = "application/json"
+        data["content"] = get_distribution_data(data)
+        return
+
+    if data.get("path") in ["breakdown", "/breakdown", "/breakdown/"]:
+        data["content_type"] = "application/json"
+        data["content"] = get_breakdown_data(data)
+        return
+
+    if data.get("path") in ["throughput", "/throughput", "/throughput/"]:
+        data["content_type"] = "application/json"
+        data["content"] = get_throughput_data(data)
+        return
+
+    if data.get("path") in ["changes", "/changes", "/changes/"]:
+        data["content_type"] = "application/json"
+        data["content"] = get_changes_data(data)
+        return
+
+    if data.get("path") in ["verifyTotals", "/verifyTotals", "/verifyTotals/"]:
+        data["content_type"] = "application/json"
+        data["content"] = verify_total_size_change_data(data)
+        return
+
+    if data.get("path") in ["export", "/export", "/export/"]:
+        data["content_type"], data["content"] = export_historical_data(data)
+        return
+
+    if data.get("path") in ["importHistory", "/importHistory", "/importHistory/"]:
+        data["content_type"] = "application/json"
+        data["content"] = import_historical_data(data)
+        return
+
     if data.get("path") in ["resetMetrics", "/resetMetrics", "/resetMetrics/"]:
         data["content_type"] = "application/json"
         data["content"] = reset_all_metrics(data)
         return
 
-    with open(
-        os.path.abspath(os.path.join(os.path.dirname(__file__), "static", "index.html"))
-    ) as f:
-        content = f.read()
-        data["content"] = content.replace("{cache_buster}", str(uuid.uuid4()))
+    if data.get("path") in ["stats", "/stats", "/stats/"]:
+        data["content_type"] = "application/json"
+        data["content"] = get_stats_data(data)
+        return
+
+    data["content"] = PanelPage.get()
 
     return data
@@ -0,0 +1,87 @@
+// Polls the server for the rows recorded since the last poll. Each reply carries the watermark and data
+// version for the next poll, so a poll with nothing new is answered "not modified" without reading the
+// database. Subscribers are passed every reply that has new data, with the version it follows on from
+// as sinceVersion.
+const LiveChanges = (function () {
+  const pollInterval = 5000;
+  const subscribers = [];
+  const state = {
+    lastId: undefined,
+    // The watermark only holds for the database it was read from. The server resets it when this changes.
+    generation: undefined,
+    version: undefined,
+    // Set while a reply that was cut short is being continued. The rest of its rows share its version.
+    continuing: false,
+    timer: null,
+  };
+
+  const schedule = (delay) => {
+    clearTimeout(state.timer);
+    state.timer = setTimeout(poll, delay);
+  };
+
+  const notify = (json) => {
+    subscribers.forEach((subscriber) => {
+      try {
+        subscriber(json);
+      } catch (e) {
+        // One broken view should not stop the others from updating
+      }
+    });
+  };
+
+  const poll = () => {
+    // Hidden tabs catch up with a single poll when they are shown again
+    if (document.hidden) {
+      schedule(pollInterval);
+      return;
+    }
+
+    const request = { wait: 0 };
+    if (state.lastId !== undefined) {
+      request.since = state.lastId;
+      if (state.generation !== undefined) {
+        request.generation = state.generation;
+      }
+    }
+    if (state.version !== undefined && !state.continuing) {
+      request.version = state.version;
+    }
+
+    jQuery
+      .get("changes/", request)
+      .done((json) => {
+        if (!json || json.schema_upgrading === true || json.error) {
+          schedule(pollInterval);
+          return;
+        }
+        const firstPoll = state.lastId === undefined;
+        if (json.not_modified !== true) {
+          const sinceVersion = state.version;
+          state.lastId = json.last_id;
+          state.generation = json.generation;
+          state.version = json.version;
+          if (!firstPoll) {
+            notify({ ...json, sinceVersion: sinceVersion });
+          }
+        }
+        // Carry straight on when the reply was cut short
+        state.continuing = json.more === true;
+        schedule(state.continuing ? 0 : pollInterval);
+      })
+      .fail(() => {
+        schedule(pollInterval);
+      });
+  };
+
+  return {
+    subscribe: (subscriber) => {
+      subscribers.push(subscriber);
+    },
+    start: () => {
+      if (state.timer === null) {
+        poll();
+      }
+    },
+  };
+})();
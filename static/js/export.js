@@ -0,0 +1,21 @@
+const ExportHistory = (function () {
+  const formatSelect = document.getElementById("export-format");
+  const exportBtn = document.getElementById("export-history-btn");
+
+  const updateExportLink = () => {
+    const format = formatSelect.value;
+    exportBtn.setAttribute("href", "export/?format=" + encodeURIComponent(format));
+    exportBtn.setAttribute("download", "file_size_metrics." + format);
+  };
+
+  const bindEvents = () => {
+    formatSelect.addEventListener("change", updateExportLink);
+  };
+
+  return {
+    init: () => {
+      updateExportLink();
+      bindEvents();
+    },
+  };
+})();
@@ -124,6 +124,32 @@ const CompletedTasksFileSizeDiffChart = (function () {
     },
   });
 
+  const timeseriesChart = new Highcharts.Chart({
+    chart: {
+      renderTo: "timeseries_size_chart",
+      type: "column",
+    },
+    subtitle: {
+      text: "Total file size before and after processing for tasks finished in each period",
+    },
+    legend: {
+      enabled: true,
+      itemStyle: {
+        color: text_colour,
+      },
+    },
+    xAxis: {
+      type: "datetime",
+    },
+    yAxis: {
+      labels: {
+        formatter: function () {
+          return formatBytes(this.value);
+        },
+      },
+    },
+  });
+
   const updateIndividualChart = function () {
     // If the destination file size is greater than the source, then mark it
     // negative, otherwise positive
@@ -260,6 +286,71 @@ const CompletedTasksFileSizeDiffChart = (function () {
     totalChart.redraw();
   };
 
+  const updateTimeseriesChart = function (data) {
+    const buckets = (data && data.data) || [];
+    const sourceData = [];
+    const destinationData = [];
+    const taskCounts = {};
+
+    buckets.forEach((bucket) => {
+      const timestamp = Number(bucket.bucket_start) * 1000;
+      sourceData.push([timestamp, Number(bucket.source || 0)]);
+      destinationData.push([timestamp, Number(bucket.destination || 0)]);
+      taskCounts[timestamp] = Number(bucket.task_count || 0);
+    });
+
+    timeseriesChart.update(
+      {
+        title: {
+          text: buckets.length ? "" : "No tasks finished in this period",
+        },
+        colors: [default_bar_colour, positive_bar_colour],
+        tooltip: {
+          shared: true,
+          formatter: function () {
+            const rows = this.points.map(
+              (point) =>
+                `${point.series.name}: <strong>${formatBytes(point.y)}</strong>`,
+            );
+            return `<strong>${Highcharts.dateFormat("%Y-%m-%d %H:%M", this.x)}</strong>
+              <br>
+              Tasks: ${taskCounts[this.x] || 0}
+              <br>
+              ${rows.join("<br>")}`;
+          },
+        },
+      },
+      false,
+    );
+
+    for (let i = timeseriesChart.series.length - 1; i >= 0; i--) {
+      timeseriesChart.series[i].remove(false);
+    }
+
+    timeseriesChart.addSeries(
+      { borderWidth: 0, name: "Before", data: sourceData },
+      false,
+    );
+    timeseriesChart.addSeries(
+      { borderWidth: 0, name: "After", data: destinationData },
+      false,
+    );
+    timeseriesChart.redraw();
+  };
+
+  const fetchTimeseries = function () {
+    const bucket = $("#timeseries-bucket").val() || "day";
+
+    VersionedResponses.get("timeseries/", { bucket: bucket }).done(function (data) {
+      if (data && data.schema_upgrading === true) {
+        setTimeout(fetchTimeseries, 5000);
+        return;
+      }
+
+      updateTimeseriesChart(data);
+    });
+  };
+
   const fetchConversionDetails = function (taskId) {
     jQuery.get(`conversionDetails/?task_id=${taskId}`, function (data) {
       // Update/set the conversion details list
@@ -307,8 +398,8 @@ const CompletedTasksFileSizeDiffChart = (function () {
   };
 
   const fetchTotalFileSizeDetails = function () {
-    jQuery
-      .get("totalSizeChange", function (data) {
+    VersionedResponses.get("totalSizeChange")
+      .done(function (data) {
         source_total_size = Number(data.source || 0);
         destination_total_size = Number(data.destination || 0);
 
@@ -326,9 +417,14 @@ const CompletedTasksFileSizeDiffChart = (function () {
                 ? data.is_assigned
                 : undefined,
             message: data.empty_state_message,
+            upgrading: data.schema_upgrading === true,
           });
         }
 
+        if (data.schema_upgrading === true) {
+          setTimeout(fetchTotalFileSizeDetails, 5000);
+        }
+
         const hasTotalData =
           typeof data.has_data === "boolean"
             ? data.has_data
@@ -386,11 +482,27 @@ const CompletedTasksFileSizeDiffChart = (function () {
       .triggerHandler("change");
   };
 
+  // New tasks only add to the totals, so the chart is updated from the /changes reply
+  LiveChanges.subscribe(function (changes) {
+    const totals = changes.totals || {};
+    if (changes.reset === true || (!source_total_size && !destination_total_size)) {
+      fetchTotalFileSizeDetails();
+    } else {
+      source_total_size = Number(totals.source_size || 0);
+      destination_total_size = Number(totals.destination_size || 0);
+      updateTotalChart();
+    }
+    fetchTimeseries();
+  });
+
   return {
     //main function to initiate the module
     init: function () {
       watch();
       fetchTotalFileSizeDetails();
+
+      $("#timeseries-bucket").off("change").on("change", fetchTimeseries);
+      fetchTimeseries();
     },
   };
 })();
@@ -3,6 +3,7 @@ const ResetMetrics = (function () {
   const resetBtn = document.getElementById("reset-metrics-btn");
   const cancelBtn = document.getElementById("reset-cancel-btn");
   const confirmBtn = document.getElementById("reset-confirm-btn");
+  const backupCheckbox = document.getElementById("reset-backup-checkbox");
 
   const showResetDialog = () => {
     resetDialog.showModal();
@@ -22,6 +23,9 @@ const ResetMetrics = (function () {
         url: "resetMetrics/",
         method: "GET",
         dataType: "json",
+        data: {
+          backup: backupCheckbox.checked ? "true" : "false",
+        },
       })
       .done(function (data) {
         hideResetDialog();
@@ -34,7 +34,14 @@ const formatLocalDateTime = (timestamp) => {
   return `${lookup.year}-${lookup.month}-${lookup.day} ${lookup.hour}:${lookup.minute}:${lookup.second}`;
 };
 
-const setMetricsPanelState = ({ hasData, isAssigned, message } = {}) => {
+const schemaUpgradeRetryDelay = 5000;
+
+const setMetricsPanelState = ({
+  hasData,
+  isAssigned,
+  message,
+  upgrading,
+} = {}) => {
   const notice = document.getElementById("panelNotice");
   const noticeTitle = document.getElementById("panelNoticeTitle");
   const noticeMessage = document.getElementById("panelNoticeMessage");
@@ -44,6 +51,15 @@ const setMetricsPanelState = ({ hasData, isAssigned, message } = {}) => {
     return;
   }
 
+  if (upgrading === true) {
+    notice.classList.remove("notice-banner-warning");
+    notice.classList.add("notice-banner-neutral");
+    noticeTitle.textContent = "Upgrading the metrics database";
+    noticeMessage.textContent = message || "";
+    noticeLink.classList.add("hidden");
+    return;
+  }
+
   if (typeof hasData === "boolean") {
     panelState.hasData = panelState.hasData || hasData;
   }
@@ -84,14 +100,160 @@ const CompletedTasksDatatable = (function () {
     return `<span class="q-badge failed"></span> <span class="name" title="View Details">${basename}</span>`;
   };
 
+  // Cursors returned with the last page. They are only reused when the next request asks for the page
+  // directly before or after it with the same sort order, search and page length.
+  const pageState = {
+    current: null,
+    pending: null,
+    lastRequest: null,
+  };
+
+  // Key of the stored reply for a request. The draw counter changes with every request, and a cursor
+  // only changes how the server finds the page, not the page itself.
+  const buildResponseKey = (request) => {
+    const { draw, version, cursor, cursorDirection, ...rest } = request;
+    return "list?" + JSON.stringify(rest);
+  };
+
+  const buildPageKey = (data) => {
+    return JSON.stringify({
+      order: data.order,
+      search: data.search?.value || "",
+      length: data.length,
+    });
+  };
+
+  // Rows are requested column by column, which keeps large pages small, and rebuilt here
+  const rowsFromColumns = (columns) => {
+    const names = Object.keys(columns);
+    const count = names.length ? columns[names[0]].length : 0;
+    const rows = new Array(count);
+    for (let i = 0; i < count; i++) {
+      const row = {};
+      for (const name of names) {
+        row[name] = columns[name][i];
+      }
+      rows[i] = row;
+    }
+    return rows;
+  };
+
+  const addPageCursor = (data) => {
+    const request = { ...data, dataFormat: "columns" };
+    const current = pageState.current;
+    pageState.lastRequest = request;
+
+    const version = VersionedResponses.versionFor(buildResponseKey(request));
+    if (version !== undefined) {
+      request.version = version;
+    }
+
+    pageState.pending = {
+      key: buildPageKey(data),
+      start: data.start,
+    };
+
+    if (!current || current.key !== pageState.pending.key || data.start <= 0) {
+      return request;
+    }
+
+    if (data.start === current.start + data.length && current.nextCursor) {
+      request.cursor = current.nextCursor;
+      request.cursorDirection = "next";
+    } else if (data.start === current.start - data.length && current.prevCursor) {
+      request.cursor = current.prevCursor;
+      request.cursorDirection = "prev";
+    }
+
+    return request;
+  };
+
+  // The server's order for the newest tasks first
+  const compareNewestFirst = (a, b) =>
+    b.finish_time - a.finish_time || b.id - a.id;
+
+  // Add the rows from a /changes reply to the stored copy of the page being shown, then redraw it. The
+  // server answers the redraw "not modified" and the merged copy is shown without running the list queries.
+  // Only the first page of the newest tasks is merged. Other pages and searches keep what they show until
+  // they are refreshed.
+  const mergeChanges = (changes) => {
+    const table = $("#history_completed_tasks_table").DataTable();
+    const request = pageState.lastRequest;
+    if (!request || changes.reset === true) {
+      table.ajax.reload();
+      return;
+    }
+
+    const order = (request.order || [])[0] || {};
+    const orderName = ((request.columns || [])[order.column] || {}).name;
+    const newestFirst =
+      request.start === 0 &&
+      !request.search?.value &&
+      orderName === "finish_time" &&
+      order.dir === "desc";
+    const key = buildResponseKey(request);
+    const stored = VersionedResponses.stored(key);
+
+    if (!stored || !stored.columns || stored.version !== changes.sinceVersion) {
+      // The page was built from an older version than the changes follow on from
+      table.draw(false);
+      return;
+    }
+    if (!newestFirst) {
+      return;
+    }
+
+    const seen = new Set();
+    const rows = rowsFromColumns(stored.columns)
+      .concat(rowsFromColumns(changes.columns))
+      .sort(compareNewestFirst)
+      .filter((row) => !seen.has(row.id) && seen.add(row.id))
+      .slice(0, request.length);
+    const columns = {};
+    Object.keys(stored.columns).forEach((name) => {
+      columns[name] = rows.map((row) => row[name]);
+    });
+    const successCount = rows.filter((row) => row.task_success).length;
+
+    VersionedResponses.resolve(key, {
+      ...stored,
+      columns: columns,
+      recordsTotal: changes.recordsTotal,
+      // Tasks can have more than one destination row, so the page counts rows rather than tasks
+      recordsFiltered: changes.recordsFiltered,
+      successCount: successCount,
+      failedCount: rows.length - successCount,
+      hasData: changes.recordsTotal > 0,
+      // The cursors pointed at the old first and last rows
+      nextCursor: null,
+      prevCursor: null,
+      version: changes.version,
+    });
+    table.draw(false);
+  };
+
   const buildTable = () => {
     const table = $("#history_completed_tasks_table").DataTable({
       autoWidth: false,
       processing: true,
       serverSide: true,
+      searchDelay: 250,
       ajax: {
         url: "list/", // ajax source
         type: "GET", // request type
+        // Swap a "not modified" reply for the stored copy before DataTables reads it. The key is rebuilt
+        // from the URL of this request, in case an earlier request is still in flight.
+        dataFilter: function (response) {
+          try {
+            const params = new URLSearchParams(this.url.split("?")[1] || "");
+            const key = buildResponseKey(JSON.parse(params.get("data")));
+            return JSON.stringify(
+              VersionedResponses.resolve(key, JSON.parse(response)),
+            );
+          } catch (e) {
+            return response;
+          }
+        },
         dataSrc: (json) => {
           setMetricsPanelState({
             hasData:
@@ -103,12 +265,28 @@ const CompletedTasksDatatable = (function () {
                 ? json.isAssigned
                 : undefined,
             message: json?.emptyStateMessage,
+            upgrading: json?.schemaUpgrading === true,
           });
+          if (json?.schemaUpgrading === true) {
+            setTimeout(() => {
+              $("#history_completed_tasks_table").DataTable().ajax.reload();
+            }, schemaUpgradeRetryDelay);
+          }
+          if (pageState.pending) {
+            pageState.current = {
+              ...pageState.pending,
+              nextCursor: json?.nextCursor || null,
+              prevCursor: json?.prevCursor || null,
+            };
+          }
+          if (json?.columns) {
+            return rowsFromColumns(json.columns);
+          }
           return json?.data || [];
         },
         data: (data) => {
           return {
-            data: JSON.stringify(data),
+            data: JSON.stringify(addPageCursor(data)),
           };
         },
         error: () => {
@@ -186,6 +364,7 @@ const CompletedTasksDatatable = (function () {
     //main function to initiate the module
     init: () => {
       buildTable();
+      LiveChanges.subscribe(mergeChanges);
     },
   };
 })();
@@ -0,0 +1,60 @@
+// Keeps the last reply of each panel request for the browser session. The data version of the reply is
+// sent with the next identical request, and the server answers with a short "not modified" reply when
+// nothing has been recorded since. The stored reply is then used again.
+const VersionedResponses = (function () {
+  const storagePrefix = "fileSizeMetrics:";
+
+  const read = (key) => {
+    try {
+      const stored = sessionStorage.getItem(storagePrefix + key);
+      return stored ? JSON.parse(stored) : null;
+    } catch (e) {
+      return null;
+    }
+  };
+
+  const write = (key, json) => {
+    try {
+      sessionStorage.setItem(storagePrefix + key, JSON.stringify(json));
+    } catch (e) {
+      // Storage is full or disabled. The next request fetches the full reply again.
+    }
+  };
+
+  // The version to send with a request, if an earlier reply is stored
+  const versionFor = (key) => {
+    const stored = read(key);
+    return stored && stored.version !== undefined ? stored.version : undefined;
+  };
+
+  // Return the full reply for a response, storing it if it is versioned
+  const resolve = (key, json) => {
+    if (json && (json.notModified === true || json.not_modified === true)) {
+      const stored = read(key);
+      if (stored) {
+        return json.draw !== undefined ? { ...stored, draw: json.draw } : stored;
+      }
+    }
+    if (json && json.version !== undefined) {
+      write(key, json);
+    }
+    return json;
+  };
+
+  const get = (url, params) => {
+    const key = url + "?" + JSON.stringify(params || {});
+    const request = { ...(params || {}) };
+    const version = versionFor(key);
+    if (version !== undefined) {
+      request.version = version;
+    }
+    return jQuery.get(url, request).then((json) => resolve(key, json));
+  };
+
+  return {
+    versionFor: versionFor,
+    stored: read,
+    resolve: resolve,
+    get: get,
+  };
+})();